@@ -0,0 +1,59 @@
+"""
+band powers of the newest epoch at hour 1, 4 and 8 of a night: YasaClassifier.get_bandpower_per_epoch() over the whole
+recording (as simulate_scoring_in_live did) vs. IncrementalBandpower. Also compares the band powers of all epochs and
+the theta/delta ratios of both. Uses synthetic eeg, run from the Drec directory:
+
+    python -m benchmarks.bench_bandpower_cache [hours]
+"""
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.synthetic_eeg import synthetic_night
+from scripts.Utils.IncrementalBandpower import IncrementalBandpower
+from scripts.Utils.yasa_functions import YasaClassifier
+
+SAMPLE_RATE = 256
+EPOCH_LEN = 30 * SAMPLE_RATE
+EPOCHS_PER_HOUR = 120
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+    eeg = synthetic_night(hours, n_channels=2)[0]
+    n_epochs = eeg.shape[1] // EPOCH_LEN
+
+    cache = IncrementalBandpower(2, SAMPLE_RATE)
+    latency = []
+    for i in range(n_epochs):
+        start = time.perf_counter()
+        cache.add_epoch(eeg[:, i * EPOCH_LEN:(i + 1) * EPOCH_LEN])
+        cache.ratio('Theta', 'Delta')
+        latency.append(time.perf_counter() - start)
+
+    print('latency of the band powers of the newest epoch')
+    for hour in (1, 4, 8):
+        epoch = hour * EPOCHS_PER_HOUR
+        if epoch > n_epochs:
+            continue
+        raw = YasaClassifier.to_raw(eeg[:, :epoch * EPOCH_LEN], ['eegl', 'eegr'], SAMPLE_RATE)
+        start = time.perf_counter()
+        YasaClassifier.get_bandpower_per_epoch(raw)
+        full = time.perf_counter() - start
+        print(f'  hour {hour}: whole recording {1000 * full:7.1f} ms   incremental {1000 * latency[epoch - 1]:5.2f} ms')
+    print(f'incremental over the night: median {1000 * np.median(latency):.2f} ms, max {1000 * np.max(latency):.2f} ms')
+    print(f'cached psds: {cache.psd.shape} (epochs, channels, freqs), {cache.psd.nbytes / 1024 ** 2:.1f} MiB')
+
+    raw = YasaClassifier.to_raw(eeg[:, :n_epochs * EPOCH_LEN], ['eegl', 'eegr'], SAMPLE_RATE)
+    bandpower, _ = YasaClassifier.get_bandpower_per_epoch(raw)
+    ratio = (bandpower[1, :, 0] + bandpower[1, :, 1]) / 2 / ((bandpower[0, :, 0] + bandpower[0, :, 1]) / 2)
+    print(f'largest difference of the band powers: {np.abs(cache.bandpower() - bandpower).max():.2e}')
+    print(f'theta/delta > 0.22 the same for {np.sum((ratio > 0.22) == (cache.ratio("Theta", "Delta", None) > 0.22))} '
+          f'of {n_epochs} epochs')
+    eeg_bands = cache.bandpower(YasaClassifier.eeg_bands)
+    print(f'band powers of YasaClassifier.eeg_bands from the cached psds: {eeg_bands.shape} [band, epoch, channel]')
+
+
+if __name__ == '__main__':
+    main()
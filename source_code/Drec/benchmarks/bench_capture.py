@@ -0,0 +1,81 @@
+"""
+replays captured loopback traffic through the scapy based TcpSniffSocket and the RawSniffSocket, checks that both
+deliver the same bytes and compares the cpu time per packet. Run from the Drec directory:
+
+    python -m benchmarks.bench_capture [recording.pcap]
+
+Without a pcap file (captured on the linux loopback interface, e.g. 'tcpdump -i lo -w recording.pcap tcp port 8000')
+a synthetic session with the HDServer is replayed.
+"""
+import socket
+import struct
+import sys
+import time
+
+from scapy.layers.l2 import Ether
+from scapy.utils import RawPcapReader
+
+from benchmarks.bench_decode import make_lines
+from scripts.Connection.RawSniffSocket import RawSniffSocket
+from scripts.Connection.TcpSniffSocket import TcpSniffSocket
+from scripts.Utils.TCP_Packet import SYN, ACK
+
+CLIENT = ('127.0.0.1', 50123)
+SERVER = ('127.0.0.1', 8000)
+PSH = 0x08
+
+
+def make_frame(src, dst, seq, ack, flags, payload=b''):
+    tcp = struct.pack('!HHLLBBHHH', src[1], dst[1], seq, ack, 5 << 4, flags, 65535, 0, 0)
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp) + len(payload), 0, 0x4000, 64, socket.IPPROTO_TCP, 0,
+                     socket.inet_aton(src[0]), socket.inet_aton(dst[0]))
+    eth = b'\x00' * 12 + b'\x08\x00'
+    return eth + ip + tcp + payload
+
+
+def synthetic_session(n_samples=256 * 60, samples_per_segment=4):
+    """client SYN, server SYN-ACK and the data stream of the server with the ACKs of the client"""
+    client_seq, server_seq = 1000, 2**32 - 100_000  # let the server sequence numbers wrap around
+    frames = [make_frame(CLIENT, SERVER, client_seq, 0, SYN),
+              make_frame(SERVER, CLIENT, server_seq, client_seq + 1, SYN | ACK)]
+    server_seq += 1
+    lines = [line.encode() + b'\n' for line in make_lines(n_samples)]
+    for i in range(0, len(lines), samples_per_segment):
+        payload = b''.join(lines[i:i + samples_per_segment])
+        frames.append(make_frame(SERVER, CLIENT, server_seq % 2**32, client_seq + 1, PSH | ACK, payload))
+        server_seq += len(payload)
+        frames.append(make_frame(CLIENT, SERVER, client_seq + 1, server_seq % 2**32, ACK))
+    return frames
+
+
+def drain(queue):
+    data = []
+    while not queue.empty():
+        data.append(queue.get())
+    return b''.join(data)
+
+
+def main(frames):
+    scapy_sock = TcpSniffSocket()
+    start = time.process_time()
+    for frame in frames:
+        scapy_sock._sniffer_callback(Ether(frame))  # scapy sniff() dissects every packet before the callback
+    scapy_time = time.process_time() - start
+
+    raw_sock = RawSniffSocket()
+    start = time.process_time()
+    for frame in frames:
+        raw_sock.process_frame(frame)
+    raw_time = time.process_time() - start
+
+    scapy_data, raw_data = drain(scapy_sock.data_queue), drain(raw_sock.data_queue)
+    print(f'{len(frames)} packets, {len(raw_data)} bytes delivered, identical output: {scapy_data == raw_data}')
+    print(f'  scapy: {scapy_time / len(frames) * 1e6:8.2f} us cpu per packet')
+    print(f'  raw:   {raw_time / len(frames) * 1e6:8.2f} us cpu per packet ({scapy_time / raw_time:.1f}x less)')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main([bytes(frame) for frame, _ in RawPcapReader(sys.argv[1])])
+    else:
+        main(synthetic_session())
@@ -0,0 +1,110 @@
+"""
+micro-benchmark of the decoding of HDServer data packets: the parsing of ZmaxHeadband.read before the batch decoding
+(all 17 channels of every line, copied to original_read()), per line decoding of the requested channels only
+(ZmaxHeadband.decode_line) and batch decoding (ZmaxHeadband.decode_lines). The speedup is relative to the original
+parsing. Run from the Drec directory:
+
+    python -m benchmarks.bench_decode
+"""
+import time
+
+import numpy as np
+
+from scripts.Connection.ZmaxHeadband import ZmaxHeadband
+
+
+class ReplaySocket:
+    """stands in for TcpSniffSocket and returns the same chunk of lines on every read"""
+    def __init__(self, chunk):
+        self.chunk = chunk
+
+    def read_one_line(self):
+        return self.chunk
+
+    def stop(self):
+        pass
+
+
+def make_lines(n_samples, seed=0):
+    """random but well formed data packets as sent by the HDServer"""
+    rng = np.random.default_rng(seed)
+    packets = rng.integers(0, 256, size=(n_samples, 40))
+    packets[:, 0] = 6  # packet type
+    return ['D.' + '-'.join(f'{b:02X}' for b in packet) + '\r' for packet in packets]
+
+
+def original_read(hb, buf, reqIDs):
+    """the parsing of ZmaxHeadband.read before the batch decoding, every channel of every line is decoded"""
+    reqVals = []
+    for line in buf.split('\n'):
+        if str.startswith(line, 'DEBUG'):  # ignore debugging messages from server
+            pass
+        else:
+            if str.startswith(line, 'D'):  # only process data packets
+                p = line.split('.')
+
+                if len(p) == 2:
+                    line = p[1]
+                    packet_type = hb.getbyteat(line, 0)
+                    if (packet_type >= 1) and (packet_type <= 11):  # packet type within correct range
+                        if len(line) == 120:
+                            eegr = hb.getwordat(line, 1)
+                            eegl = hb.getwordat(line, 3)
+                            dx = hb.getwordat(line, 5)
+                            dy = hb.getwordat(line, 7)
+                            dz = hb.getwordat(line, 9)
+                            oxy_ir_ac = hb.getwordat(line, 27)
+                            oxy_r_ac = hb.getwordat(line, 25)
+                            oxy_dark_ac = hb.getwordat(line, 34)
+                            oxy_ir_dc = hb.getwordat(line, 17)
+                            oxy_r_dc = hb.getwordat(line, 15)
+                            oxy_dark_dc = hb.getwordat(line, 32)
+                            bodytemp = hb.getwordat(line, 36)
+                            nasal_l = hb.getwordat(line, 11)
+                            nasal_r = hb.getwordat(line, 13)
+                            light = hb.getwordat(line, 21)
+                            bat = hb.getwordat(line, 23)
+                            noise = hb.getwordat(line, 19)
+                            eegr, eegl = hb.ScaleEEG(eegr), hb.ScaleEEG(eegl)
+                            dx, dy, dz = hb.ScaleAccel(dx), hb.ScaleAccel(dy), hb.ScaleAccel(dz)
+                            bodytemp = hb.BodyTemp(bodytemp)
+                            bat = hb.BatteryVoltage(bat)
+                            result = [eegr, eegl, dx, dy, dz, bodytemp, bat, noise, light, nasal_l, nasal_r,
+                                      oxy_ir_ac, oxy_r_ac, oxy_dark_ac, oxy_ir_dc, oxy_r_dc, oxy_dark_dc]
+                            vals = []
+                            for i in reqIDs:
+                                vals.append(result[i])
+                            reqVals.append(vals)
+
+    return reqVals
+
+
+def bench(fn, n_samples, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return n_samples / best
+
+
+def main(n_samples=256 * 30, repeats=5):
+    lines = make_lines(n_samples)
+    buf = '\n'.join(lines)
+    hb = ZmaxHeadband(sock=ReplaySocket(buf))
+
+    for reqIDs in ([0, 1], [0, 1, 2, 3, 4, 5, 7, 8], list(range(17))):
+        original = bench(lambda: original_read(hb, buf, reqIDs), n_samples, repeats)
+        per_line = bench(lambda: [hb.decode_line(line, reqIDs) for line in lines], n_samples, repeats)
+        batch = bench(lambda: hb.read_array(reqIDs), n_samples, repeats)
+
+        expected = np.array(original_read(hb, buf, reqIDs))
+        assert np.allclose(hb.read_array(reqIDs), expected)
+        assert np.allclose([hb.decode_line(line, reqIDs) for line in lines], expected)
+
+        print(f'{len(reqIDs):2d} channels: original {original:10,.0f} samples/s | per line {per_line:10,.0f} '
+              f'samples/s | batch {batch:12,.0f} samples/s | speedup {batch / original:5.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+staging eegl and eegr: IncrementalSleepStaging with n_channels=2 (one batched pass over both channels) vs. one staging
+per channel, and vs. staging eegl alone. Checks that the per channel predictions of the batched staging equal the
+separate stagings, reports the time per epoch and how often the fused prediction agrees with each channel. Uses a
+synthetic night with two channels, run from the Drec directory (exits with 1 if the predictions differ):
+
+    python -m benchmarks.bench_dual_channel_staging [hours] [preprocessing]
+"""
+import sys
+import time
+
+import mne
+import numpy as np
+
+from benchmarks.synthetic_eeg import synthetic_night
+from scripts.Utils.IncrementalStaging import IncrementalSleepStaging
+
+SAMPLE_RATE = 256
+EPOCH_LEN = 30 * SAMPLE_RATE
+
+
+def stage_night(eeg, stagings):
+    """adds every epoch of eeg to each staging, eeg has one row per staging or all rows go to a single staging"""
+    probas = [[] for _ in stagings]
+    elapsed = 0
+    for epoch in range(eeg.shape[1] // EPOCH_LEN):
+        data = eeg[:, epoch * EPOCH_LEN:(epoch + 1) * EPOCH_LEN]
+        start = time.perf_counter()
+        for i, staging in enumerate(stagings):
+            staging.add_epoch(data if len(stagings) == 1 else data[i])
+            probas[i].append(staging.predict_proba_last_per_channel().to_numpy())
+        elapsed += time.perf_counter() - start
+    # shape (channels, epochs, stages)
+    return np.concatenate([np.stack(p, axis=1) for p in probas]), elapsed / (eeg.shape[1] // EPOCH_LEN)
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+    preprocessing = sys.argv[2] if len(sys.argv) > 2 else 'yasa'
+    mne.set_log_level('error')
+    eeg = synthetic_night(hours, n_channels=2, sf=SAMPLE_RATE)[0]
+
+    def staging(n_channels=1):
+        return IncrementalSleepStaging(SAMPLE_RATE, preprocessing=preprocessing, n_channels=n_channels)
+
+    classes = staging().clf.classes_
+    _, single_time = stage_night(eeg[:1], [staging()])
+    separate, separate_time = stage_night(eeg, [staging(), staging()])
+    batched, batched_time = stage_night(eeg, [staging(2)])
+
+    same = np.array_equal(separate.argmax(axis=2), batched.argmax(axis=2))
+    fused = classes[batched.mean(axis=0).argmax(axis=1)]
+    per_channel = classes[batched.argmax(axis=2)]
+    print(f'{hours} h night, {batched.shape[1]} epochs of 2 channels, {preprocessing} preprocessing')
+    print(f'  eegl alone:              {1000 * single_time:6.1f} ms per epoch')
+    print(f'  eegl and eegr, separate: {1000 * separate_time:6.1f} ms per epoch ({separate_time / single_time:.2f}x)')
+    print(f'  eegl and eegr, batched:  {1000 * batched_time:6.1f} ms per epoch ({batched_time / single_time:.2f}x)')
+    print(f'  same per channel predictions as the separate stagings: {same}, '
+          f'largest probability difference {np.abs(separate - batched).max():.1e}')
+    print(f'  fused prediction agrees with eegl for {np.mean(fused == per_channel[0]):.3f}, '
+          f'with eegr for {np.mean(fused == per_channel[1]):.3f} of the epochs, '
+          f'the channels agree for {np.mean(per_channel[0] == per_channel[1]):.3f}')
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+saving a recording with save_edf() at the end vs. writing it epoch by epoch with the StreamingEdfWriter: peak memory
+of the save and the time from 'stop' until the file is complete. Run from the Drec directory:
+
+    python -m benchmarks.bench_edf_save [hours]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from scripts.Utils.EdfUtils import StreamingEdfWriter, save_edf
+from scripts.Utils.RecordingBuffer import RecordingBuffer
+
+SAMPLE_RATE = 256
+EPOCH_LEN = 30 * SAMPLE_RATE
+CHANNELS = [0, 1, 2, 3, 4, 5, 7, 8, 998, 999]
+
+
+def main(hours=1.0):
+    n_epochs = int(hours * 120)
+    epoch = np.random.default_rng(0).normal(scale=100, size=(EPOCH_LEN, len(CHANNELS)))
+    recording = RecordingBuffer(len(CHANNELS), block_size=20 * EPOCH_LEN)
+    for _ in range(n_epochs):
+        recording.append(epoch)
+
+    with tempfile.TemporaryDirectory() as path:
+        tracemalloc.start()
+        start = time.perf_counter()
+        save_edf(recording.to_array(), CHANNELS, path, 'at_once.edf')
+        at_once_time = time.perf_counter() - start
+        _, at_once_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        writer = StreamingEdfWriter(path, 'streamed.edf', CHANNELS, SAMPLE_RATE)
+        for i in range(n_epochs):
+            writer.write(recording.get(i * EPOCH_LEN, (i + 1) * EPOCH_LEN))
+        start = time.perf_counter()
+        writer.close()
+        streamed_time = time.perf_counter() - start
+        _, streamed_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        sizes = [os.path.getsize(os.path.join(path, f)) for f in ('at_once.edf', 'streamed.edf')]
+
+    print(f'{hours:g} h recording ({recording.nbytes / 2**20:.0f} MiB in memory), edf files of {sizes[0] / 2**20:.0f} '
+          f'and {sizes[1] / 2**20:.0f} MiB')
+    print(f'  save_edf at stop: {at_once_time:7.3f} s after stop, peak memory {at_once_peak / 2**20:7.1f} MiB')
+    print(f'  streaming writer: {streamed_time:7.3f} s after stop, peak memory {streamed_peak / 2**20:7.1f} MiB')
+
+
+if __name__ == '__main__':
+    main(*[float(arg) for arg in sys.argv[1:]])
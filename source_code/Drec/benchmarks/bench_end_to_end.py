@@ -0,0 +1,248 @@
+"""
+the whole live pipeline on a replayed night: HD_Server_Sim -> capture ('tcp' backend by default) -> ZmaxHeadband.read
+-> RecordThread -> HBRecorderInterface (edf, scoring worker) -> a webhook stub, at a multiple of real time. Reports the
+decode throughput, the scoring latency of the epochs at hour 1, 4 and 8, the peak resident memory of the recorder and
+the scoring process and the samples that were sent but not received, as json so runs of different commits can be
+compared. Needs no hardware, the simulator listens on port 8000 like the HDServer. Replays a recording (a
+recording.edf of this program or a directory with the EEG L.edf/EEG R.edf of the ZMax software) or a synthetic night,
+run from the Drec directory:
+
+    python -m benchmarks.bench_end_to_end [--recording PATH] [--hours 8] [--speed 60] [--output results.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import mne
+import numpy as np
+from PyQt5.QtCore import QCoreApplication
+
+from benchmarks.synthetic_eeg import synthetic_night
+from scripts.Connection.ZmaxHeadband import CAPTURE_BACKENDS
+from scripts.Logic.HBRecorderInterface import HBRecorderInterface
+from scripts.Logic.OfflineScoring import find_recordings
+from scripts.Logic.RecorderThread import RecordThread
+from scripts.Utils.HD_Server_Simulation import HD_Server_Sim
+from scripts.Utils.Metrics import METRICS, resident_memory
+
+SAMPLE_RATE = 256
+EPOCHS_PER_HOUR = 120
+REPORTED_HOURS = (1, 4, 8)
+IDLE_SECONDS = 3  # the stream is over once no samples arrived for this long after the simulator finished
+MEMORY_INTERVAL = 0.5  # seconds between two samples of the resident memory
+
+
+def load_eeg(recording: str, hours: float) -> np.ndarray:
+    """
+    :return: eegl and eegr in uV, shape (2, n)
+    """
+    if recording is None:
+        eeg = synthetic_night(hours, n_channels=2, sf=SAMPLE_RATE)[0]
+    else:
+        files = find_recordings([recording])
+        if not files:
+            sys.exit(f'no recording found in {recording}')
+        files = files[0]
+        if len(files) == 1:
+            raw = mne.io.read_raw_edf(files[0], include=['eegl', 'eegr'], preload=True, verbose='error')
+            eeg = raw.get_data(picks=['eegl', 'eegr'])
+        else:  # EEG L.edf, EEG R.edf
+            eeg = np.vstack([mne.io.read_raw_edf(path, preload=True, verbose='error').get_data()[:1]
+                             for path in files])
+        eeg = eeg[:, :int(hours * 3600 * SAMPLE_RATE)]
+    return eeg * 1e6
+
+
+def run_simulator(path: str, speed: float, sent, finished):
+    """the simulated HDServer, run in its own process so it does not compete with the recorder for the GIL"""
+    server = HD_Server_Sim(speed=speed)
+    server.eeg_data = np.load(path)
+    server.start()
+    while not any(client.cursor == server.n_samples for client in server.clients):
+        sent.value = server.samples_sent
+        time.sleep(0.1)
+    sent.value = server.samples_sent
+    finished.set()
+    threading.Event().wait()  # until terminated
+
+
+class WebhookStub:
+    """counts the posts of HBRecorderInterface to the webhook per path"""
+    def __init__(self):
+        posts = self.posts = {}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                name = self.path.rstrip('/').split('/')[-1]
+                posts[name] = posts.get(name, 0) + 1
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/webhookcallback/'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def histogram_summary(name: str) -> dict:
+    histogram = METRICS.histogram(name, '')
+    snapshot = histogram.snapshot()
+    if snapshot['count'] == 0:
+        return {'count': 0}
+    return {'count': snapshot['count'],
+            'mean_ms': 1000 * snapshot['sum'] / snapshot['count'],
+            'p99_ms': 1000 * min(histogram.quantile(0.99, snapshot), snapshot['max']),
+            'max_ms': 1000 * snapshot['max']}
+
+
+def replay(eeg: np.ndarray, speed: float, backend: str, warmup: float) -> dict:
+    app = QCoreApplication([])
+    context = multiprocessing.get_context('spawn')
+    directory = tempfile.mkdtemp()
+    np.save(os.path.join(directory, 'eeg.npy'), eeg)
+    sent, finished = context.Value('q', 0), context.Event()
+    simulator = context.Process(target=run_simulator, args=(os.path.join(directory, 'eeg.npy'), speed, sent, finished),
+                                daemon=True)
+    simulator.start()
+
+    # the latency of an epoch is from cutting it in the recorder thread to its prediction in the main thread
+    cut, latency = {}, {}
+    send_epoch_data = RecordThread.sendEpochData
+
+    def timed_send_epoch_data(thread, data):
+        cut[thread.epochCounter] = time.perf_counter()
+        send_epoch_data(thread, data)
+
+    RecordThread.sendEpochData = timed_send_epoch_data
+
+    webhook = WebhookStub()
+    os.chdir(directory)  # the recording is saved to ./recordings/... of the working directory
+    hbif = HBRecorderInterface()
+    hbif.capture_backend = backend
+    hbif.webHookBaseAdress = webhook.url
+    hbif.start_webhook()
+    hbif.start_scoring()
+    hbif.scoringWorker.predictionSignal.connect(
+        lambda _, epoch, __: latency.__setitem__(epoch, time.perf_counter() - cut.get(epoch, np.nan)))
+    # the scoring process loads the classifier before the replay starts, as it would during the first minutes of a night
+    deadline = time.perf_counter() + warmup
+    while time.perf_counter() < deadline:
+        app.processEvents()
+        time.sleep(0.05)
+    hbif.start_recording()
+
+    first_change = None  # when the first samples arrived
+    peak_memory = {'recorder': 0, 'scoring': 0}
+    last_received, last_change, next_memory = 0, time.perf_counter(), 0
+    while not finished.is_set() or time.perf_counter() - last_change < IDLE_SECONDS:
+        app.processEvents()
+        time.sleep(0.005)
+        now = time.perf_counter()
+        received = hbif.recorderThread.receivedSamples
+        if received != last_received:
+            last_received, last_change = received, now
+            first_change = first_change or now
+        if now >= next_memory:
+            next_memory = now + MEMORY_INTERVAL
+            peak_memory['recorder'] = max(peak_memory['recorder'], resident_memory())
+            peak_memory['scoring'] = np.nanmax([peak_memory['scoring'], hbif.scoringWorker.processMemory])
+    elapsed = last_change - (first_change or last_change)
+
+    # the predictions of the last epochs
+    deadline = time.perf_counter() + 30
+    while hbif.scoringWorker.submitTimes and time.perf_counter() < deadline:
+        app.processEvents()
+        time.sleep(0.01)
+    hbif.quit()
+    simulator.terminate()
+    webhook.stop()
+    RecordThread.sendEpochData = send_epoch_data
+
+    received = hbif.recorderThread.receivedSamples
+    decode = METRICS.histogram('decode_seconds', '').snapshot()
+    scored = sorted(epoch for epoch, value in latency.items() if not np.isnan(value))
+    at_hour = {}
+    for hour in REPORTED_HOURS:
+        # the epoch at the hour or the next one that was scored
+        epochs = [epoch for epoch in scored if epoch >= hour * EPOCHS_PER_HOUR]
+        if hour * EPOCHS_PER_HOUR <= hbif.recorderThread.epochCounter and epochs:
+            at_hour[f'hour_{hour}'] = 1000 * latency[epochs[0]]
+    latencies = np.array([latency[epoch] for epoch in scored])
+
+    return {'wall_seconds': elapsed,
+            'samples_sent': int(sent.value),
+            'samples_received': int(received),
+            'dropped_samples': int(sent.value - received),
+            'achieved_speed': received / SAMPLE_RATE / elapsed if elapsed else None,
+            'decode': {'samples_per_second': received / decode['sum'] if decode['sum'] else None,
+                       **histogram_summary('decode_seconds')},
+            'capture': histogram_summary('capture_packet_seconds'),
+            'epoch_handoff': histogram_summary('epoch_handoff_seconds'),
+            'edf_write': histogram_summary('edf_write_seconds'),
+            'scoring_latency_ms': {**at_hour,
+                                   'median': 1000 * float(np.median(latencies)) if len(latencies) else None,
+                                   'max': 1000 * float(np.max(latencies)) if len(latencies) else None},
+            'scoring_compute': histogram_summary('scoring_compute_seconds'),
+            'epochs': int(hbif.recorderThread.epochCounter),
+            'epochs_scored': len(scored),
+            'epochs_skipped': int(hbif.scoringWorker.skipped),
+            'webhook_posts': webhook.posts,
+            'peak_rss_bytes': {name: int(value) for name, value in peak_memory.items()}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replays a night through the live pipeline at a multiple of real '
+                                                 'time and reports its performance as json')
+    parser.add_argument('--recording', help='recording.edf or directory of a recording, a synthetic night by default')
+    parser.add_argument('--hours', type=float, default=8, help='hours of the night to replay (default 8)')
+    parser.add_argument('--speed', type=float, default=60, help='multiple of real time (default 60)')
+    parser.add_argument('--backend', choices=CAPTURE_BACKENDS, default='tcp', help='capture backend (default tcp)')
+    parser.add_argument('--warmup', type=float, default=30,
+                        help='seconds the scoring process gets to load the classifier before the replay (default 30)')
+    parser.add_argument('--output', help='also write the results to this json file')
+    args = parser.parse_args()
+    mne.set_log_level('error')
+
+    eeg = load_eeg(args.recording, args.hours)
+    output = None if args.output is None else os.path.abspath(args.output)
+    results = {'commit': git_commit(),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'cpus': os.cpu_count(),
+               'recording': args.recording or 'synthetic',
+               'hours': eeg.shape[1] / SAMPLE_RATE / 3600,
+               'speed': args.speed,
+               'backend': args.backend,
+               **replay(eeg, args.speed, args.backend, args.warmup)}
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if output is not None:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
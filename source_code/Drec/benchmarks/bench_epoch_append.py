@@ -0,0 +1,53 @@
+"""
+time to add one 30 s epoch to the recording of a night at hour 1 and hour 10: np.concatenate of the whole recording
+(as HBRecorderInterface did) vs. RecordingBuffer.append. Run from the Drec directory:
+
+    python -m benchmarks.bench_epoch_append
+"""
+import time
+
+import numpy as np
+
+from scripts.Utils.RecordingBuffer import RecordingBuffer
+
+SAMPLE_RATE = 256
+EPOCH_LEN = 30 * SAMPLE_RATE
+N_COLUMNS = 10
+EPOCHS_PER_HOUR = 120
+
+
+def time_concatenate(recording, epoch, repeats=5):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        np.concatenate((recording, epoch), axis=0)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def time_append(buffer, epoch, repeats=5):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        buffer.append(epoch)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    epoch = np.random.default_rng(0).normal(size=(EPOCH_LEN, N_COLUMNS))
+    buffer = RecordingBuffer(N_COLUMNS, block_size=20 * EPOCH_LEN)
+
+    for hour in (1, 10):
+        n_epochs = hour * EPOCHS_PER_HOUR
+        concat = time_concatenate(np.zeros((n_epochs * EPOCH_LEN, N_COLUMNS)), epoch)
+
+        while len(buffer) < n_epochs * EPOCH_LEN:
+            buffer.append(epoch)
+        append = time_append(buffer, epoch)
+
+        print(f'hour {hour:2d}: np.concatenate {concat * 1000:8.2f} ms | RecordingBuffer.append {append * 1000:6.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
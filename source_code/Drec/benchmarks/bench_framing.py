@@ -0,0 +1,67 @@
+"""
+measures how many samples are lost when tcp payloads are handed to the decoder as they are (split lines fail the
+length check) vs. after the LineFramer, and the latency added by sleep polling vs. a blocking queue. Run from the
+Drec directory:
+
+    python -m benchmarks.bench_framing
+"""
+import threading
+import time
+from queue import Queue
+
+import numpy as np
+
+from benchmarks.bench_decode import ReplaySocket, make_lines
+from scripts.Connection.LineFramer import LineFramer
+from scripts.Connection.ZmaxHeadband import ZmaxHeadband
+
+
+def split_stream(stream: bytes, mean_segment_size: int, seed=0):
+    """cuts the stream at random positions, like tcp segments that do not respect line boundaries"""
+    rng = np.random.default_rng(seed)
+    cuts = np.cumsum(rng.integers(1, 2 * mean_segment_size, size=len(stream) // mean_segment_size * 2))
+    cuts = cuts[cuts < len(stream)]
+    return [stream[a:b] for a, b in zip(np.r_[0, cuts], np.r_[cuts, len(stream)])]
+
+
+def lost_samples(n_samples=256 * 60, mean_segment_size=1024):
+    lines = make_lines(n_samples)
+    segments = split_stream(('\n'.join(lines) + '\n').encode(), mean_segment_size)
+    hb = ZmaxHeadband(sock=ReplaySocket(''))
+
+    unframed = sum(len(hb.decode_lines(seg.decode().split('\n'), [0, 1])) for seg in segments)
+
+    framer = LineFramer()
+    framed = sum(len(hb.decode_lines(framer.feed(seg).decode().split('\n'), [0, 1])) for seg in segments)
+
+    print(f'{len(segments)} segments of ~{mean_segment_size} bytes, {n_samples} samples sent')
+    print(f'  without framing: {n_samples - unframed:6d} samples lost ({(n_samples - unframed) / n_samples:.1%})')
+    print(f'  with framing:    {n_samples - framed:6d} samples lost, {framer.split_lines} split lines joined')
+
+
+def read_latency(n_reads=50):
+    def polling_get(q):
+        while q.empty():
+            time.sleep(0.1)
+        return q.get()
+
+    def blocking_get(q):
+        return q.get(timeout=1.0)
+
+    for name, get in (('sleep polling', polling_get), ('blocking get', blocking_get)):
+        q = Queue()
+        delays = []
+        for _ in range(n_reads):
+            sent = []
+            producer = threading.Timer(np.random.uniform(0, 0.1), lambda: (sent.append(time.perf_counter()), q.put(b'x')))
+            producer.start()
+            get(q)
+            delays.append(time.perf_counter() - sent[0])
+            producer.join()
+        print(f'  {name:14s}: mean added latency {np.mean(delays) * 1000:6.2f} ms, max {np.max(delays) * 1000:6.2f} ms')
+
+
+if __name__ == '__main__':
+    lost_samples()
+    print('read latency')
+    read_latency()
@@ -0,0 +1,60 @@
+"""
+scoring the newest epoch at hour 1, 4 and 8 of a night: yasa.SleepStaging over the whole recording (as
+HBRecorderInterface did) vs. IncrementalSleepStaging. Also compares the predictions of both for epochs spread over the
+night. Uses synthetic eeg, run from the Drec directory:
+
+    python -m benchmarks.bench_incremental_staging [hours]
+"""
+import sys
+import time
+
+import mne
+import numpy as np
+
+from benchmarks.synthetic_eeg import synthetic_night
+from scripts.Utils.IncrementalStaging import IncrementalSleepStaging
+from scripts.Utils.yasa_functions import YasaClassifier
+
+SAMPLE_RATE = 256
+EPOCH_LEN = 30 * SAMPLE_RATE
+EPOCHS_PER_HOUR = 120
+
+
+def score_full(eeg, n_epochs):
+    info = mne.create_info(ch_names=['eegl'], sfreq=SAMPLE_RATE, ch_types='eeg', verbose='ERROR')
+    mne_array = mne.io.RawArray(eeg[np.newaxis, :n_epochs * EPOCH_LEN], info, verbose='ERROR')
+    start = time.perf_counter()
+    preds = YasaClassifier.get_preds_per_epoch(mne_array, 'eegl')
+    return preds[-1], time.perf_counter() - start
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+    eeg = synthetic_night(hours, n_channels=1)[0][0]
+    n_epochs = len(eeg) // EPOCH_LEN
+
+    staging = IncrementalSleepStaging(sf=SAMPLE_RATE)
+    incremental = []
+    latency = []
+    for i in range(n_epochs):
+        start = time.perf_counter()
+        staging.add_epoch(eeg[i * EPOCH_LEN:(i + 1) * EPOCH_LEN])
+        incremental.append(staging.predict_last())
+        latency.append(time.perf_counter() - start)
+
+    print('latency of scoring the newest epoch')
+    for hour in (1, 4, 8):
+        epoch = hour * EPOCHS_PER_HOUR
+        if epoch > n_epochs:
+            continue
+        _, full = score_full(eeg, epoch)
+        print(f'  hour {hour}: whole recording {1000 * full:8.1f} ms   incremental {1000 * latency[epoch - 1]:6.1f} ms')
+    print(f'incremental over the night: median {1000 * np.median(latency):.1f} ms, max {1000 * np.max(latency):.1f} ms')
+
+    checked = range(11, n_epochs + 1, max(n_epochs // 40, 1))
+    agree = sum(score_full(eeg, epoch)[0] == incremental[epoch - 1] for epoch in checked)
+    print(f'same prediction as the whole recording for {agree} of {len(checked)} epochs')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+simulate_scoring_in_live: the single pass replay vs. rebuilding the recording from sample 0 for every epoch and
+running bandpower, SleepStaging and rem_detect on it (as simulate_scoring_in_live did). Compares the scoring_results.csv
+of both and the time they take. Uses a synthetic night with eye movements during R and W, run from the Drec directory:
+
+    python -m benchmarks.bench_live_replay [hours] [processes]
+"""
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import mne
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic_eeg import synthetic_night
+from scripts.Utils.yasa_functions import YasaClassifier, simulate_scoring_in_live
+
+SAMPLE_RATE = 256
+
+
+def add_eye_movements(eeg, stages, seed=0):
+    """opposite deflections of 40 to 200 uV on both channels every few seconds during R and W"""
+    rng = np.random.default_rng(seed)
+    epoch_len = 30 * SAMPLE_RATE
+    for epoch, stage in enumerate(stages):
+        if stage not in ('R', 'W'):
+            continue
+        for start in np.sort(rng.choice(epoch_len - SAMPLE_RATE, size=rng.integers(0, 6), replace=False)):
+            duration = int(rng.uniform(0.3, 0.8) * SAMPLE_RATE)
+            movement = rng.uniform(40, 200) * 1e-6 * np.sin(np.pi * np.arange(duration) / duration)
+            begin = epoch * epoch_len + start
+            eeg[0, begin:begin + duration] += movement
+            eeg[1, begin:begin + duration] -= movement
+
+
+def prefix_replay(raw, channel_l, channel_r):
+    """the replay of simulate_scoring_in_live before the single pass version"""
+    data = raw.get_data(picks=[channel_l, channel_r])
+    sf = SAMPLE_RATE
+    rem_epochs, psd_theta_epochs, pred_rem_epochs, combined_epochs = [], [], [], []
+    idx = sf * 60 * 120
+    while idx + sf * 30 < data.shape[1]:
+        mne_array = YasaClassifier.to_raw(data[:, 0:idx + sf * 30], ['eegl', 'eegr'], sf)
+
+        _, bandpower_last_epoch = YasaClassifier.get_bandpower_per_epoch(mne_array)
+        delta_mean = (bandpower_last_epoch[0, 0] + bandpower_last_epoch[0, 1]) / 2
+        theta_mean = (bandpower_last_epoch[1, 0] + bandpower_last_epoch[1, 1]) / 2
+        theta_delta_ratio = theta_mean / delta_mean
+        psd_theta_epochs.append(int(theta_delta_ratio > 0.22))
+
+        preds = YasaClassifier.get_preds_per_epoch(mne_array=mne_array)
+        pred_rem_epochs.append(int(preds[-1] == 'R'))
+
+        rem = YasaClassifier.get_eyes(mne_array, ['eegl', 'eegr'], preds)
+        if rem:
+            rem_pd = rem.summary()
+            rem_last_30_sec = rem_pd.loc[rem_pd['Start'] > (idx / 256)]
+        else:
+            rem_last_30_sec = pd.DataFrame()
+        rem_epochs.append(int(not rem_last_30_sec.empty))
+
+        combined_epochs.append(int(theta_delta_ratio > 0.22 and preds[-1] == 'R' and not rem_last_30_sec.empty))
+        idx += sf * 30
+
+    scoring_df = pd.DataFrame(list(zip(combined_epochs, rem_epochs, psd_theta_epochs, pred_rem_epochs)),
+                              columns=['combines', 'eyes', 'theta/delta', 'pred'])
+    scoring_df.to_csv('scoring_results.csv')
+
+
+def run(function, *args, **kwargs):
+    directory = tempfile.mkdtemp()
+    os.chdir(directory)
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    return pd.read_csv(os.path.join(directory, 'scoring_results.csv'), index_col=0), elapsed
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    mne.set_log_level('error')
+    warnings.filterwarnings('ignore', category=FutureWarning)  # yasa 0.7 deprecations in the old replay
+    eeg, stages = synthetic_night(hours, n_channels=2, sf=SAMPLE_RATE)
+    add_eye_movements(eeg, stages)
+    raw = YasaClassifier.to_raw(eeg, ['eegl', 'eegr'], SAMPLE_RATE)
+
+    single_pass, single_pass_time = run(simulate_scoring_in_live, raw, 'eegl', 'eegr', processes=processes)
+    prefix, prefix_time = run(prefix_replay, raw, 'eegl', 'eegr')
+
+    print(f'{hours} h night, {len(prefix)} epochs replayed')
+    print(f'  from sample 0 for every epoch: {prefix_time:7.1f} s')
+    print(f'  single pass:                   {single_pass_time:7.1f} s')
+    print(f'  identical files: {single_pass.equals(prefix)}')
+    for column in prefix.columns:
+        differing = np.flatnonzero(single_pass[column].to_numpy() != prefix[column].to_numpy())
+        print(f'  {column:<12} {prefix[column].sum():4d} epochs set, {len(differing)} differ {list(differing)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+cold vs. warm scoring latency: yasa.SleepStaging.predict() unpickling the classifier on every call (as
+YasaClassifier.get_sleep_hypno did) vs. the classifier kept by ModelRegistry, and the first incremental prediction of a
+recording with a freshly loaded vs. a warmed up classifier. Uses synthetic eeg, run from the Drec directory:
+
+    python -m benchmarks.bench_model_cache
+"""
+import time
+
+import joblib
+import mne
+import yasa
+
+from benchmarks.synthetic_eeg import synthetic_night
+from scripts.Utils import ModelRegistry
+from scripts.Utils.IncrementalStaging import IncrementalSleepStaging
+from scripts.Utils.yasa_functions import YasaClassifier
+
+SAMPLE_RATE = 256
+EPOCH_LEN = 30 * SAMPLE_RATE
+REPEATS = 5
+
+
+def best_of(function, repeats=REPEATS):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    mne.set_log_level('error')
+    eeg = synthetic_night(1, n_channels=1)[0]
+    raw = YasaClassifier.to_raw(eeg, ['eegl'], SAMPLE_RATE)
+    path = ModelRegistry.resolve_model_path()
+
+    load = best_of(lambda: joblib.load(path))
+    print(f'unpickling {path.split("/")[-1]}: {1000 * load:.1f} ms')
+
+    cold = best_of(lambda: yasa.SleepStaging(raw, eeg_name='eegl', metadata=dict(age=45, male=True)).predict())
+    ModelRegistry.warm_up()
+    warm = best_of(lambda: YasaClassifier.get_preds_per_epoch(raw, 'eegl'))
+    print(f'staging 1 h: cold {1000 * cold:.1f} ms, warm {1000 * warm:.1f} ms')
+
+    def first_epoch(clf):
+        staging = IncrementalSleepStaging(SAMPLE_RATE)
+        staging.clf = clf
+        staging.add_epoch(eeg[0, :EPOCH_LEN])
+        start = time.perf_counter()
+        staging.predict_last()
+        return time.perf_counter() - start
+
+    cold_first = min(first_epoch(joblib.load(path)) + load for _ in range(REPEATS))
+    warm_first = min(first_epoch(ModelRegistry.get_classifier()) for _ in range(REPEATS))
+    print(f'first incremental prediction of a recording (loading included): cold {1000 * cold_first:.1f} ms, '
+          f'warm {1000 * warm_first:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+throughput of the offline batch scoring (scoreoffline.py) with 1, 2, 4, ... processes up to the number of cpus, on
+synthetic recordings written like the recorder (recording.edf) and the ZMax software (EEG L.edf and EEG R.edf) do.
+Also checks that a second run skips the recordings that are up to date. Run from the Drec directory:
+
+    python -m benchmarks.bench_offline_scoring [n_recordings] [hours]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic_eeg import synthetic_night
+from scripts.Logic.OfflineScoring import score_recordings
+from scripts.Utils.EdfUtils import save_edf
+
+SAMPLE_RATE = 256
+
+
+def write_recordings(directory, n_recordings, hours):
+    for i in range(n_recordings):
+        eeg = synthetic_night(hours, n_channels=2, sf=SAMPLE_RATE, seed=i)[0] * 1e6  # edf in uV
+        path = os.path.join(directory, f'night-{i}')
+        os.makedirs(path)
+        if i % 2 == 0:
+            save_edf(eeg.T, [0, 1], path, 'recording.edf', SAMPLE_RATE)  # eegr, eegl
+        else:
+            save_edf(eeg[1:].T, [1], path, 'EEG L.edf', SAMPLE_RATE)
+            save_edf(eeg[:1].T, [0], path, 'EEG R.edf', SAMPLE_RATE)
+
+
+def main():
+    n_recordings = int(sys.argv[1]) if len(sys.argv) > 1 else 4 * os.cpu_count()
+    hours = float(sys.argv[2]) if len(sys.argv) > 2 else 8
+    directory = tempfile.mkdtemp()
+    write_recordings(directory, n_recordings, hours)
+    print(f'{n_recordings} recordings of {hours} h, {os.cpu_count()} cpus')
+
+    processes = [1]
+    while processes[-1] * 2 <= os.cpu_count():
+        processes.append(processes[-1] * 2)
+
+    throughput = {}
+    for n in processes:
+        start = time.perf_counter()
+        score_recordings([directory], processes=n, force=True)
+        throughput[n] = 3600 * n_recordings / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    skipped = score_recordings([directory])
+    print(f'second run without --force: {len(skipped)} scored in {time.perf_counter() - start:.2f} s')
+
+    print('processes  recordings/hour  speedup')
+    for n, value in throughput.items():
+        print(f'{n:9d}  {value:15.0f}  {value / throughput[1]:7.2f}')
+
+
+if __name__ == '__main__':
+    main()
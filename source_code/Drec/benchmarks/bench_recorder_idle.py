@@ -0,0 +1,43 @@
+"""
+cpu usage of a recorder that is connected to the HDServer simulator but receives no data, and the time stop() needs
+to take effect. Run from the Drec directory (port 8000 has to be free):
+
+    python -m benchmarks.bench_recorder_idle
+"""
+import threading
+import time
+
+import numpy as np
+from PyQt5.QtCore import QCoreApplication
+
+from scripts.Logic.RecorderThread import RecordThread
+from scripts.Utils.HD_Server_Simulation import HD_Server_Sim
+
+
+def main(idle_seconds=10):
+    app = QCoreApplication([])
+
+    server = HD_Server_Sim()
+    server.eeg_data = np.zeros((2, 2 * server.sampling_rate))  # streams for two seconds, then stays silent
+    threading.Thread(target=server.start_server, daemon=True).start()
+    time.sleep(0.5)
+
+    recorder = RecordThread(signalType=[0, 1], captureBackend='tcp')
+    recorder.start()
+    time.sleep(4)  # connect and receive the two seconds of data
+
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    time.sleep(idle_seconds)
+    cpu_usage = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start)
+
+    stop_start = time.perf_counter()
+    recorder.stop()
+    recorder.wait()
+    stop_time = time.perf_counter() - stop_start
+
+    print(f'idle cpu usage of the process: {cpu_usage:.1%} of one core')
+    print(f'stop() took effect after {stop_time:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
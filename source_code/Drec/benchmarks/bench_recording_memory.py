@@ -0,0 +1,65 @@
+"""
+memory footprint of a simulated recording: the former list of lists (one python list of floats per sample) vs. the
+RecordingBuffer. Run from the Drec directory:
+
+    python -m benchmarks.bench_recording_memory [hours]
+
+The list of lists is measured for one hour and extrapolated, a full night of it does not fit into memory on most
+machines.
+"""
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from scripts.Utils.RecordingBuffer import RecordingBuffer
+
+SAMPLE_RATE = 256
+N_COLUMNS = 10  # the 8 default signals + sample number + sample time
+BATCH = 64  # samples per read of the headband
+
+
+def list_of_lists(n_samples):
+    recording = []
+    batch = np.random.default_rng(0).normal(size=(BATCH, N_COLUMNS))
+    for _ in range(n_samples // BATCH):
+        for line in batch.tolist():
+            recording.append(line)
+    return recording
+
+
+def recording_buffer(n_samples):
+    recording = RecordingBuffer(N_COLUMNS, block_size=20 * 30 * SAMPLE_RATE)
+    batch = np.random.default_rng(0).normal(size=(BATCH, N_COLUMNS))
+    for _ in range(n_samples // BATCH):
+        recording.append(batch)
+    return recording
+
+
+def measure(fn, n_samples):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(n_samples)
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak, duration
+
+
+def main(hours=10.0):
+    samples_per_hour = SAMPLE_RATE * 3600
+
+    list_peak, list_time = measure(list_of_lists, samples_per_hour)
+    buffer_peak, buffer_time = measure(recording_buffer, int(hours * samples_per_hour))
+
+    print(f'{hours:g} h recording, {N_COLUMNS} columns at {SAMPLE_RATE} Hz')
+    print(f'  list of lists:   {list_peak * hours / 2**20:8.0f} MiB (extrapolated from 1 h), '
+          f'{list_time / samples_per_hour * 1e9:6.0f} ns per sample')
+    print(f'  RecordingBuffer: {buffer_peak / 2**20:8.0f} MiB, '
+          f'{buffer_time / (hours * samples_per_hour) * 1e9:6.0f} ns per sample')
+
+
+if __name__ == '__main__':
+    main(*[float(arg) for arg in sys.argv[1:]])
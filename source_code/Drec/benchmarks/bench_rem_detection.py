@@ -0,0 +1,56 @@
+"""
+rem detection of the newest epoch at hour 1, 4 and 8 of a night: YasaClassifier.get_eyes() on the whole recording vs.
+IncrementalRemDetection. That both find the same rems is tested in tests/test_incremental_rem_detection.py. Uses a
+synthetic night with eye movements, run from the Drec directory:
+
+    python -m benchmarks.bench_rem_detection [hours]
+"""
+import sys
+import time
+
+import mne
+import numpy as np
+
+from benchmarks.bench_live_replay import add_eye_movements
+from benchmarks.synthetic_eeg import synthetic_night
+from scripts.Utils.IncrementalRemDetection import IncrementalRemDetection
+from scripts.Utils.yasa_functions import YasaClassifier
+
+SAMPLE_RATE = 256
+EPOCH_LEN = 30 * SAMPLE_RATE
+EPOCHS_PER_HOUR = 120
+
+
+def detect_epochs(eeg):
+    detector = IncrementalRemDetection(SAMPLE_RATE)
+    latency = []
+    for start in range(0, eeg.shape[1], EPOCH_LEN):
+        begin = time.perf_counter()
+        detector.add(*eeg[:, start:start + EPOCH_LEN])
+        latency.append(time.perf_counter() - begin)
+    return latency
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+    mne.set_log_level('error')
+    eeg, stages = synthetic_night(hours, n_channels=2, sf=SAMPLE_RATE)
+    add_eye_movements(eeg, stages)
+    n_epochs = eeg.shape[1] // EPOCH_LEN
+
+    latency = detect_epochs(eeg)
+    print('latency of the rem detection of the newest epoch')
+    for hour in (1, 4, 8):
+        epoch = hour * EPOCHS_PER_HOUR
+        if epoch > n_epochs:
+            continue
+        raw = YasaClassifier.to_raw(eeg[:, :epoch * EPOCH_LEN], ['eegl', 'eegr'], SAMPLE_RATE)
+        start = time.perf_counter()
+        YasaClassifier.get_eyes(raw, ['eegl', 'eegr'])
+        full = time.perf_counter() - start
+        print(f'  hour {hour}: whole recording {1000 * full:7.1f} ms   incremental {1000 * latency[epoch - 1]:5.1f} ms')
+    print(f'incremental over the night: median {1000 * np.median(latency):.1f} ms, max {1000 * np.max(latency):.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
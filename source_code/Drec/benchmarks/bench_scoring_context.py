@@ -0,0 +1,69 @@
+"""
+accuracy vs. context length of the bounded-context scoring: stages a night epoch by epoch like the live scoring, once
+based on the whole recording and once per context length, and reports the epoch by epoch agreement
+(YasaClassifier.get_epoch_by_epoch_agreement) of each context with the whole recording, the time per epoch at the end of
+the night and the memory of the cached features. Uses an 8 h synthetic night or a recording, run from the Drec
+directory:
+
+    python -m benchmarks.bench_scoring_context [path/to/recording.edf channel]
+"""
+import sys
+import time
+
+import mne
+import yasa
+
+from benchmarks.synthetic_eeg import synthetic_night
+from scripts.Utils.IncrementalStaging import IncrementalSleepStaging
+from scripts.Utils.yasa_functions import YasaClassifier
+
+SAMPLE_RATE = 256
+HOURS = 8
+CONTEXT_MINUTES = [None, 30, 60, 120, 240]
+TIMED_EPOCHS = 20  # the last epochs of the night, their mean time per epoch is reported
+
+
+def load_eeg():
+    if len(sys.argv) > 2:
+        raw = mne.io.read_raw_edf(sys.argv[1], preload=True)
+        return raw.get_data(picks=[sys.argv[2]])[0], int(raw.info['sfreq'])
+    return synthetic_night(HOURS, n_channels=1, sf=SAMPLE_RATE)[0][0], SAMPLE_RATE
+
+
+def stage_night(eeg, sf, context_minutes):
+    staging = IncrementalSleepStaging(sf, context_epochs=None if context_minutes is None else context_minutes * 2)
+    n_epochs = len(eeg) // staging.epoch_len
+    preds = []
+    elapsed = 0
+    for epoch in range(n_epochs):
+        start = time.perf_counter()
+        staging.add_epoch(eeg[epoch * staging.epoch_len:(epoch + 1) * staging.epoch_len])
+        preds.append(staging.predict_last())
+        if epoch >= n_epochs - TIMED_EPOCHS:
+            elapsed += time.perf_counter() - start
+    cache = staging._features.nbytes + staging._rollc.nbytes + staging._rollp.nbytes
+    return preds, elapsed / TIMED_EPOCHS, cache
+
+
+def main():
+    mne.set_log_level('error')
+    eeg, sf = load_eeg()
+    print(f'{len(eeg) / sf / 3600:.1f} h of eeg at {sf} Hz')
+
+    results = {minutes: stage_night(eeg, sf, minutes) for minutes in CONTEXT_MINUTES}
+    full = yasa.Hypnogram(results[None][0], scorer='whole recording')
+
+    print('context        agreement  kappa  ms per epoch at the end  cached features')
+    for minutes, (preds, latency, cache) in results.items():
+        if minutes is None:
+            agreement, kappa = 1.0, 1.0
+        else:
+            hypno = yasa.Hypnogram(preds, scorer=f'{minutes} min')
+            scores = YasaClassifier.get_epoch_by_epoch_agreement([full], [hypno]).get_agreement()
+            agreement, kappa = scores['accuracy'], scores['kappa']
+        name = 'whole night' if minutes is None else f'{minutes} min'
+        print(f'{name:<13}  {agreement:9.3f}  {kappa:5.3f}  {1000 * latency:23.1f}  {cache / 1024:12.0f} KiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+memory traced by tracemalloc while scoring the newest epoch of a two channel recording with the whole recording: the
+copying path (RawArray of copied channels, then get_preds_per_epoch copying the Raw twice and picking, as
+simulate_scoring_in_live and HBRecorderInterface did) vs. YasaClassifier.to_raw on a slice and the zero-copy staging.
+Uses synthetic eeg, run from the Drec directory:
+
+    python -m benchmarks.bench_scoring_copies [hours]
+"""
+import sys
+import tracemalloc
+
+import mne
+import yasa
+
+from benchmarks.synthetic_eeg import synthetic_night
+from scripts.Utils.yasa_functions import YasaClassifier
+
+SAMPLE_RATE = 256
+
+
+def score_copying(loc, roc):
+    info = mne.create_info(ch_names=['eegl', 'eegr'], sfreq=SAMPLE_RATE, ch_types='eeg')
+    mne_array = mne.io.RawArray([loc.copy(), roc.copy()], info, verbose='error')
+    data = mne_array.copy()
+    data = data.copy()
+    data.pick('eegl')
+    return yasa.SleepStaging(data, eeg_name='eegl', metadata=dict(age=45, male=True)).predict()
+
+
+def score_views(signal):
+    mne_array = YasaClassifier.to_raw(signal, ['eegl', 'eegr'], SAMPLE_RATE)
+    return YasaClassifier.get_preds_per_epoch(mne_array, 'eegl')
+
+
+def traced(function, *args):
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+    signal = synthetic_night(hours)[0]
+    mne.set_log_level('error')
+
+    print(f'peak traced memory while scoring {hours:g} h of two channel eeg ({signal.nbytes / 2 ** 20:.0f} MiB)')
+    copying = traced(score_copying, signal[0], signal[1])
+    views = traced(score_views, signal)
+    print(f'  copying channels and Raw: {copying / 2 ** 20:8.1f} MiB')
+    print(f'  views:                    {views / 2 ** 20:8.1f} MiB')
+    print(f'  reduction per epoch:      {(copying - views) / 2 ** 20:8.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+records from the HDServer simulator while scoring is slower than the epochs arrive (a staging that burns 70 s of cpu
+per prediction), once with the staging in the Qt main thread (as HBRecorderInterface did) and once in the
+ScoringWorker process. Reports samples sent vs. received, the longest block of the main thread and which epochs got a
+prediction. Takes about 10 minutes, run from the Drec directory (port 8000 has to be free):
+
+    python -m benchmarks.bench_scoring_worker
+"""
+import functools
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from PyQt5.QtCore import QCoreApplication
+
+from scripts.Logic.HBRecorderInterface import HBRecorderInterface
+from scripts.Logic.ScoringWorker import ScoringWorker
+from scripts.Utils.HD_Server_Simulation import HD_Server_Sim
+from scripts.Utils.IncrementalStaging import IncrementalSleepStaging
+
+RECORD_SECONDS = 300
+BURN_SECONDS = 70
+
+
+class SlowStaging(IncrementalSleepStaging):
+    def __init__(self, sf, burn=BURN_SECONDS, **kwargs):
+        super().__init__(sf, **kwargs)
+        self.burn = burn
+
+    def predict_last(self):
+        end = time.process_time() + self.burn
+        while time.process_time() < end:
+            pass
+        return super().predict_last()
+
+
+class InProcessScoring(HBRecorderInterface):
+    """scores in the Qt slot like before the scoring worker"""
+    def _start_scoring_worker(self):
+        pass
+
+    def _score_curr_data(self, epoch_counter):
+        if getattr(self, 'staging', None) is None:
+            self.staging = SlowStaging(self.sample_rate)
+        for start in range(self.staging.n_epochs * self.epoch_len, self.recorded_samples, self.epoch_len):
+            self.staging.add_epoch(self.recording.get(start, start + self.epoch_len, channels=1))
+        self.on_prediction(datetime.now(), epoch_counter, self.staging.predict_last())
+
+
+class WorkerScoring(HBRecorderInterface):
+    def _start_scoring_worker(self):
+        if self.scoringWorker is None:
+            self.scoringWorker = ScoringWorker(self.sample_rate, self.scoring_deadline,
+                                               staging_factory=functools.partial(SlowStaging, burn=BURN_SECONDS))
+            self.scoringWorker.predictionSignal.connect(self.on_prediction)
+            self.scoringWorker.start()
+
+
+def record(app, server, interface_class):
+    hbif = interface_class()
+    hbif.set_capture_backend('tcp')
+    hbif.scoring_delay = 0
+    hbif.start_scoring()
+    sent_before = server.samples_sent
+    hbif.start_recording()
+
+    longest_stall = 0
+    end = time.monotonic() + RECORD_SECONDS
+    while time.monotonic() < end:
+        start = time.monotonic()
+        app.processEvents()
+        longest_stall = max(longest_stall, time.monotonic() - start)
+        time.sleep(0.01)
+
+    hbif.stop_recording()
+    hbif.wait_for_saving()
+    sent = server.samples_sent - sent_before
+    received = hbif.recorderThread.totalDataSampleCounter
+    hbif.quit()
+
+    print(f'{interface_class.__name__}:')
+    print(f'  samples sent {sent}, received {received}, lost {sent - received}')
+    print(f'  longest block of the main thread: {longest_stall:.1f} s')
+    print(f'  predictions for epochs {[epoch for _, epoch, _ in hbif.scoring_predictions]} '
+          f'of {hbif.recorderThread.epochCounter}')
+
+
+def main():
+    app = QCoreApplication([])
+    os.chdir(tempfile.mkdtemp())
+
+    server = HD_Server_Sim()
+    server.eeg_data = np.random.default_rng(0).normal(0, 20, (2, 3600 * server.sampling_rate))
+    threading.Thread(target=server.start_server, daemon=True).start()
+    time.sleep(0.5)
+
+    for interface_class in (InProcessScoring, WorkerScoring):
+        record(app, server, interface_class)
+        time.sleep(2)
+
+
+if __name__ == '__main__':
+    main()
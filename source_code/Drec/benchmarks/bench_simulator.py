@@ -0,0 +1,97 @@
+"""
+the HDServer simulator: encoding the packets of a recording at once vs. one line per sample with string formatting, and
+how many samples several virtual headbands on consecutive ports deliver at a multiple of real time, each read by a
+ZmaxHeadband over the 'tcp' backend in its own thread. Checks that the decoded eeg equals the replayed eeg (up to the
+word resolution). Run from the Drec directory (ports 8100 and up have to be free, exits with 1 if the eeg differs):
+
+    python -m benchmarks.bench_simulator [speed] [headbands] [seconds]
+"""
+import multiprocessing
+import sys
+import threading
+import time
+
+import numpy as np
+
+from scripts.Connection.TcpClientSocket import TcpClientSocket
+from scripts.Connection.ZmaxHeadband import ZmaxHeadband
+from scripts.Utils.HD_Server_Simulation import FRAME_LEN, HD_Server_Sim, start_headbands
+
+SAMPLE_RATE = 256
+FIRST_PORT = 8100
+WORD_RESOLUTION = 3952 / 65536  # uV
+
+
+def night(hours: float) -> np.ndarray:
+    return np.random.default_rng(0).normal(0, 20, (2, int(hours * 3600 * SAMPLE_RATE)))
+
+
+def run_headbands(speed: float, headbands: int, hours: float, ready):
+    server = HD_Server_Sim()
+    server.eeg_data = night(hours)
+    start_headbands(server.frames, range(FIRST_PORT, FIRST_PORT + headbands), speed)
+    ready.set()
+    threading.Event().wait()  # until terminated
+
+
+def read_headband(port: int, seconds: float, result: dict):
+    hb = ZmaxHeadband(sock=TcpClientSocket(port=port))
+    hb.sock.connect()
+    chunks, end = [], time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        chunks.append(hb.read_array([1, 0]))  # eegl, eegr
+    hb.stop()
+    result[port] = np.concatenate(chunks)
+
+
+def main():
+    speed = float(sys.argv[1]) if len(sys.argv) > 1 else 100
+    headbands = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+    server = HD_Server_Sim()
+
+    eeg = night(1)
+    start = time.perf_counter()
+    server.eeg_data = eeg
+    encode_time = time.perf_counter() - start
+    n_lines = 10000
+    start = time.perf_counter()
+    for sigl, sigr in eeg[:, :n_lines].T:
+        server.signal_to_hex(sigl, sigr)
+    line_time = (time.perf_counter() - start) / n_lines * eeg.shape[1]
+    print(f'encoding 1 h ({eeg.shape[1]} samples, {len(server.frames) / 1e6:.0f} MB): at once {encode_time:.2f} s, '
+          f'line by line {line_time:.0f} s (extrapolated from {n_lines} lines)')
+
+    # enough data for the whole run, the simulator runs in its own process like the HDServer
+    hours = speed * (seconds + 5) / 3600
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    simulator = context.Process(target=run_headbands, args=(speed, headbands, hours, ready), daemon=True)
+    simulator.start()
+    ready.wait()
+    result = {}
+    readers = [threading.Thread(target=read_headband, args=(port, seconds, result))
+               for port in range(FIRST_PORT, FIRST_PORT + headbands)]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    simulator.terminate()
+
+    expected = night(hours)
+    same = True
+    print(f'{headbands} headbands at {speed:g}x real time for {seconds:g} s')
+    for port in sorted(result):
+        received = result[port]
+        error = np.abs(received - expected[:, :len(received)].T).max() if len(received) else 0
+        same &= error <= WORD_RESOLUTION
+        print(f'  port {port}: {len(received)} samples, {len(received) / seconds / SAMPLE_RATE:.1f}x real time, '
+              f'{len(received) * FRAME_LEN / seconds / 1e6:.1f} MB/s, largest eeg difference {error:.3f} uV')
+    total = sum(len(received) for received in result.values())
+    print(f'  all headbands: {total / seconds:.0f} samples/s ({total / seconds / SAMPLE_RATE:.1f}x one headband)')
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+how long the Qt main thread (and with it the CLI) is blocked after stopping a recording, while the session is saved.
+Records a few seconds from the HDServer simulator with an active webhook that answers slowly. Run from the Drec
+directory (ports 8000 and 5000 have to be free):
+
+    python -m benchmarks.bench_stop_latency
+"""
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+from PyQt5.QtCore import QCoreApplication
+
+from scripts.Logic.HBRecorderInterface import HBRecorderInterface
+from scripts.Utils.HD_Server_Simulation import HD_Server_Sim
+
+
+class SlowWebhook(BaseHTTPRequestHandler):
+    delay = 3.0
+
+    def do_POST(self):
+        time.sleep(self.delay)
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b'received')
+
+    def log_message(self, *args):
+        pass
+
+
+def main(record_seconds=5):
+    app = QCoreApplication([])
+    os.chdir(tempfile.mkdtemp())
+
+    server = HD_Server_Sim()
+    server.eeg_data = np.zeros((2, 600 * server.sampling_rate))
+    threading.Thread(target=server.start_server, daemon=True).start()
+    webhook = HTTPServer(('127.0.0.1', 5000), SlowWebhook)
+    threading.Thread(target=webhook.serve_forever, daemon=True).start()
+    time.sleep(0.5)
+
+    hbif = HBRecorderInterface()
+    hbif.set_capture_backend('tcp')
+    hbif.webhookActive = True
+    hbif.start_recording()
+    end = time.monotonic() + record_seconds
+    while time.monotonic() < end:
+        app.processEvents()
+        time.sleep(0.01)
+
+    stop_time = time.monotonic()
+    hbif.stop_recording()
+    longest_stall = 0
+    while not hbif.sessionFuture.done():
+        start = time.monotonic()
+        app.processEvents()
+        longest_stall = max(longest_stall, time.monotonic() - start)
+        time.sleep(0.01)
+    saved_time = time.monotonic()
+
+    print(f'longest block of the main thread after stop: {longest_stall:.3f} s')
+    print(f'recording saved {saved_time - stop_time:.2f} s after stop (webhook answers after {SlowWebhook.delay} s)')
+    webhook.shutdown()
+
+
+if __name__ == '__main__':
+    main()
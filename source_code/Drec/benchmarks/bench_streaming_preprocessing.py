@@ -0,0 +1,95 @@
+"""
+StreamingPreprocessor vs. preprocessing the whole recording for every epoch like yasa.SleepStaging does (mne resample
+to 100 Hz and the 0.4 - 30 Hz filter). Checks that the streamed output equals the offline sosfilt(upfirdn(...)) of the
+whole night, fed epoch by epoch and in pieces of 1 s, reports the time per epoch at hour 1, 4 and 8 and the agreement
+of IncrementalSleepStaging with preprocessing='streaming' with the staging on SleepStaging's filters. Uses a synthetic
+night, run from the Drec directory (exits with 1 if the output differs):
+
+    python -m benchmarks.bench_streaming_preprocessing [hours]
+"""
+import sys
+import time
+
+import mne
+import numpy as np
+import yasa
+from mne.filter import filter_data, resample
+from scipy.signal import resample_poly, sosfilt, upfirdn
+
+from benchmarks.synthetic_eeg import synthetic_night
+from scripts.Utils.IncrementalStaging import FREQ_BROAD, STAGING_SF, IncrementalSleepStaging
+from scripts.Utils.StreamingPreprocessing import StreamingPreprocessor
+from scripts.Utils.yasa_functions import YasaClassifier
+
+SAMPLE_RATE = 256
+EPOCH_LEN = 30 * SAMPLE_RATE
+EPOCHS_PER_HOUR = 120
+
+
+def stream(eeg, piece_len):
+    preprocessor = StreamingPreprocessor(SAMPLE_RATE)
+    latency = []
+    for start in range(0, len(eeg), piece_len):
+        begin = time.perf_counter()
+        preprocessor.process(eeg[start:start + piece_len])
+        latency.append(time.perf_counter() - begin)
+    return preprocessor.get(0, preprocessor.n_samples)[0], latency
+
+
+def stage_night(eeg, preprocessing):
+    staging = IncrementalSleepStaging(SAMPLE_RATE, preprocessing=preprocessing)
+    preds = []
+    start = time.perf_counter()
+    for epoch in range(len(eeg) // EPOCH_LEN):
+        staging.add_epoch(eeg[epoch * EPOCH_LEN:(epoch + 1) * EPOCH_LEN])
+        preds.append(staging.predict_last())
+    return preds, (time.perf_counter() - start) / len(preds)
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+    mne.set_log_level('error')
+    eeg = synthetic_night(hours, n_channels=1, sf=SAMPLE_RATE)[0][0] * 1e6
+    n_epochs = len(eeg) // EPOCH_LEN
+
+    by_epoch, latency = stream(eeg, EPOCH_LEN)
+    by_second, _ = stream(eeg, SAMPLE_RATE)
+    preprocessor = StreamingPreprocessor(SAMPLE_RATE)
+    offline = sosfilt(preprocessor.sos, upfirdn(preprocessor.h, eeg, preprocessor.up, preprocessor.down))
+    offline = offline[:len(by_epoch)]
+    error = max(np.abs(by_epoch - offline).max(), np.abs(by_second - offline).max()) / np.abs(offline).max()
+    # resample_poly compensates the delay of its filter, the filter state then differs for the first seconds
+    delay = int(preprocessor.delay)
+    shifted = sosfilt(preprocessor.sos, resample_poly(eeg, preprocessor.up, preprocessor.down))[:len(by_epoch) - delay]
+    settled = 60 * STAGING_SF
+    shift_error = np.abs(by_epoch[delay + settled:] - shifted[settled:]).max() / np.abs(offline).max()
+    print(f'{hours} h night, {len(by_epoch)} samples at {STAGING_SF} Hz')
+    print(f'  largest difference to offline sosfilt(upfirdn) of the whole night: {error:.1e} (relative)')
+    print(f'  to sosfilt(resample_poly) {delay} samples later, after the first minute: {shift_error:.1e} (relative)')
+
+    print('preprocessing time of the newest epoch')
+    for hour in (1, 4, 8):
+        epoch = hour * EPOCHS_PER_HOUR
+        if epoch > n_epochs:
+            continue
+        start = time.perf_counter()
+        data = resample(eeg[:epoch * EPOCH_LEN], up=float(STAGING_SF), down=float(SAMPLE_RATE), npad='auto')
+        filter_data(data, STAGING_SF, l_freq=FREQ_BROAD[0], h_freq=FREQ_BROAD[1], verbose=False)
+        full = time.perf_counter() - start
+        print(f'  hour {hour}: whole recording {1000 * full:7.1f} ms   streaming {1000 * latency[epoch - 1]:5.2f} ms')
+    print(f'streaming over the night: median {1000 * np.median(latency):.2f} ms, max {1000 * np.max(latency):.2f} ms')
+
+    preds, exact_time = stage_night(eeg * 1e-6, 'yasa')
+    streaming_preds, streaming_time = stage_night(eeg * 1e-6, 'streaming')
+    scores = YasaClassifier.get_epoch_by_epoch_agreement(
+        [yasa.Hypnogram(preds, scorer='yasa')], [yasa.Hypnogram(streaming_preds, scorer='streaming')]).get_agreement()
+    print('IncrementalSleepStaging, time per epoch including the features')
+    print(f'  yasa filters: {1000 * exact_time:.1f} ms   streaming: {1000 * streaming_time:.1f} ms')
+    print(f'  agreement of the predictions: {scores["accuracy"]:.3f}, kappa {scores["kappa"]:.3f}')
+
+    if error > 1e-9:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+synthetic sleep eeg for the benchmarks, so they run without recordings. The signal cycles through 90 minute sleep
+cycles of wake, N1, N2, N3 and REM like eeg, each stage a mix of its typical rhythms plus 1/f background noise.
+"""
+import numpy as np
+
+SAMPLE_RATE = 256
+
+# stage: (minutes per cycle, [(frequency, amplitude in uV), ...], background amplitude in uV)
+STAGES = [('W', 5, [(10, 25), (20, 6)], 10),
+          ('N1', 5, [(6, 20), (4, 12)], 14),
+          ('N2', 30, [(13, 18), (5, 15), (1.5, 25)], 20),
+          ('N3', 25, [(1, 80), (0.6, 60)], 30),
+          ('N2', 10, [(13, 18), (5, 15), (1.5, 25)], 20),
+          ('R', 15, [(6, 18), (2.5, 10), (20, 4)], 12)]
+
+
+def pink_noise(n: int, rng) -> np.ndarray:
+    spectrum = np.fft.rfft(rng.normal(size=n))
+    freqs = np.arange(len(spectrum))
+    spectrum[1:] /= np.sqrt(freqs[1:])
+    spectrum[0] = 0
+    noise = np.fft.irfft(spectrum, n)
+    return noise / noise.std()
+
+
+def synthetic_night(hours: float, n_channels: int = 2, sf: int = SAMPLE_RATE, seed: int = 0):
+    """
+    :return: the eeg in V, shape (n_channels, hours * 3600 * sf), and the stage of every 30 s epoch
+    """
+    rng = np.random.default_rng(seed)
+    n_samples = int(hours * 3600 * sf)
+    signal = np.empty((n_channels, n_samples))
+    stages = []
+
+    pos = 0
+    while pos < n_samples:
+        for stage, minutes, rhythms, background in STAGES:
+            n = min(minutes * 60 * sf, n_samples - pos)
+            if n <= 0:
+                break
+            t = np.arange(n) / sf
+            for ch in range(n_channels):
+                x = background * pink_noise(n, rng)
+                for freq, amplitude in rhythms:
+                    # slowly varying amplitude and a random phase, different for every channel
+                    envelope = 1 + 0.5 * np.sin(2 * np.pi * t / rng.uniform(5, 40) + rng.uniform(0, 2 * np.pi))
+                    x += amplitude * envelope * np.sin(2 * np.pi * freq * t + rng.uniform(0, 2 * np.pi))
+                signal[ch, pos:pos + n] = x * 1e-6
+            stages += [stage] * (n // (30 * sf))
+            pos += n
+
+    return signal, stages
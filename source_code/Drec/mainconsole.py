@@ -1,8 +1,13 @@
+import sys
+
 from scripts.Logic.communicationLogic import CommunicationLogic
+from scripts.Utils.Metrics import METRICS_PORT
 
 
 def main():
-    logic = CommunicationLogic()
+    # --warm-up loads the scoring model at startup, --no-metrics does not serve the metrics at 127.0.0.1:8001/metrics
+    logic = CommunicationLogic(warmUpScoring='--warm-up' in sys.argv,
+                               metricsPort=None if '--no-metrics' in sys.argv else METRICS_PORT)
     logic.start()
 
 
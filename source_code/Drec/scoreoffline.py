@@ -0,0 +1,19 @@
+import argparse
+
+from scripts.Logic.OfflineScoring import score_recordings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='scores previous recordings (recording.edf or EEG L.edf/EEG R.edf of '
+                                                 'the ZMax software) in parallel, one recording per process')
+    parser.add_argument('recordings', nargs='+', help='directories (searched recursively), edf files or glob patterns')
+    parser.add_argument('--processes', type=int, default=None, help='number of processes, defaults to the cpus')
+    parser.add_argument('--force', action='store_true', help='also score recordings whose outputs are up to date')
+    parser.add_argument('--model', default='auto', help="path of a yasa classifier or 'auto'")
+    args = parser.parse_args()
+
+    score_recordings(args.recordings, processes=args.processes, force=args.force, path_to_model=args.model)
+
+
+if __name__ == '__main__':
+    main()
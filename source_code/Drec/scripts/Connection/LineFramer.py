@@ -0,0 +1,41 @@
+class LineFramer:
+    """
+    Cuts a byte stream that arrives in arbitrary pieces (e.g. tcp payloads) into complete lines. Incomplete lines at
+    the end of a piece are kept and completed with the following pieces instead of being handed on (and dropped by the
+    decoder).
+    """
+    def __init__(self, delimiter: bytes = b'\n', max_line_length: int = 4096):
+        self.delimiter = delimiter
+        self.max_line_length = max_line_length
+        self.remainder = b''
+
+        # statistics
+        self.lines = 0  # complete lines returned
+        self.split_lines = 0  # lines that were split over several pieces and would be lost without framing
+        self.dropped_bytes = 0  # bytes discarded because no delimiter was found within max_line_length
+
+    def feed(self, piece) -> bytes:
+        """
+        :param piece: the next bytes of the stream (bytes, bytearray or memoryview)
+        :return: all lines completed by this piece including their delimiters, b'' if no line was completed
+        """
+        piece = bytes(piece)
+        end = piece.rfind(self.delimiter) + len(self.delimiter)
+        if end < len(self.delimiter):  # no delimiter in this piece
+            self.remainder += piece
+            if len(self.remainder) > self.max_line_length:
+                self.dropped_bytes += len(self.remainder)
+                self.remainder = b''
+            return b''
+
+        if self.remainder:
+            self.split_lines += 1
+            lines = self.remainder + piece[:end]
+        else:
+            lines = piece[:end]
+        self.remainder = piece[end:]
+        self.lines += lines.count(self.delimiter)
+        return lines
+
+    def reset(self):
+        self.remainder = b''
@@ -0,0 +1,139 @@
+import ctypes
+import socket
+import struct
+import threading
+
+from scripts.Connection.SniffSocket import SniffSocket
+from scripts.Connection.TcpConnection import Connection
+from scripts.Utils.Metrics import CAPTURE_TIME
+from scripts.Utils.TCP_Packet import IP_Packet, TCP_Packet, FIN, SYN, RST, ACK
+
+ETH_P_ALL = 0x0003
+ETH_HEADER_LENGTH = 14
+SO_ATTACH_FILTER = 26
+
+
+def bpf_src_port_filter(port: int) -> list:
+    """
+    classic bpf program (as in 'tcpdump -dd ip and tcp src port <port>') that only lets ipv4 tcp packets sent from
+    the given port pass, so the kernel drops everything else before it is copied to user space.
+    """
+    return [
+        (0x28, 0, 0, 12),           # ldh [12]                 ethertype
+        (0x15, 0, 8, 0x0800),       # jeq #ipv4                else drop
+        (0x30, 0, 0, 23),           # ldb [23]                 ip protocol
+        (0x15, 0, 6, 6),            # jeq #tcp                 else drop
+        (0x28, 0, 0, 20),           # ldh [20]                 fragment offset
+        (0x45, 4, 0, 0x1FFF),       # jset #0x1fff             drop fragments
+        (0xB1, 0, 0, 14),           # ldxb 4*([14]&0xf)        ip header length
+        (0x48, 0, 0, 14),           # ldh [x + 14]             tcp source port
+        (0x15, 0, 1, port),         # jeq #port                else drop
+        (0x06, 0, 0, 0x40000),      # ret #262144              accept
+        (0x06, 0, 0, 0),            # ret #0                   drop
+    ]
+
+
+class RawSniffSocket(SniffSocket):
+    """
+    Captures the data the HDServer sends to its clients with a raw AF_PACKET socket on the loopback interface (linux
+    only, requires root or CAP_NET_RAW). Unlike TcpSniffSocket it does not need scapy: the kernel filters for the
+    server -> client direction and the headers are parsed with struct. Exposes the same interface as TcpSniffSocket.
+    """
+    def __init__(self, iface: str = 'lo', port: int = 8000, buffer_size: int = 64 * 1024):
+        super().__init__()
+        self.iface = iface
+        self.port = port
+        self.buffer_size = buffer_size
+        self.sock = None
+        self.malformed_frames = 0  # frames process_frame() failed on
+
+    def connect(self):
+        self.stop_sniffing = False
+        self.sniffer_thread = threading.Thread(target=self._start_sniffer)
+        self.sniffer_thread.daemon = True
+        self.sniffer_thread.start()
+
+    def _open_socket(self):
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+
+        program = bpf_src_port_filter(self.port)
+        filter_buffer = ctypes.create_string_buffer(b''.join(struct.pack('=HBBI', *ins) for ins in program))
+        sock_fprog = struct.pack('HL', len(program), ctypes.addressof(filter_buffer))
+        sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, sock_fprog)
+
+        sock.bind((self.iface, 0))
+        sock.settimeout(1.0)
+        return sock
+
+    def _start_sniffer(self):
+        try:
+            self.sock = self._open_socket()
+        except (OSError, AttributeError) as e:  # AttributeError: no AF_PACKET on this os
+            print(f"[ERROR] could not open a raw socket on {self.iface}: {e}")
+            return
+
+        buffer = bytearray(self.buffer_size)
+        view = memoryview(buffer)
+        try:
+            while not self.stop_sniffing:
+                try:
+                    n_bytes, address = self.sock.recvfrom_into(buffer)
+                except socket.timeout:
+                    continue
+                # on the loopback interface every packet is seen twice, once outgoing and once incoming
+                if address[2] == socket.PACKET_OUTGOING:
+                    continue
+                # a malformed frame is dropped, the capture goes on with the next one
+                try:
+                    with CAPTURE_TIME.time():
+                        self.process_frame(bytes(view[:n_bytes]))
+                except Exception as e:
+                    self.malformed_frames += 1
+                    print(f"[ERROR] dropped a frame that could not be processed: {e}")
+        except OSError as e:
+            print(f"[ERROR] An error occurred: {e}")
+        finally:
+            self.sock.close()
+
+    def process_frame(self, frame: bytes):
+        """handles one ethernet frame as captured on the loopback interface"""
+        ip_packet = IP_Packet(frame[ETH_HEADER_LENGTH:])
+        if ip_packet.version != 4 or ip_packet.protocol != socket.IPPROTO_TCP:
+            return
+        tcp_packet = TCP_Packet(ip_packet.data, ip_packet.iph_length)
+        if tcp_packet.source_port != self.port:  # only the server -> client direction carries the data
+            return
+
+        conn_id = (ip_packet.source_address, tcp_packet.source_port,
+                   ip_packet.dest_address, tcp_packet.dest_port)
+        flags = tcp_packet.flags
+
+        # SYN-ACK of the server starts a new connection
+        if flags & SYN and flags & ACK:
+            self.connections[conn_id] = Connection(*conn_id, tcp_packet.sequence)
+            print(f"[INFO] New connection started: {conn_id}")
+            return
+
+        conn = self.connections.get(conn_id)
+        if conn is None:
+            return
+
+        if tcp_packet.data:
+            conn.parse_payload(tcp_packet.sequence, tcp_packet.data, self.data_queue)
+
+        if flags & (FIN | RST):
+            print(f"[INFO] Connection closed: {conn_id}")
+            del self.connections[conn_id]
+
+    def get_capture_stats(self):
+        stats = super().get_capture_stats()
+        stats['malformed_frames'] = self.malformed_frames
+        return stats
+
+
+if __name__ == '__main__':
+    sock = RawSniffSocket()
+    sock.connect()
+    while True:
+        print(sock.read_one_line())
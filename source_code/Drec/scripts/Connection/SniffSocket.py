@@ -0,0 +1,49 @@
+from queue import Queue, Empty
+
+
+class SniffSocket:
+    """
+    What TcpSniffSocket and RawSniffSocket share: the capture thread of a subclass reassembles the traffic of the
+    HDServer per connection and puts the complete lines into data_queue, read_one_line() hands them on in batches.
+    """
+    def __init__(self):
+        self.sniffer_thread = None
+        self.connections = {}  # (src, sport, dst, dport) -> Connection of the server -> client direction
+        self.data_queue = Queue()
+        self.stop_sniffing = True
+
+    def read_one_line(self, timeout: float = 1.0):
+        """
+        blocks until data arrives and returns all complete lines received so far as one string. Returns '' if nothing
+        arrived within the timeout or the sniffer is stopped.
+        """
+        if self.stop_sniffing:
+            return ''
+
+        try:
+            chunks = [self.data_queue.get(timeout=timeout)]
+        except Empty:
+            return ''
+
+        # hand on everything that is already waiting as one batch
+        while True:
+            try:
+                chunks.append(self.data_queue.get_nowait())
+            except Empty:
+                break
+        return b''.join(chunks).decode("utf-8")
+
+    def get_capture_stats(self):
+        """framing and reassembly statistics summed over all tracked connections"""
+        stats = {}
+        for conn in list(self.connections.values()):
+            conn_stats = conn.get_stats()
+            conn_stats.update(lines=conn.framer.lines,
+                              split_lines=conn.framer.split_lines,
+                              dropped_bytes=conn.framer.dropped_bytes)
+            for key, val in conn_stats.items():
+                stats[key] = stats.get(key, 0) + val
+        return stats
+
+    def stop(self):
+        self.stop_sniffing = True
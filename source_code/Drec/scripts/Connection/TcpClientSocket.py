@@ -0,0 +1,90 @@
+import socket
+import time
+
+from scripts.Connection.LineFramer import LineFramer
+from scripts.Utils.Metrics import CAPTURE_TIME
+
+
+class TcpClientSocket:
+    """
+    Connects to the HDServer directly as a regular TCP client instead of sniffing the loopback traffic. Exposes the
+    same interface as TcpSniffSocket and works on every os.
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 8000, buffer_size: int = 64 * 1024,
+                 timeout: float = 1.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self.buffer = bytearray(buffer_size)  # preallocated, filled by recv_into
+        self.framer = LineFramer()
+        self.stop_reading = True
+
+    def connect(self):
+        self.stop_reading = False
+        self._open(report_errors=True)
+
+    def _open(self, report_errors: bool = False):
+        try:
+            self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            self.sock.sendall(b'HELLO\n')  # the server starts streaming after receiving HELLO
+        except OSError as e:
+            if report_errors:
+                print(f'[ERROR] could not connect to HDServer at {self.host}:{self.port}: {e}')
+            self._close()
+            return
+        self.framer.reset()
+        print(f'[INFO] Connected to HDServer at {self.host}:{self.port}')
+
+    def read_one_line(self):
+        """
+        returns all complete lines received since the last call as one string. A line that is not complete yet is
+        kept and returned with the next call. Returns '' if nothing arrived within the timeout or the socket is
+        stopped. If the connection is lost, it is reopened after waiting for the timeout.
+        """
+        if self.stop_reading:
+            return ''
+
+        if self.sock is None:
+            time.sleep(self.timeout)
+            self._open()
+            return ''
+
+        try:
+            n_bytes = self.sock.recv_into(self.buffer)
+        except socket.timeout:
+            return ''
+        except OSError as e:
+            print(f'[ERROR] An error occurred: {e}')
+            self._close()
+            return ''
+
+        if n_bytes == 0:
+            print('[INFO] Connection closed by the server.')
+            self._close()
+            return ''
+
+        with CAPTURE_TIME.time():
+            return self.framer.feed(memoryview(self.buffer)[:n_bytes]).decode('utf-8', errors='replace')
+
+    def stop(self):
+        self.stop_reading = True
+        self._close()
+
+    def _close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+
+if __name__ == '__main__':
+    sock = TcpClientSocket()
+    sock.connect()
+    i = 0
+    while i <= 1000:
+        print(sock.read_one_line())
+        i += 1
+    sock.stop()
@@ -1,5 +1,24 @@
+import heapq
+import time
+
+from scripts.Connection.LineFramer import LineFramer
+
+SEQ_MOD = 2**32
+
+
+def seq_diff(a: int, b: int) -> int:
+    """signed distance from sequence number b to a, taking the wraparound at 2**32 into account"""
+    return (a - b + 2**31) % SEQ_MOD - 2**31
+
+
 class Connection:
-    def __init__(self, src_host, src_port, dst_host, dst_port, first_seq: int = None):
+    def __init__(self, src_host, src_port, dst_host, dst_port, first_seq: int = None,
+                 max_buffered_bytes: int = 1024 * 1024, max_buffered_segments: int = 1024, gap_timeout: float = 1.0):
+        """
+        :param max_buffered_bytes: max size of all out of order segments waiting for a missing segment
+        :param max_buffered_segments: max number of out of order segments waiting for a missing segment
+        :param gap_timeout: seconds to wait for a missing segment before skipping it
+        """
         self.src_host = src_host
         self.src_port = src_port
         self.dst_host = dst_host
@@ -7,8 +26,23 @@ class Connection:
         if not first_seq:
             self.expected_seq = None
         else:
-            self.expected_seq = first_seq + 1
-        self.packet_buffer = {}
+            self.expected_seq = (first_seq + 1) % SEQ_MOD
+        self.packet_buffer = {}  # seq -> payload of segments that arrived before the expected one
+        self._order = []  # heap of (distance from _order_base, seq) of the segments in packet_buffer
+        self._order_base = None  # expected_seq when the first segment of packet_buffer was buffered
+        self.framer = LineFramer()
+
+        self.max_buffered_bytes = max_buffered_bytes
+        self.max_buffered_segments = max_buffered_segments
+        self.gap_timeout = gap_timeout
+        self.gap_since = None  # time the gap before the first segment in packet_buffer became the oldest one
+
+        # statistics
+        self.reorders = 0  # segments that arrived ahead of a missing one
+        self.duplicates = 0  # segments (or parts of them) that were already delivered
+        self.gaps = 0  # number of times a missing segment was skipped
+        self.gap_bytes = 0  # bytes lost in skipped gaps
+        self.bytes_buffered = 0  # current size of packet_buffer
 
     def get_id(self):
         return self.src_host, self.src_port, self.dst_host, self.dst_port
@@ -16,26 +50,104 @@ class Connection:
     def get_inv_id(self):
         return self.dst_host, self.dst_port, self.src_host, self.src_port
 
-    def parse_payload(self, seq, payload, data_queue):
-        # past or future packets
+    def get_stats(self):
+        return {'reorders': self.reorders,
+                'duplicates': self.duplicates,
+                'gaps': self.gaps,
+                'gap_bytes': self.gap_bytes,
+                'bytes_buffered': self.bytes_buffered,
+                'segments_buffered': len(self.packet_buffer)}
+
+    def parse_payload(self, seq, payload, data_queue, now: float = None):
+        if now is None:
+            now = time.monotonic()
+
         if self.expected_seq is None:
             self.expected_seq = seq
 
-        if seq < self.expected_seq or seq > self.expected_seq:
-            self.packet_buffer[seq] = payload
+        offset = seq_diff(seq, self.expected_seq)
+
+        # past packets: retransmits of data that was already delivered, possibly overlapping new data
+        if offset + len(payload) <= 0:
+            self.duplicates += 1
+            return None
+        if offset < 0:
+            self.duplicates += 1
+            payload = payload[-offset:]
+            offset = 0
+
+        # future packets
+        if offset > 0:
+            self._buffer(seq, payload, now)
+            if (self.bytes_buffered > self.max_buffered_bytes
+                    or len(self.packet_buffer) > self.max_buffered_segments
+                    or now - self.gap_since > self.gap_timeout):
+                self._skip_gap(data_queue, now)
             return None
 
         # current packets
-        self.expected_seq = (self.expected_seq + len(payload)) % (2**32)
-        data_queue.put(payload)
+        self._deliver(payload, data_queue)
 
         # handle buffer
-        while self.expected_seq in self.packet_buffer:
-            buffered_payload = self.packet_buffer.pop(self.expected_seq)
-            data_queue.put(buffered_payload)
-            self.expected_seq = (self.expected_seq + len(payload)) % (2 ** 32)
+        self._drain(data_queue, now)
+
+    def _buffer(self, seq, payload, now):
+        buffered = self.packet_buffer.get(seq)
+        if buffered is not None:
+            self.duplicates += 1
+            if len(buffered) >= len(payload):
+                return
+            self.bytes_buffered -= len(buffered)
+        else:
+            self.reorders += 1
+            # all buffered segments are within 2**31 of the base, so their distances from it keep their order
+            if not self.packet_buffer:
+                self._order_base = self.expected_seq
+            heapq.heappush(self._order, (seq_diff(seq, self._order_base), seq))
+
+        self.packet_buffer[seq] = payload
+        self.bytes_buffered += len(payload)
+        if self.gap_since is None:
+            self.gap_since = now
+
+    def _drain(self, data_queue, now):
+        while self._order:
+            seq = self._order[0][1]
+            offset = seq_diff(seq, self.expected_seq)
+            if offset > 0:  # still missing data before the next buffered segment
+                # the timeout of this gap starts now, not when the previous one began
+                self.gap_since = now
+                return
+
+            heapq.heappop(self._order)
+            payload = self.packet_buffer.pop(seq)
+            self.bytes_buffered -= len(payload)
+            if offset + len(payload) <= 0:
+                self.duplicates += 1
+                continue
+            if offset < 0:  # overlaps with already delivered data
+                self.duplicates += 1
+                payload = payload[-offset:]
+            self._deliver(payload, data_queue)
+
+        self.gap_since = None
+
+    def _skip_gap(self, data_queue, now):
+        # give up on the missing data and continue with the oldest buffered segment
+        seq = self._order[0][1]
+        self.gaps += 1
+        self.gap_bytes += seq_diff(seq, self.expected_seq)
+        self.expected_seq = seq
+        self.framer.reset()  # the incomplete line before the gap can not be completed anymore
+        self._drain(data_queue, now)
+
+    def _deliver(self, payload, data_queue):
+        self.expected_seq = (self.expected_seq + len(payload)) % SEQ_MOD
+        # only complete lines are handed on, the rest waits for the next payload
+        lines = self.framer.feed(payload)
+        if lines:
+            data_queue.put(lines)
 
 
 if __name__ == "__main__":
     pass
-
@@ -1,19 +1,14 @@
 import threading
-import time
 
 from scapy.all import sniff, IP, TCP
-from queue import Queue
 
+from scripts.Connection.SniffSocket import SniffSocket
 from scripts.Connection.TcpConnection import Connection
+from scripts.Utils.Metrics import CAPTURE_TIME
 
 
-class TcpSniffSocket:
-    def __init__(self):
-        self.sniffer_thread = None
-        self.connections = {}
-        self.data_queue = Queue()
-        self.stop_sniffing = True
-
+class TcpSniffSocket(SniffSocket):
+    """captures the data the HDServer sends to its clients with scapy on the windows loopback adapter (npcap)"""
     def connect(self):
         self.sniffer_thread = threading.Thread(target=self._start_sniffer)
         self.sniffer_thread.daemon = True
@@ -22,23 +17,14 @@ class TcpSniffSocket:
 
     def read_live(self):
         while True:
-            if not self.data_queue.empty():
-                print(self.data_queue.get())
-
-    def read_one_line(self):
-        if self.stop_sniffing:
-            return ''
-
-        while self.data_queue.empty():
-            time.sleep(0.1)
-        return self.data_queue.get().decode("utf-8")
+            print(self.data_queue.get())
 
     def _start_sniffer(self):
         try:
             # Start sniffing traffic on the localhost interface
             sniff(filter=f"tcp port 8000",
                   iface="\\Device\\NPF_Loopback",
-                  prn=self._sniffer_callback,
+                  prn=self._timed_sniffer_callback,
                   stop_filter=lambda p: self.stop_sniffing,
                   store=False)
         except KeyboardInterrupt:
@@ -46,6 +32,10 @@ class TcpSniffSocket:
         except Exception as e:
             print(f"[ERROR] An error occurred: {e}")
 
+    def _timed_sniffer_callback(self, packet):
+        with CAPTURE_TIME.time():
+            self._sniffer_callback(packet)
+
     def _sniffer_callback(self, packet):
         # Check if the packet has the necessary layers (IP and TCP)
         if IP in packet and TCP in packet:
@@ -91,9 +81,6 @@ class TcpSniffSocket:
                     # Clean up the connection data
                     del self.connections[active_conn]
 
-    def stop(self):
-        self.stop_sniffing = True
-
 
 if __name__ == '__main__':
     sock = TcpSniffSocket()
@@ -3,7 +3,10 @@ import time
 import numpy as np
 import enum
 
+from scripts.Connection.RawSniffSocket import RawSniffSocket
+from scripts.Connection.TcpClientSocket import TcpClientSocket
 from scripts.Connection.TcpSniffSocket import TcpSniffSocket
+from scripts.Utils.Metrics import METRICS
 
 
 class ZmaxDataID(enum.Enum):
@@ -31,22 +34,69 @@ class ZmaxDataID(enum.Enum):
         return self.name
 
 
-def connect():
-    sock = TcpSniffSocket()
+# byte index of the (2 byte) word of each channel within a data packet
+WORD_OFFSETS = {
+    ZmaxDataID.eegr: 1,
+    ZmaxDataID.eegl: 3,
+    ZmaxDataID.dx: 5,
+    ZmaxDataID.dy: 7,
+    ZmaxDataID.dz: 9,
+    ZmaxDataID.bodytemp: 36,
+    ZmaxDataID.bat: 23,
+    ZmaxDataID.noise: 19,
+    ZmaxDataID.light: 21,
+    ZmaxDataID.nasal_l: 11,  # requires external nasal sensor
+    ZmaxDataID.nasal_r: 13,  # requires external nasal sensor
+    ZmaxDataID.oxy_ir_ac: 27,  # requires external nasal sensor
+    ZmaxDataID.oxy_r_ac: 25,  # requires external nasal sensor
+    ZmaxDataID.oxy_dark_ac: 34,  # requires external nasal sensor
+    ZmaxDataID.oxy_ir_dc: 17,  # requires external nasal sensor
+    ZmaxDataID.oxy_r_dc: 15,  # requires external nasal sensor
+    ZmaxDataID.oxy_dark_dc: 32,  # requires external nasal sensor
+}
+
+# lookup table from an ascii character to the value of the hex digit, -1 for non hex characters
+_HEX_LUT = np.full(256, -1, dtype=np.int32)
+for _i, _c in enumerate('0123456789ABCDEF'):
+    _HEX_LUT[ord(_c)] = _i
+    _HEX_LUT[ord(_c.lower())] = _i
+
+
+_DECODE_TIME = METRICS.histogram('decode_seconds', 'decoding of the lines of one ZmaxHeadband.read')
+
+# available ways to receive the data of the HDServer
+CAPTURE_BACKENDS = ['sniff', 'tcp', 'raw']
+
+
+def connect(backend: str = 'sniff'):
+    """
+    :param backend: 'sniff' to capture the loopback traffic with scapy (windows only), 'tcp' to connect to the
+        HDServer directly as a client or 'raw' to capture the loopback traffic with a raw socket (linux only)
+    """
+    if backend == 'tcp':
+        sock = TcpClientSocket()
+    elif backend == 'raw':
+        sock = RawSniffSocket()
+    else:
+        sock = TcpSniffSocket()
     sock.connect()
     return sock
 
 
 class ZmaxHeadband():
-    def __init__(self):
+    def __init__(self, sock=None, backend: str = 'sniff'):
         self.buf_size = 3 * 256  # 3 seconds at 256 frames per second (plotting can be SLOW)
         self.buf_eeg1 = np.zeros((self.buf_size, 1))
         self.buf_eeg2 = np.zeros((self.buf_size, 1))
         self.buf_dx = np.zeros((self.buf_size, 1))
         self.buf_dy = np.zeros((self.buf_size, 1))
         self.buf_dz = np.zeros((self.buf_size, 1))
-        self.sock = connect()
+        self.sock = sock if sock is not None else connect(backend)
         self.msgn = 1  # message number for sending stimulation
+        if hasattr(self.sock, 'data_queue'):
+            # chunks the sniffer captured that were not read yet
+            METRICS.gauge('capture_queue_chunks', 'captured chunks waiting to be decoded',
+                          function=self.sock.data_queue.qsize)
 
     def read(self, reqIDs=None):
         """
@@ -54,58 +104,111 @@ class ZmaxHeadband():
         [0=eegr, 1=eegl, 2=dx, 3=dy, 4=dz, 5=bodytemp, 6=bat, 7=noise, 8=light, 9=nasal_l, 10=nasal_r, 11=oxy_ir_ac,
             12=oxy_r_ac, 13=oxy_dark_ac, 14=oxy_ir_dc, 15=oxy_r_dc, 16=oxy_dark_dc]
         """
+        return self.read_array(reqIDs).tolist()
+
+    def read_array(self, reqIDs=None):
+        """
+        same as read(), but returns the samples as a np.ndarray of shape (n_samples, len(reqIDs))
+        """
         if reqIDs is None:
             reqIDs = [0, 1]
 
-        reqVals = []
         buf = self.sock.read_one_line()
-        for line in buf.split('\n'):
-            if str.startswith(line, 'DEBUG'):  # ignore debugging messages from server
-                pass
-            else:
-                if str.startswith(line, 'D'):  # only process data packets
-                    p = line.split('.')
-
-                    if len(p) == 2:
-                        line = p[1]
-                        packet_type = self.getbyteat(line, 0)
-                        if (packet_type >= 1) and (packet_type <= 11):  # packet type within correct range
-                            if len(line) == 120: #119
-                                # EEG channels
-                                eegr = self.getwordat(line, 1)
-                                eegl = self.getwordat(line, 3)
-                                # Accelerometer channels
-                                dx = self.getwordat(line, 5)
-                                dy = self.getwordat(line, 7)
-                                dz = self.getwordat(line, 9)
-                                # PPG channels (not plotted)
-                                oxy_ir_ac = self.getwordat(line, 27)  # requires external nasal sensor
-                                oxy_r_ac = self.getwordat(line, 25)  # requires external nasal sensor
-                                oxy_dark_ac = self.getwordat(line, 34)  # requires external nasal sensor
-                                oxy_ir_dc = self.getwordat(line, 17)  # requires external nasal sensor
-                                oxy_r_dc = self.getwordat(line, 15)  # requires external nasal sensor
-                                oxy_dark_dc = self.getwordat(line, 32)  # requires external nasal sensor
-                                # other channels (not plotted)
-                                bodytemp = self.getwordat(line, 36)
-                                nasal_l = self.getwordat(line, 11)  # requires external nasal sensor
-                                nasal_r = self.getwordat(line, 13)  # requires external nasal sensor
-                                light = self.getwordat(line, 21)
-                                bat = self.getwordat(line, 23)
-                                noise = self.getwordat(line, 19)
-                                # convert
-                                eegr, eegl = self.ScaleEEG(eegr), self.ScaleEEG(eegl)
-                                dx, dy, dz = self.ScaleAccel(dx), self.ScaleAccel(dy), self.ScaleAccel(dz)
-                                bodytemp = self.BodyTemp(bodytemp)
-                                bat = self.BatteryVoltage(bat)
-                                # for function return
-                                result = [eegr, eegl, dx, dy, dz, bodytemp, bat, noise, light, nasal_l, nasal_r,
-                                          oxy_ir_ac, oxy_r_ac, oxy_dark_ac, oxy_ir_dc, oxy_r_dc, oxy_dark_dc]
-                                vals = []
-                                for i in reqIDs:
-                                    vals.append(result[i])
-                                reqVals.append(vals)
-
-        return reqVals
+        if not buf:
+            return np.empty((0, len(reqIDs)))
+        with _DECODE_TIME.time():
+            return self.decode_lines(buf.split('\n'), reqIDs)
+
+    def decode_lines(self, lines, reqIDs):
+        """
+        decodes a batch of lines received from the HDServer at once. Debug messages and malformed packets are
+        dropped, only the word offsets of the channels in reqIDs are decoded.
+
+        :param lines: iterable of strings as sent by the server, e.g. 'D.06-80-56-7F-EA-...'
+        :param reqIDs: the channels to decode, see read()
+        :return: np.ndarray of shape (n_samples, len(reqIDs))
+        """
+        payloads = []
+        for line in lines:
+            # only process data packets of the form 'D.<payload>', this also skips 'DEBUG' messages
+            if line[:2] != 'D.':
+                continue
+            payload = line[2:]
+            if len(payload) == 120 and '.' not in payload:
+                payloads.append(payload)
+
+        if not payloads:
+            return np.empty((0, len(reqIDs)))
+
+        # view the ascii characters as a (n_samples, 120) byte matrix: byte i of a packet is at chars 3*i, 3*i+1
+        chars = np.frombuffer(''.join(payloads).encode('ascii', errors='replace'), dtype=np.uint8)
+        chars = chars.reshape(len(payloads), 120)
+
+        packet_type = self._bytes_at(chars, 0)
+        valid = (packet_type >= 1) & (packet_type <= 11)
+
+        words = []
+        for i in reqIDs:
+            word = self._words_at(chars, WORD_OFFSETS[ZmaxDataID(i)])
+            valid &= word >= 0
+            words.append(word)
+
+        result = np.empty((len(payloads), len(reqIDs)))
+        for col, (i, word) in enumerate(zip(reqIDs, words)):
+            result[:, col] = self._scale(ZmaxDataID(i), word)
+
+        return result[valid]
+
+    def decode_line(self, line, reqIDs):
+        """
+        decodes a single data line field by field. Returns the list of requested values or None if the line is not a
+        valid data packet. Kept as reference for decode_lines().
+        """
+        if not str.startswith(line, 'D'):  # only process data packets
+            return None
+        p = line.split('.')
+        if len(p) != 2:
+            return None
+        line = p[1]
+        packet_type = self.getbyteat(line, 0)
+        if not ((packet_type >= 1) and (packet_type <= 11)) or len(line) != 120:
+            return None
+
+        result = []
+        for i in reqIDs:
+            dataID = ZmaxDataID(i)
+            result.append(self._scale(dataID, self.getwordat(line, WORD_OFFSETS[dataID])))
+        return result
+
+    def _scale(self, dataID, word):
+        """converts a word value (or an array of them) of the given channel to its physical unit"""
+        if dataID in (ZmaxDataID.eegr, ZmaxDataID.eegl):
+            return self.ScaleEEG(word)
+        if dataID in (ZmaxDataID.dx, ZmaxDataID.dy, ZmaxDataID.dz):
+            return self.ScaleAccel(word)
+        if dataID == ZmaxDataID.bodytemp:
+            return self.BodyTemp(word)
+        if dataID == ZmaxDataID.bat:
+            return self.BatteryVoltage(word)
+        return word
+
+    @staticmethod
+    def _bytes_at(chars, idx):
+        """vectorized getbyteat() over a (n_samples, 120) character matrix. Invalid hex digits result in -1."""
+        high = _HEX_LUT[chars[:, idx * 3]]
+        low = _HEX_LUT[chars[:, idx * 3 + 1]]
+        byte = high * 16 + low
+        byte[(high < 0) | (low < 0)] = -1
+        return byte
+
+    @staticmethod
+    def _words_at(chars, idx):
+        """vectorized getwordat() over a (n_samples, 120) character matrix. Invalid hex digits result in -1."""
+        high = ZmaxHeadband._bytes_at(chars, idx)
+        low = ZmaxHeadband._bytes_at(chars, idx + 1)
+        word = high * 256 + low
+        word[(high < 0) | (low < 0)] = -1
+        return word
 
     def stop(self):
         self.sock.stop()
@@ -1,16 +1,27 @@
-import os
+import time
+from concurrent.futures import Future, wait
 from pathlib import Path
 
-import mne
-from datetime import datetime
-
 import numpy as np
 import requests
+from PyQt5.QtCore import QCoreApplication
 
+from scripts.Connection.ZmaxHeadband import ZmaxDataID
 from scripts.Logic.RecorderThread import RecordThread
-from scripts.Utils.yasa_functions import YasaClassifier
+from scripts.Logic.ScoringWorker import ScoringWorker
+from scripts.Logic.SessionSaver import SessionSaver
+from scripts.Utils.RecordingBuffer import RecordingBuffer
+
+from scripts.Utils.EdfUtils import StreamingEdfWriter
+from scripts.Utils.IncrementalStaging import PREPROCESSING
+from scripts.Utils.Metrics import METRICS, resident_memory
+from scripts.Utils.ModelRegistry import resolve_model_path
 
-from scripts.Utils.EdfUtils import save_edf
+_HANDOFF_TIME = METRICS.histogram('epoch_handoff_seconds', 'from cutting an epoch in the recorder thread until the '
+                                                           'main thread receives it')
+_EDF_WRITE_TIME = METRICS.histogram('edf_write_seconds', 'writing one epoch to the edf file')
+_SCORE_SUBMIT_TIME = METRICS.histogram('score_submit_seconds', 'handing the new epochs to the scoring worker')
+_WEBHOOK_TIME = METRICS.histogram('webhook_seconds', 'sending the newest prediction to the webhook')
 
 
 class HBRecorderInterface:
@@ -24,16 +35,39 @@ class HBRecorderInterface:
         #   14=oxy_ir_dc, 15=oxy_r_dc, 16=oxy_dark_dc
         # ]
         self.scoring_delay = 10
-        self.recording = np.empty(shape=(0, len(self.signalType) + 2)) # +2 because we add 2 columns, sample# and or something
+        self.capture_backend = 'sniff'
+        self.epoch_len = 30 * self.sample_rate
+        # the recording is shared with the recorder thread, which appends to it. Only the first recorded_samples
+        # samples have been handed over as epochs yet
+        self.recording = RecordingBuffer(len(self.signalType) + 2)  # +2 because we add 2 columns, sample# and or something
+        self.recorded_samples = 0
+        self.edfWriter = None
 
         self.hb = None
         self.recorderThread = None
 
         self.isRecording = False
         self.firstRecording = True
-        self.recordingFinished = True
+        self.recordingFinished = True  # the recorder thread delivered all its data
+        self.keep_spool = False  # keep recording.spool after the edf file is saved, see RawSpool
+
+        # recordings are saved in the background, every recording has a future that is resolved once it is saved
+        self.sessionSaver = SessionSaver()
+        self.sessionSaver.progressSignal.connect(self.on_save_progress)
+        self.sessionSaver.finishedSignal.connect(self.on_session_saved)
+        self.sessionFuture = None
+        self.sessionFutures = []
 
         self.scoring_predictions = []
+        # scoring runs in a separate process, started when it is first needed. scored_samples samples of the recording
+        # have been sent to it
+        self.scoringWorker = None
+        self.scoring_deadline = 30.0
+        self.scoring_model = 'auto'  # see ModelRegistry.get_classifier()
+        self.scoring_context = None  # number of epochs the scoring is based on, None for the whole recording
+        self.scoring_preprocessing = 'yasa'  # how the scoring resamples and filters the eeg
+        self.scoring_channels = ['eegl']  # the eeg channels that are scored, several are fused into one prediction
+        self.scored_samples = 0
         self.epochCounter = 0
 
         # program parameters
@@ -43,11 +77,48 @@ class HBRecorderInterface:
         self.webHookBaseAdress = "http://127.0.0.1:5000/webhookcallback/"
         self.webhookActive = False
 
-    def start_recording(self):
+        METRICS.gauge('resident_memory_bytes', 'resident memory of the recorder process', function=resident_memory)
+        METRICS.gauge('saves_pending', 'recordings that are not saved yet, the running one included',
+                      function=lambda: sum(not future.done() for future in self.sessionFutures))
+
+    def start_recording(self, resumePath: str = None):
+        """
+        :param resumePath: optional session directory of an interrupted recording, which is continued
+        """
         if self.isRecording:
             return
+        if not self.recordingFinished:
+            print('the previous recording is still stopping, please try again in a moment.')
+            return
+
+        try:
+            self.recorderThread = RecordThread(signalType=self.signalType, captureBackend=self.capture_backend,
+                                               resumePath=resumePath)
+        except Exception as e:
+            print(f'[ERROR] could not start the recording: {e}')
+            return
+        self.signalType = self.recorderThread.signalType
+        self.recording = self.recorderThread.recording
+        self.recorded_samples = self.recorderThread.epochCounter * self.epoch_len
+        self.scoring_predictions = []
+        self.scored_samples = 0
+        if self.scoringWorker is not None:
+            self.scoringWorker.new_session()
+        self.sessionFuture = Future()
+        self.sessionFutures.append(self.sessionFuture)
 
-        self.recorderThread = RecordThread(signalType=self.signalType)
+        # the recording is written to disk epoch by epoch while it is running
+        try:
+            self.edfWriter = StreamingEdfWriter(self.recorderThread.file_path,
+                                                'recording.edf',
+                                                self.recorderThread.columns,
+                                                self.sample_rate)
+            # a resumed recording starts with the epochs recorded before the interruption
+            for start in range(0, self.recorded_samples, self.epoch_len):
+                self.edfWriter.write(self.recording.get(start, start + self.epoch_len))
+        except Exception as e:
+            print(f'[ERROR] when opening edf: {e}')
+            self.edfWriter = None
 
         if self.firstRecording:
             self.firstRecording = False
@@ -61,7 +132,20 @@ class HBRecorderInterface:
         self.recorderThread.sendEpochDataSignal.connect(self.get_epoch_data)
         self.recordingFinished = False
 
-        print('recording started')
+        if resumePath is None:
+            print('recording started')
+        else:
+            print(f'recording resumed after epoch {self.recorderThread.epochCounter}')
+
+    def resume_recording(self, path: str):
+        self.start_recording(resumePath=path)
+
+    def recover_recording(self, path: str):
+        """converts the spool of an interrupted recording into an edf file in the background"""
+        future = Future()
+        self.sessionFutures.append(future)
+        self.sessionSaver.recover(future, path)
+        print(f'recovering the recording in {path} in the background')
 
     def stop_recording(self):
         if not self.isRecording:
@@ -81,49 +165,100 @@ class HBRecorderInterface:
         # ensures directory exists
         Path(f"{filePath}").mkdir(parents=True, exist_ok=True)
 
-        # save the recording
-        save_edf(self.recording,
-                 self.signalType,
-                 filePath,
-                 'recording.edf')
-
-        # save the predictions
-        if self.scoring_predictions:
-            with open(os.path.join(filePath, "predictions.txt"), "a") as outfile:
-                outfile.write("\n".join(str(epoch) + '-' + str(pred) + '-' + str(time) for time, epoch, pred in self.scoring_predictions))
-
-        # send signal to webhook if it is running
-        if self.webhookActive:
-            requests.post(self.webHookBaseAdress + 'finished')
+        # the edf file, the predictions and the webhook are finished in the background
+        webhookUrl = self.webHookBaseAdress + 'finished' if self.webhookActive else None
+        # the saver gets the predictions of the session as they are now, the ones still on their way are dropped
+        self.sessionSaver.save(self.sessionFuture, filePath, self.edfWriter, self.recording,
+                               list(self.scoring_predictions), webhookUrl, self.keep_spool)
+        self.edfWriter = None
+        if self.scoringWorker is not None:
+            self.scoringWorker.new_session()
+        print(f'saving the recording to {filePath} in the background')
+
+    def on_save_progress(self, filePath: str, percent: int):
+        if percent < 100:
+            print(f'saving {filePath}: {percent}%')
+
+    def on_session_saved(self, filePath: str):
+        print(f'recording saved to {filePath}')
+
+    def wait_for_saving(self, timeout: float = None) -> bool:
+        """
+        waits until all recordings are saved. Qt events are processed meanwhile, so a recorder thread that is still
+        stopping can deliver its data. Returns False if the timeout passed first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        pending = [future for future in self.sessionFutures if not future.done()]
+        while pending:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            QCoreApplication.processEvents()
+            _, pending = wait(pending, timeout=0.05)
+        return True
 
     def start_scoring(self):
         self.scoreSleep = True
+        self._start_scoring_worker()
         print('scoring started')
 
     def stop_scoring(self):
         self.scoreSleep = False
         print('scoring stopped')
 
-    def get_epoch_data(self, data: list, epoch_counter: int):
-        self.recording = np.concatenate((self.recording, data), axis=0)
+    def get_epoch_data(self, data: np.ndarray, epoch_counter: int):
+        # data is a view of the latest epoch in self.recording, which already holds it
+        self.recorded_samples = epoch_counter * self.epoch_len
+        handoffTime = self.recorderThread.handoffTimes.pop(epoch_counter, None) if self.recorderThread else None
+        if handoffTime is not None:
+            _HANDOFF_TIME.observe(time.perf_counter() - handoffTime)
+
+        if self.edfWriter is not None:
+            try:
+                with _EDF_WRITE_TIME.time():
+                    self.edfWriter.write(data.T)
+            except Exception as e:
+                print(f'[ERROR] when writing edf: {e}')
         if self.scoreSleep and epoch_counter > self.scoring_delay:
-            self._score_curr_data(epoch_counter)
-
-        if self.webhookActive:  # Do this AFTER the scoring is done
-            self._send_to_webhook()
+            with _SCORE_SUBMIT_TIME.time():
+                self._score_curr_data(epoch_counter)
+
+    def _start_scoring_worker(self):
+        # starting the process takes a few seconds, so it is started with the scoring and kept until quit
+        if self.scoringWorker is None:
+            self.scoringWorker = ScoringWorker(self.sample_rate, self.scoring_deadline,
+                                               path_to_model=self.scoring_model, context_epochs=self.scoring_context,
+                                               preprocessing=self.scoring_preprocessing)
+            self.scoringWorker.predictionSignal.connect(self.on_prediction)
+            self.scoringWorker.start()
+
+    def warm_up_scoring(self):
+        """starts the scoring worker, which loads the classifier and runs a first prediction, without scoring yet"""
+        self._start_scoring_worker()
 
     def _score_curr_data(self, epoch_counter):
-        eegr = self.recording[:, 0]
-        eegl = self.recording[:, 1]
-        info = mne.create_info(ch_names=['eegr', 'eegl'], sfreq=self.sample_rate, ch_types='eeg', verbose='ERROR')
-        mne_array = mne.io.RawArray([eegr, eegl], info, verbose='ERROR')
+        self._start_scoring_worker()
+        # the worker stages the scoring channels epoch by epoch, send it the epochs it has not seen yet, usually just the
+        # newest one. The prediction arrives in on_prediction
+        try:
+            channels = [self.signalType.index(ZmaxDataID[name].value) for name in self.scoring_channels]
+        except ValueError:
+            print(f'[ERROR] the scoring channels {self.scoring_channels} are not all recorded')
+            return
+        if len(channels) == 1:
+            channels = channels[0]
+        eeg = self.recording.get(self.scored_samples, self.recorded_samples, channels=channels)
+        self.scoringWorker.score(epoch_counter, eeg)
+        self.scored_samples = self.recorded_samples
 
-        sleep_stages = YasaClassifier.get_preds_per_epoch(mne_array, 'eegl')
+    def on_prediction(self, predictionTime, epoch_counter: int, prediction: str):
+        if not self.isRecording:
+            # the session of the epoch ended, its predictions are already saved or being saved
+            return
+        self.scoring_predictions.append((predictionTime, epoch_counter, prediction))
 
-        predictionToTransmit = sleep_stages[-1]
-        self.scoring_predictions.append((datetime.now(),
-                                         epoch_counter,
-                                         predictionToTransmit))
+        if self.webhookActive:  # Do this AFTER the scoring is done
+            with _WEBHOOK_TIME.time():
+                self._send_to_webhook()
 
     def _send_to_webhook(self):
         if len(self.scoring_predictions) <= 0:
@@ -157,12 +292,105 @@ class HBRecorderInterface:
         if types is None:
             types = []
         self.signalType = types
-        self.recording = np.empty(shape=(0, len(self.signalType)))
+        self.recording = RecordingBuffer(len(self.signalType) + 2)
+        self.recorded_samples = 0
+        self.scored_samples = 0
 
     def set_scoring_delay(self, delay_in_epochs: int):
         self.scoring_delay = delay_in_epochs
 
+    def set_scoring_model(self, path_to_model: str):
+        """
+        :param path_to_model: path of a yasa classifier (joblib file) or 'auto' for the latest one shipped with yasa
+        """
+        try:
+            path = resolve_model_path(path_to_model)
+        except Exception as e:
+            print(f'[ERROR] no classifier found for {path_to_model}: {e}')
+            return
+        if not Path(path).is_file():
+            print(f'{path} does not exist. the scoring model was not changed.')
+            return
+        self.scoring_model = path_to_model
+        if self.scoringWorker is not None:
+            self.scoringWorker.path_to_model = path_to_model
+            self._restart_scoring_session()
+        print(f'scoring with {path}')
+
+    def set_scoring_context(self, minutes: int):
+        """
+        :param minutes: score every epoch based on the last minutes of the recording only, 0 for the whole recording
+        """
+        self.scoring_context = minutes * 60 // 30 if minutes > 0 else None
+        if self.scoringWorker is not None:
+            self.scoringWorker.context_epochs = self.scoring_context
+            self._restart_scoring_session()
+        if self.scoring_context is None:
+            print('scoring based on the whole recording')
+        else:
+            print(f'scoring based on the last {minutes} minutes of the recording')
+
+    def set_scoring_preprocessing(self, preprocessing: str):
+        """
+        :param preprocessing: 'yasa' to resample and filter the eeg like yasa.SleepStaging, 'streaming' to resample and
+        filter every sample once with a causal filter, see IncrementalSleepStaging
+        """
+        if preprocessing not in PREPROCESSING:
+            print(f'unknown preprocessing {preprocessing}, use one of {PREPROCESSING}.')
+            return
+        self.scoring_preprocessing = preprocessing
+        if self.scoringWorker is not None:
+            self.scoringWorker.preprocessing = preprocessing
+            self._restart_scoring_session()
+        print(f'scoring with {preprocessing} preprocessing')
+
+    def set_scoring_channels(self, channels: list):
+        """
+        :param channels: names of the eeg channels to score, e.g. ['eegl', 'eegr']. Several channels are staged together
+        and their probabilities are fused into one prediction
+        """
+        if not channels or any(name not in ('eegl', 'eegr') for name in channels):
+            print(f'unknown scoring channels {channels}, use eegl, eegr or both.')
+            return
+        self.scoring_channels = list(dict.fromkeys(channels))
+        if self.scoringWorker is not None:
+            self._restart_scoring_session()
+        print(f'scoring {", ".join(self.scoring_channels)}')
+
+    def _restart_scoring_session(self):
+        # restage the recording with the new settings from the next epoch on
+        self.scoringWorker.new_session()
+        self.scored_samples = 0
+
+    def print_status(self):
+        """prints the state of the recording and scoring and the metrics, durations in ms"""
+        if self.isRecording:
+            print(f'recording: epoch {self.recorderThread.epochCounter}, {self.recorderThread.receivedSamples} samples '
+                  f'received, {self.recorderThread.expected_samples()} expected')
+        else:
+            print('not recording')
+        if self.scoreSleep:
+            print(f'scoring {", ".join(self.scoring_channels)} after epoch {self.scoring_delay}, '
+                  f'{len(self.scoring_predictions)} predictions')
+        else:
+            print('not scoring')
+        print(METRICS.status())
+
+    def set_capture_backend(self, backend: str):
+        self.capture_backend = backend
+
+    def set_keep_spool(self, keep: bool):
+        self.keep_spool = keep
+        if keep:
+            print('the spool is kept next to recording.edf after saving')
+        else:
+            print('the spool is deleted once recording.edf is saved')
+
     def quit(self):
         if self.recorderThread:
             self.stop_recording()
+        self.wait_for_saving()
+        self.sessionSaver.shutdown()
+        if self.scoringWorker is not None:
+            self.scoringWorker.stop()
 
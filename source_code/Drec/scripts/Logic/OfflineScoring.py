@@ -0,0 +1,145 @@
+import glob
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+
+import mne
+import numpy as np
+import pandas as pd
+from threadpoolctl import threadpool_limits
+
+from scripts.Utils.ModelRegistry import warm_up
+from scripts.Utils.yasa_functions import YasaClassifier
+
+RECORDING_FILE = 'recording.edf'  # written by the recorder, the eeg is in the channel 'eegl'
+ZMAX_FILES = ('EEG L.edf', 'EEG R.edf')  # exported by the hypnodyne software, the left channel is scored
+
+# the outputs written next to the recording
+OUTPUTS = ('hypnogram.csv', 'probabilities.csv', 'predictions.txt')
+
+_thread_limits = None
+
+
+def find_recordings(patterns: list) -> list:
+    """
+    finds the recordings in directories (searched recursively) and glob patterns
+
+    :param patterns: directories, edf files or glob patterns, e.g. 'recordings/*/recording.edf'
+    :return: the edf files of each recording, [recording.edf] or [EEG L.edf, EEG R.edf]
+    """
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            files += glob.glob(os.path.join(pattern, '**', '*.edf'), recursive=True)
+        else:
+            files += glob.glob(pattern, recursive=True)
+
+    recordings = []
+    for file in sorted(set(os.path.abspath(file) for file in files)):
+        directory, name = os.path.split(file)
+        if name == RECORDING_FILE:
+            recordings.append([file])
+        elif name == ZMAX_FILES[0] and os.path.isfile(os.path.join(directory, ZMAX_FILES[1])):
+            recordings.append([file, os.path.join(directory, ZMAX_FILES[1])])
+    return recordings
+
+
+def output_paths(recording: list) -> list:
+    """the hypnogram, probabilities and predictions files of a recording, see OUTPUTS"""
+    directory, name = os.path.split(recording[0])
+    prefix = 'offline_' if name == RECORDING_FILE else 'offline_zmax_'
+    return [os.path.join(directory, prefix + output) for output in OUTPUTS]
+
+
+def is_up_to_date(recording: list) -> bool:
+    """True if all outputs exist and are newer than the edf files"""
+    outputs = output_paths(recording)
+    if not all(os.path.isfile(output) for output in outputs):
+        return False
+    return min(os.path.getmtime(output) for output in outputs) >= max(os.path.getmtime(file) for file in recording)
+
+
+def score_recording(recording: list, path_to_model: str = 'auto', male: bool = True, age: int = 45):
+    """
+    scores a recording and writes its outputs:
+
+    - offline_hypnogram.csv: the stage of every epoch
+    - offline_probabilities.csv: the probability of every stage for every epoch
+    - offline_predictions.txt: like the predictions.txt of a live recording, 'epoch-stage-time' per line, where time is
+      the end of the epoch
+
+    :param recording: the edf files of the recording, see find_recordings()
+    :return: the path of the first edf file, the number of epochs and the seconds it took
+    """
+    start = time.perf_counter()
+    if os.path.basename(recording[0]) == RECORDING_FILE:
+        raw = mne.io.read_raw_edf(recording[0], include=['eegl'], preload=True, verbose='error')
+    else:
+        raw = mne.io.read_raw_edf(recording[0], preload=True, verbose='error')
+    eeg = raw._data[0]
+    preds, probs = YasaClassifier.get_preds_and_probs_from_array(eeg, raw.info['sfreq'], male, age, path_to_model)
+
+    # epochs are counted from 1 like in predictions.txt, the edf start time is the local time of the recording
+    epochs = pd.Index(np.arange(1, len(preds) + 1), name='epoch')
+    meas_date = raw.info['meas_date'].replace(tzinfo=None)
+    predictions = "\n".join(str(epoch) + '-' + str(pred) + '-' + str(meas_date + timedelta(seconds=30 * int(epoch)))
+                            for epoch, pred in zip(epochs, preds))
+    probs.index = epochs
+
+    # the predictions are written last, so an interrupted run is not taken for up to date
+    hypnogram_path, probabilities_path, predictions_path = output_paths(recording)
+    pd.DataFrame({'stage': preds}, index=epochs).to_csv(hypnogram_path)
+    probs.to_csv(probabilities_path)
+    with open(predictions_path, 'w') as outfile:
+        outfile.write(predictions)
+
+    return recording[0], len(preds), time.perf_counter() - start
+
+
+def score_recordings(patterns: list, processes: int = None, force: bool = False, path_to_model: str = 'auto',
+                     male: bool = True, age: int = 45) -> list:
+    """
+    scores all recordings found in patterns that are not up to date, one recording per process
+
+    :param patterns: see find_recordings()
+    :param processes: number of processes, defaults to the number of cpus
+    :param force: also score recordings whose outputs are up to date
+    :param path_to_model: the classifier, see ModelRegistry.get_classifier()
+    :return: the results of score_recording() of the recordings that were scored
+    """
+    recordings = find_recordings(patterns)
+    todo = [recording for recording in recordings if force or not is_up_to_date(recording)]
+    print(f'{len(recordings)} recordings found, {len(recordings) - len(todo)} up to date, scoring {len(todo)}')
+    if not todo:
+        return []
+
+    processes = min(processes or os.cpu_count(), len(todo))
+    results = []
+    start = time.perf_counter()
+    # spawn, so the workers start without the threads of this process
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(path_to_model,)) as executor:
+        futures = {executor.submit(score_recording, recording, path_to_model, male, age): recording
+                   for recording in todo}
+        for future in as_completed(futures):
+            try:
+                path, n_epochs, seconds = future.result()
+            except Exception as e:
+                print(f'[ERROR] when scoring {futures[future][0]}: {e}')
+                continue
+            results.append((path, n_epochs, seconds))
+            print(f'[{len(results)}/{len(todo)}] {path}: {n_epochs} epochs in {seconds:.1f} s')
+
+    elapsed = time.perf_counter() - start
+    print(f'scored {len(results)} recordings in {elapsed:.1f} s with {processes} processes '
+          f'({3600 * len(results) / elapsed:.0f} recordings/hour)')
+    return results
+
+
+def _init_worker(path_to_model):
+    global _thread_limits
+    # one thread per process, the processes already use all cpus
+    _thread_limits = threadpool_limits(1)
+    warm_up(path_to_model)
@@ -1,103 +1,141 @@
 from datetime import datetime
 import time
+
+import numpy as np
 from PyQt5.QtCore import QThread, pyqtSignal
 
 
 from scripts.Connection.ZmaxHeadband import ZmaxDataID, ZmaxHeadband
+from scripts.Utils.Metrics import METRICS
+from scripts.Utils.RawSpool import RawSpool, read_spool_header
 
 
 class RecordThread(QThread):
     recordingFinishedSignal = pyqtSignal(str)
     sendEpochDataSignal = pyqtSignal(object, int)
-
-    def __init__(self, parent=None, signalType=None):
+    # seconds to wait before reading again after a failed read, doubled up to the max while it keeps failing. The
+    # max is the read timeout of the transports, so stop() still takes effect within about a second
+    MIN_RETRY_DELAY = 0.1
+    MAX_RETRY_DELAY = 1.0
+
+    def __init__(self, parent=None, signalType=None, captureBackend: str = 'sniff', resumePath: str = None):
+        """
+        :param resumePath: session directory of an interrupted recording to continue, its signal types are used
+        """
         super(RecordThread, self).__init__(parent)
+        if resumePath is not None:
+            signalType = read_spool_header(resumePath)['columns'][:-2]
         if signalType is None:
             signalType = [0, 1, 5, 2, 3, 4]
 
         self.model_CNNLSTM = None
         self.threadactive = True
-        self.signalType = signalType  # "EEGR, EEGL, TEMP, DX, DY, DZ"
+        self.signalType = list(signalType)  # "EEGR, EEGL, TEMP, DX, DY, DZ"
+        # add two columns for the sample number within its second and the whole seconds since the start
+        self.columns = self.signalType + [998, 999]
+        self.captureBackend = captureBackend
         self.stimulationType = ""
-        self.secondCounter = 0
-        self.dataSampleCounter = 0
         self.totalDataSampleCounter = 0
         self.epochCounter = 0
         self.sample_rate = 256
+        self.epoch_len = 30 * self.sample_rate  # each epoch is 30 seconds
+
+        if resumePath is None:
+            now = datetime.now()  # for file name
+            dt_string = now.strftime("recording-date-%Y-%m-%d-time-%H-%M-%S")
+            self.file_path = f".\\recordings\\{dt_string}"
+        else:
+            self.file_path = resumePath
+
+        # all samples after the first second, spooled to the session directory as they arrive. Blocks of 20 epochs
+        # so every epoch lies within one block and can be handed on as a view
+        self.spool = RawSpool(self.file_path, self.columns, self.sample_rate, block_size=20 * self.epoch_len,
+                              resume=resumePath is not None)
+        self.recording = self.spool.recording
+        self.epochCounter = self.spool.header['epoch_count']
+        self.totalDataSampleCounter = self.spool.header['total_samples']
+
+        # samples received since run() started vs. the samples expected at sample_rate, to see drift and drops
+        self.receivedSamples = 0
+        self.startTime = None
+        self.stopTime = None
+        self.handoffTimes = {}  # epoch -> time.perf_counter() when it was handed on, see HBRecorderInterface
+        METRICS.gauge('samples_received', 'samples received since the recording started',
+                      function=lambda: self.receivedSamples)
+        METRICS.gauge('samples_expected', f'samples expected at {self.sample_rate} Hz since the recording started',
+                      function=self.expected_samples)
+        METRICS.gauge('samples_missing', 'samples expected but not received, negative if more samples arrived',
+                      function=lambda: self.expected_samples() - self.receivedSamples)
+
+    def expected_samples(self) -> int:
+        if self.startTime is None:
+            return 0
+        return int(((self.stopTime or time.time()) - self.startTime) * self.sample_rate)
 
     def sendEpochData(self, data):
+        self.handoffTimes[self.epochCounter] = time.perf_counter()
         self.sendEpochDataSignal.emit(data, self.epochCounter)
 
     def run(self):
-        recording = []
-        cols = self.signalType
-        cols.extend([998, 999])  # add two columns for sample number, sample time
-        recording.append(cols)  # first row of received data is the col_id. eg: 0 => eegr
-        hb = ZmaxHeadband()  # create a new client on the server, therefore we use it only for reading the stream
-
-        now = datetime.now()  # for file name
-        dt_string = now.strftime("recording-date-%Y-%m-%d-time-%H-%M-%S")
-        file_path = f".\\recordings\\{dt_string}"
+        hb = ZmaxHeadband(backend=self.captureBackend)  # create a new client on the server, therefore we use it only for reading the stream
 
         actual_start_time = time.time()
+        self.startTime = actual_start_time
         print(f'actual start time {actual_start_time}')
 
-        buffer2analyzeIsReady = False
-        dataSamplesToAnalyzeCounter = 0  # count samples, when reach 30*256, feed all to deep learning model
-
-        self.secondCounter = 0
-        self.epochCounter = 0  # each epoch is 30 seconds
-
-        while True:
-            self.dataSampleCounter = 0  # count samples in each second
-            self.secondCounter += 1
-
-            t_end = time.time() + 1
-
-            while time.time() < t_end:
-                try:
-                    x = hb.read(cols[:-2])
-                except Exception as e:
-                    print(f'[ERROR] at ZMaxHeadband.read(): {e}')
-                    x = []
-                if x:
-                    for line in x:
-                        dataEntry = line
-                        dataEntry.extend([self.dataSampleCounter, self.secondCounter])
-                        self.dataSampleCounter += 1
-                        self.totalDataSampleCounter += 1
-                        recording.append(dataEntry)
-                        if not buffer2analyzeIsReady:
-                            if self.secondCounter >= 2:  # ignore 1st second for analysis, because it is unstable
-                                dataSamplesToAnalyzeCounter += 1
-
-                                if dataSamplesToAnalyzeCounter >= 30 * self.sample_rate:
-                                    buffer2analyzeIsReady = True
-                                    self.epochCounter += 1
-
-                else:
-                    continue
-
-            if buffer2analyzeIsReady:
-                # send all epoch data
-                self.sendEpochData(recording[-dataSamplesToAnalyzeCounter:])
-
-                # reset
-                dataSamplesToAnalyzeCounter = 0
-                buffer2analyzeIsReady = False
-
-            if self.threadactive is False:
-                hb.stop()
-                break
+        skip_samples = self.sample_rate  # ignore 1st second, because it is unstable
+        received_samples = 0
+        retry_delay = self.MIN_RETRY_DELAY
+
+        while self.threadactive:
+            try:
+                # blocks until data arrives or the read times out, so stop() takes effect within the timeout
+                x = hb.read_array(self.signalType)
+            except Exception as e:
+                # a transport that fails right away (e.g. a socket that can not be opened) must not spin a core
+                print(f'[ERROR] at ZMaxHeadband.read(), retrying in {retry_delay:g} s: {e}')
+                time.sleep(retry_delay)
+                retry_delay = min(2 * retry_delay, self.MAX_RETRY_DELAY)
+                continue
+            retry_delay = self.MIN_RETRY_DELAY
+            if len(x) == 0:
+                continue
+
+            n_samples = len(x)
+            # bounded counters, the edf file stores them exactly (see EdfUtils.physical_ranges())
+            sample_numbers = np.arange(self.totalDataSampleCounter,
+                                       self.totalDataSampleCounter + n_samples) % self.sample_rate
+            sample_time = int(time.time() - actual_start_time)
+            samples = np.column_stack((x, sample_numbers, np.full(n_samples, sample_time)))
+            self.totalDataSampleCounter += n_samples
+            received_samples += n_samples
+            self.receivedSamples = received_samples
+
+            skip = min(skip_samples, n_samples)
+            skip_samples -= skip
+            self.recording.append(samples[skip:])
+
+            # cut epochs purely on the number of received samples and hand them on as views into the recording
+            while len(self.recording) >= (self.epochCounter + 1) * self.epoch_len:
+                start = self.epochCounter * self.epoch_len
+                self.epochCounter += 1
+                self.spool.update(self.epochCounter, self.totalDataSampleCounter)
+                self.sendEpochData(self.recording.get(start, start + self.epoch_len).T)
+
+        hb.stop()
+        self.spool.close(self.epochCounter, self.totalDataSampleCounter)
 
         actual_end_time = time.time()
+        self.stopTime = actual_end_time
         print(f'actual end time {actual_end_time}')
         time_diff = actual_end_time - actual_start_time
         minute = time_diff / 60
         seconds = time_diff % 60
         print(f"actual {minute} minute, {seconds} seconds")
+        print(f'received {received_samples} samples, expected {int(time_diff * self.sample_rate)} '
+              f'at {self.sample_rate} Hz')
 
-        self.recordingFinishedSignal.emit(f"{file_path}")  # send path of recorded file to mainWindow
+        self.recordingFinishedSignal.emit(f"{self.file_path}")  # send path of recorded file to mainWindow
 
     def stop(self):
         self.threadactive = False
@@ -0,0 +1,191 @@
+import multiprocessing
+import queue
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from scripts.Utils.IncrementalStaging import IncrementalSleepStaging
+from scripts.Utils.Metrics import METRICS, resident_memory
+from scripts.Utils.ModelRegistry import warm_up
+
+_LATENCY = METRICS.histogram('scoring_latency_seconds', 'from handing an epoch to the scoring worker to its prediction')
+_COMPUTE_TIME = METRICS.histogram('scoring_compute_seconds', 'staging and prediction in the scoring process')
+
+
+class ScoringWorker(QObject):
+    """
+    Scores the recording in a separate process, so a slow classifier neither blocks the Qt main thread nor competes
+    with capture and decoding for the GIL. Epochs are sent to the process over a queue and the predictions come back
+    through predictionSignal.
+
+    Every epoch has a deadline. If the process falls behind, it still adds all waiting epochs to its staging, but only
+    predicts the newest one, and only if its deadline has not passed yet. A prediction that is only ready after the
+    deadline is dropped as well. The other epochs are reported as skipped, so no backlog builds up.
+
+    The process loads the classifier when it starts and keeps it, see ModelRegistry.
+    """
+    predictionSignal = pyqtSignal(object, int, str)  # time, epoch, prediction
+
+    def __init__(self, sample_rate: int = 256, deadline: float = 30.0, staging_factory=IncrementalSleepStaging,
+                 path_to_model: str = 'auto', context_epochs: int = None, preprocessing: str = 'yasa'):
+        """
+        :param sample_rate: sample rate of the eeg passed to score()
+        :param deadline: seconds after score() within which a prediction is still useful
+        :param staging_factory: creates the staging in the worker process from the sample rate, path_to_model,
+        context_epochs and preprocessing, must be picklable
+        :param path_to_model: the classifier, see ModelRegistry.get_classifier()
+        :param context_epochs: number of epochs the staging is based on, None for the whole recording
+        :param preprocessing: how the staging resamples and filters the eeg, see IncrementalSleepStaging
+        """
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.deadline = deadline
+        self.staging_factory = staging_factory
+        self.path_to_model = path_to_model
+        self.context_epochs = context_epochs
+        self.preprocessing = preprocessing
+        self.session = 0
+        self.skipped = 0
+        self.process = None
+        self.jobs = None
+        self.results = None
+        self.submitTimes = {}  # epoch -> time.perf_counter() of score(), until its prediction arrives
+        self.processMemory = float('nan')  # resident memory of the scoring process in bytes
+        METRICS.gauge('scoring_pending_epochs', 'epochs handed to the scoring worker without a prediction yet',
+                      function=lambda: len(self.submitTimes))
+        METRICS.gauge('scoring_skipped_epochs', 'epochs the scoring worker skipped because it fell behind',
+                      function=lambda: self.skipped)
+        METRICS.gauge('scoring_resident_memory_bytes', 'resident memory of the scoring process',
+                      function=lambda: self.processMemory)
+
+    def start(self):
+        # spawn, so the worker does not inherit the Qt and capture threads of this process
+        context = multiprocessing.get_context('spawn')
+        self.jobs = context.Queue()
+        self.results = context.Queue()
+        self.process = context.Process(target=_scoring_process,
+                                       args=(self.jobs, self.results, self.sample_rate, self.staging_factory,
+                                             self.path_to_model),
+                                       name='scoring-worker', daemon=True)
+        self.process.start()
+        threading.Thread(target=self._read_results, name='scoring-results', daemon=True).start()
+        self.new_session()
+
+    def new_session(self):
+        """
+        starts the staging of a new recording with the current path_to_model, context_epochs and preprocessing,
+        predictions of the previous one are discarded
+        """
+        self.session += 1
+        self.submitTimes = {}
+        self.jobs.put(('reset', self.session, {'path_to_model': self.path_to_model,
+                                                'context_epochs': self.context_epochs,
+                                                'preprocessing': self.preprocessing}))
+
+    def score(self, epoch: int, eeg: np.ndarray):
+        """
+        :param epoch: the number of the newest epoch in eeg
+        :param eeg: the epochs of the eeg channel in V that were not sent yet, usually just the newest one. Shape
+        (samples,) or (channels, samples) to stage several channels, which are fused into one prediction
+        """
+        self.submitTimes[epoch] = time.perf_counter()
+        self.jobs.put(('epochs', self.session, epoch, np.ascontiguousarray(eeg), time.time() + self.deadline))
+
+    def _read_results(self):
+        while True:
+            result = self.results.get()
+            if result is None:
+                return
+            kind, session, epoch, value = result
+            if kind == 'error':
+                self.submitTimes.pop(epoch, None)
+                print(f'[ERROR] when scoring epoch {epoch}: {value}')
+            elif session != self.session:
+                continue
+            elif kind == 'skipped':
+                self.submitTimes.pop(epoch, None)
+                self.skipped += 1
+                print(f'scoring of epoch {epoch} skipped, the scoring worker fell behind')
+            else:
+                prediction, seconds, self.processMemory = value
+                submitted = self.submitTimes.pop(epoch, None)
+                if submitted is not None:
+                    _LATENCY.observe(time.perf_counter() - submitted)
+                _COMPUTE_TIME.observe(seconds)
+                self.predictionSignal.emit(datetime.now(), epoch, prediction)
+
+    def stop(self):
+        if self.process is None:
+            return
+        self.jobs.put(None)
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.results.put(None)
+        self.process = None
+
+
+def _scoring_process(jobs, results, sample_rate, staging_factory, path_to_model):
+    try:
+        warm_up(path_to_model)
+    except Exception as e:
+        results.put(('error', None, 0, f'could not load the classifier: {e}'))
+
+    staging = None
+    session = None
+    options = {}
+    while True:
+        # take everything that is waiting, only the newest epoch is predicted
+        batch = [jobs.get()]
+        while True:
+            try:
+                batch.append(jobs.get_nowait())
+            except queue.Empty:
+                break
+
+        start_time = time.perf_counter()
+        newest = None
+        for job in batch:
+            if job is None:
+                results.put(None)
+                return
+            if job[0] == 'reset':
+                _, session, options = job
+                staging = None
+                newest = None
+                continue
+
+            _, job_session, epoch, eeg, deadline = job
+            if job_session != session:
+                continue
+            try:
+                if staging is None:
+                    staging = staging_factory(sample_rate, n_channels=1 if eeg.ndim == 1 else len(eeg), **options)
+                for start in range(0, eeg.shape[-1] - staging.epoch_len + 1, staging.epoch_len):
+                    staging.add_epoch(eeg[..., start:start + staging.epoch_len])
+            except Exception as e:
+                results.put(('error', session, epoch, str(e)))
+                continue
+            if newest is not None:
+                results.put(('skipped', session, newest[0], None))
+            newest = (epoch, deadline)
+
+        if newest is None:
+            continue
+        epoch, deadline = newest
+        if time.time() > deadline:
+            results.put(('skipped', session, epoch, None))
+            continue
+        try:
+            prediction = str(staging.predict_last())
+        except Exception as e:
+            results.put(('error', session, epoch, str(e)))
+            continue
+        # a prediction that arrives after its deadline is of no use anymore
+        if time.time() > deadline:
+            results.put(('skipped', session, epoch, None))
+            continue
+        results.put(('prediction', session, epoch, (prediction, time.perf_counter() - start_time, resident_memory())))
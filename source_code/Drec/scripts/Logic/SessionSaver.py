@@ -0,0 +1,94 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from scripts.Utils.RawSpool import recover_spool, remove_spool
+
+
+class SessionSaver(QObject):
+    """
+    Finalizes recordings in a background thread, so the CLI stays responsive and a new recording can be started while
+    the previous one is still being saved. Sessions are saved one after the other.
+    """
+    progressSignal = pyqtSignal(str, int)  # file path, percent done
+    finishedSignal = pyqtSignal(str)  # file path
+
+    def __init__(self):
+        super().__init__()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-saver')
+
+    def save(self, future: Future, filePath: str, edfWriter, recording, predictions: list, webhookUrl: str = None,
+             keepSpool: bool = False):
+        """
+        finalizes the session in the background and resolves future with filePath when done
+
+        :param future: the future of the session, created when the recording was started
+        :param filePath: the directory of the session
+        :param edfWriter: the StreamingEdfWriter of the session or None
+        :param recording: the RecordingBuffer of the session
+        :param predictions: the (time, epoch, prediction) tuples of the session
+        :param webhookUrl: url to post 'finished' to, None if the webhook is not active
+        :param keepSpool: keep the spool of the recording after the edf file is finished, it is deleted by default
+        """
+        def run():
+            try:
+                self._save(filePath, edfWriter, recording, predictions, webhookUrl, keepSpool)
+            except Exception as e:
+                print(f'[ERROR] when saving {filePath}: {e}')
+            future.set_result(filePath)
+            self.finishedSignal.emit(filePath)
+
+        self.executor.submit(run)
+
+    def recover(self, future: Future, filePath: str):
+        """
+        converts the spool of an interrupted recording into an edf file in the background, see RawSpool.recover_spool(),
+        and resolves future with filePath when done
+
+        :param future: the future of the recovery
+        :param filePath: the directory of the session
+        """
+        def run():
+            try:
+                recover_spool(filePath, progress=lambda percent: self.progressSignal.emit(filePath, percent))
+            except Exception as e:
+                print(f'[ERROR] could not recover the recording in {filePath}: {e}')
+            future.set_result(filePath)
+            self.finishedSignal.emit(filePath)
+
+        self.executor.submit(run)
+
+    def _save(self, filePath, edfWriter, recording, predictions, webhookUrl, keepSpool=False):
+        # write what was recorded after the last epoch and finish the recording
+        if edfWriter is not None:
+            epoch_len = 30 * edfWriter.sample_rate
+            remaining = range(edfWriter.samples_written, len(recording), epoch_len)
+            for i, start in enumerate(remaining):
+                edfWriter.write(recording.get(start, start + epoch_len))
+                self.progressSignal.emit(filePath, int(80 * (i + 1) / len(remaining)))
+            edfWriter.close()
+            # the edf file holds the recording now, the spool is only needed if saving failed
+            if not keepSpool:
+                recording.close()
+                remove_spool(filePath)
+        self.progressSignal.emit(filePath, 80)
+
+        # save the predictions
+        if predictions:
+            with open(os.path.join(filePath, "predictions.txt"), "a") as outfile:
+                outfile.write("\n".join(str(epoch) + '-' + str(pred) + '-' + str(time) for time, epoch, pred in predictions))
+        self.progressSignal.emit(filePath, 90)
+
+        # send signal to webhook if it is running
+        if webhookUrl is not None:
+            try:
+                requests.post(webhookUrl, timeout=10)
+            except Exception as e:
+                print(e)
+                print('webhook is probably not available')
+        self.progressSignal.emit(filePath, 100)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -4,14 +4,27 @@ from PyQt5.QtWidgets import QApplication
 
 from scripts.UI.CLI import CLIThread
 from scripts.Logic.HBRecorderInterface import HBRecorderInterface
+from scripts.Utils.Metrics import METRICS_PORT, MetricsServer
 
 
 class CommunicationLogic:
-    def __init__(self):
+    def __init__(self, warmUpScoring: bool = False, metricsPort: int = METRICS_PORT):
+        """
+        :param warmUpScoring: load the scoring model at startup, so scoring is fast from the first epoch on
+        :param metricsPort: port of the local /metrics endpoint, None to not serve the metrics
+        """
         self.app = QApplication(sys.argv)
 
         self.cliThread = CLIThread()
         self.hbif = HBRecorderInterface()
+        if warmUpScoring:
+            self.hbif.warm_up_scoring()
+
+        self.metricsServer = None
+        if metricsPort is not None:
+            self.metricsServer = MetricsServer(port=metricsPort)
+            if self.metricsServer.start():
+                print(f'metrics at http://127.0.0.1:{self.metricsServer.port}/metrics')
 
     def start(self):
         self.cliThread.start()
@@ -30,6 +43,15 @@ class CommunicationLogic:
         self.cliThread.cli.stop_webhook_signal.connect(self.stopWebhook)
         self.cliThread.cli.set_signaltype_signal.connect(self.setSignaltype)
         self.cliThread.cli.set_scoring_delay_signal.connect(self.setScoringDelay)
+        self.cliThread.cli.set_scoring_context_signal.connect(self.setScoringContext)
+        self.cliThread.cli.set_scoring_preprocessing_signal.connect(self.setScoringPreprocessing)
+        self.cliThread.cli.set_scoring_channels_signal.connect(self.setScoringChannels)
+        self.cliThread.cli.status_signal.connect(self.showStatus)
+        self.cliThread.cli.set_scoring_model_signal.connect(self.setScoringModel)
+        self.cliThread.cli.set_capture_backend_signal.connect(self.setCaptureBackend)
+        self.cliThread.cli.set_keep_spool_signal.connect(self.setKeepSpool)
+        self.cliThread.cli.resume_signal.connect(self.resumeRecording)
+        self.cliThread.cli.recover_signal.connect(self.recoverRecording)
         self.cliThread.cli.quit_signal.connect(self.quit)
 
     def startRecording(self):
@@ -38,6 +60,12 @@ class CommunicationLogic:
     def stopRecording(self):
         self.hbif.stop_recording()
 
+    def resumeRecording(self, path: str):
+        self.hbif.resume_recording(path)
+
+    def recoverRecording(self, path: str):
+        self.hbif.recover_recording(path)
+
     def startScoring(self):
         self.hbif.start_scoring()
 
@@ -56,22 +84,40 @@ class CommunicationLogic:
     def setScoringDelay(self, delay_in_epochs: int):
         self.hbif.set_scoring_delay(delay_in_epochs)
 
+    def setScoringContext(self, minutes: int):
+        self.hbif.set_scoring_context(minutes)
+
+    def setScoringPreprocessing(self, preprocessing: str):
+        self.hbif.set_scoring_preprocessing(preprocessing)
+
+    def setScoringChannels(self, channels: list):
+        self.hbif.set_scoring_channels(channels)
+
+    def showStatus(self):
+        self.hbif.print_status()
+
+    def setScoringModel(self, path_to_model: str):
+        self.hbif.set_scoring_model(path_to_model)
+
+    def setCaptureBackend(self, backend: str):
+        self.hbif.set_capture_backend(backend)
+
+    def setKeepSpool(self, keep: bool):
+        self.hbif.set_keep_spool(keep)
+
     def quit(self, _: bool):
 
         if self.hbif.isRecording:
-            # gracefully stop recording if it is running to allow saving files. When it is called only once from within the
-            # class it has to receive a signal again to start saving. Therefore we do it here already
+            # gracefully stop recording if it is running to allow saving files
             self.hbif.stop_recording()
-            print('recording was still running, quitting aborted and recording stopped. please try again later!')
-            return
+            print('recording was still running and is stopped.')
 
-        if not self.hbif.recordingFinished:
-            print('did not receive the finished signal from the recorder thread yet. It may still be occupied with '
-                  'saving your files. \n If this takes longer than 20 minutes or you did not start a recording please '
-                  'file an issue at the github repository.')
-            return
+        if not self.hbif.wait_for_saving(timeout=0):
+            print('waiting for the recordings to be saved before quitting...')
 
         self.hbif.quit()
+        if self.metricsServer is not None:
+            self.metricsServer.stop()
 
         self.cliThread.stop()
         self.cliThread.quit()
@@ -1,6 +1,8 @@
 import cmd
 from PyQt5.QtCore import QObject, pyqtSignal, QThread
 
+from scripts.Connection.ZmaxHeadband import CAPTURE_BACKENDS
+
 
 class CLIThread(QThread):
     def __init__(self):
@@ -27,6 +29,15 @@ class SleepRecorderCLI(cmd.Cmd, QObject):
     stop_webhook_signal = pyqtSignal(bool)
     set_signaltype_signal = pyqtSignal(list)
     set_scoring_delay_signal = pyqtSignal(int)
+    set_scoring_context_signal = pyqtSignal(int)
+    set_scoring_preprocessing_signal = pyqtSignal(str)
+    set_scoring_channels_signal = pyqtSignal(list)
+    status_signal = pyqtSignal(bool)
+    set_scoring_model_signal = pyqtSignal(str)
+    set_capture_backend_signal = pyqtSignal(str)
+    set_keep_spool_signal = pyqtSignal(bool)
+    resume_signal = pyqtSignal(str)
+    recover_signal = pyqtSignal(str)
     quit_signal = pyqtSignal(bool)
 
     def __init__(self):
@@ -59,6 +70,23 @@ class SleepRecorderCLI(cmd.Cmd, QObject):
         """Start the recoring"""
         self.start_signal.emit(True)
 
+    def do_resume(self, line):
+        """resume an interrupted recording, e.g. after a crash. pass the directory of the recording, e.g.
+        " resume .\\recordings\\recording-date-2024-11-27-time-21-39-45". Scoring and the webhook have to be started
+        separately."""
+        if not line.strip():
+            print('pass the directory of the recording to resume.')
+            return
+        self.resume_signal.emit(line.strip())
+
+    def do_recover(self, line):
+        """convert an interrupted recording (e.g. after a crash) into recording.edf. pass the directory of the
+        recording."""
+        if not line.strip():
+            print('pass the directory of the recording to recover.')
+            return
+        self.recover_signal.emit(line.strip())
+
     def do_start_scoring(self, line):
         """start scoring the eeg signal."""
         self.start_scoring_signal.emit(True)
@@ -96,4 +124,72 @@ class SleepRecorderCLI(cmd.Cmd, QObject):
             val = int(line)
         except ValueError:
             print(f'please provide a numer. "{line}" was not interpretable as integer.')
+            return
+        self.set_scoring_delay_signal.emit(val)
 
+    def do_set_scoring_context(self, line):
+        """set how many minutes of the recording the scoring of an epoch is based on, e.g. " set_scoring_context 120".
+        0 uses the whole recording (default). With a limited context scoring takes the same time and memory at any time
+        of the night."""
+        try:
+            val = int(line)
+        except ValueError:
+            print(f'please provide a numer. "{line}" was not interpretable as integer.')
+            return
+        if val < 0:
+            print('the context can not be negative.')
+            return
+        self.set_scoring_context_signal.emit(val)
+
+    def do_set_scoring_preprocessing(self, line):
+        """set how the scoring resamples and filters the eeg: 'yasa' (default) filters like the classifier was trained,
+        'streaming' resamples and filters every sample only once with a causal filter, which is cheaper but changes the
+        predictions slightly. e.g. " set_scoring_preprocessing streaming"""
+        if not line.strip():
+            print('pass "yasa" or "streaming".')
+            return
+        self.set_scoring_preprocessing_signal.emit(line.strip())
+
+    def do_status(self, line):
+        """show the state of the recording and the metrics: durations of capture, decoding, epoch hand-off, edf writing,
+        scoring and webhook, received vs. expected samples, queue depths and memory. The same metrics are served at
+        http://127.0.0.1:8001/metrics"""
+        self.status_signal.emit(True)
+
+    def do_set_scoring_channels(self, line):
+        """set the eeg channels that are scored, comma separated, e.g. " set_scoring_channels eegl,eegr". Default is
+        eegl. Both channels are staged in one pass and their probabilities are fused into one prediction."""
+        channels = [name.strip() for name in line.split(',') if name.strip()]
+        if not channels:
+            print('pass eegl, eegr or eegl,eegr.')
+            return
+        self.set_scoring_channels_signal.emit(channels)
+
+    def do_set_scoring_model(self, line):
+        """set the classifier used for scoring. pass the path of a yasa classifier (joblib file) or 'auto' for the latest
+        one shipped with yasa (default). The classifier is loaded once and kept until the program is closed."""
+        if not line.strip():
+            print('pass the path of the classifier or "auto".')
+            return
+        self.set_scoring_model_signal.emit(line.strip())
+
+    def do_set_capture_backend(self, line):
+        """set how the data of the HDServer is received. 'sniff' captures the loopback traffic (windows only, default),
+        'tcp' connects to the HDServer directly as a client, 'raw' captures the loopback traffic without scapy (linux
+        only, needs root)."""
+        backend = line.strip()
+        if backend not in CAPTURE_BACKENDS:
+            print(f'please provide one of {CAPTURE_BACKENDS}. "{line}" is not a known capture backend.')
+            return
+        self.set_capture_backend_signal.emit(backend)
+        print('the recording has to be restarted for this change to have an effect!')
+
+    def do_set_keep_spool(self, line):
+        """keep recording.spool (the crash safe copy of the recording) after recording.edf is saved, e.g.
+        " set_keep_spool on". By default (off) it is deleted once the edf file is finished, it takes about 0.5 GB per
+        night."""
+        value = line.strip().lower()
+        if value not in ('on', 'off'):
+            print('pass "on" or "off".')
+            return
+        self.set_keep_spool_signal.emit(value == 'on')
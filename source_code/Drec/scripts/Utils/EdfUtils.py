@@ -1,10 +1,35 @@
 import os
+from pathlib import Path
 
 import numpy as np
+import pyedflib
 from pyedflib import highlevel
 
 from scripts.Connection.ZmaxHeadband import ZmaxDataID
 
+MIN_EEG_VAL = -1000000
+MAX_EEG_VAL = 1000000
+
+
+def physical_ranges(channels: list, sample_rate: int = 256) -> np.ndarray:
+    """
+    the physical min and max of each channel in the edf file, shape (n_channels, 2). The counters of RecordThread get
+    ranges of their own, so they are stored exactly with the 16 bit samples of edf: the sample within its second and
+    the whole seconds since the recording started (up to 65535 s, about 18 h)
+    """
+    ranges = {ZmaxDataID.sample_number.value: (0, sample_rate - 1),
+              ZmaxDataID.sample_time.value: (0, 65535)}
+    return np.array([ranges.get(int(channel), (MIN_EEG_VAL, MAX_EEG_VAL)) for channel in channels], dtype=float)
+
+
+def make_signal_headers(channels: list, sample_rate: int = 256) -> list:
+    """the signal headers of save_edf() and StreamingEdfWriter, see physical_ranges()"""
+    channel_names = [str(ZmaxDataID(channel)) for channel in channels]
+    signal_headers = highlevel.make_signal_headers(channel_names, sample_frequency=sample_rate)
+    for signal_header, (physical_min, physical_max) in zip(signal_headers, physical_ranges(channels, sample_rate)):
+        signal_header.update(physical_min=int(physical_min), physical_max=int(physical_max))
+    return signal_headers
+
 
 def save_edf(signals: np.ndarray, channels: list, path: str, file_name: str, sample_rate:int = 256):
     """
@@ -16,20 +41,15 @@ def save_edf(signals: np.ndarray, channels: list, path: str, file_name: str, sam
     :param sample_rate:
     :return:
     """
-    min_eeg_val = -1000000
-    max_eeg_val = 1000000
     if len(signals) <= 1:
         return
 
     # write an edf file
+    ranges = physical_ranges(channels, sample_rate)
     signals_reformatted = signals.T
-    signals_reformatted = np.clip(signals_reformatted, min_eeg_val, max_eeg_val)
+    signals_reformatted = np.clip(signals_reformatted, ranges[:, :1], ranges[:, 1:])
     signals_reformatted = np.ascontiguousarray(signals_reformatted)
-    channel_names = [str(ZmaxDataID(channel)) for channel in channels]
-    signal_headers = highlevel.make_signal_headers(channel_names,
-                                                   sample_frequency=sample_rate,
-                                                   physical_min=-1000000,
-                                                   physical_max=1000000)
+    signal_headers = make_signal_headers(channels, sample_rate)
     header = highlevel.make_header(patientname='patient')
     try:
         highlevel.write_edf(os.path.join(path, file_name),
@@ -39,3 +59,60 @@ def save_edf(signals: np.ndarray, channels: list, path: str, file_name: str, sam
     except Exception as e:
         print(f'[ERROR] when writing edf: {e}')
 
+
+class StreamingEdfWriter:
+    """
+    Writes a recording to an edf file piece by piece while it is recorded, instead of all at once at the end. Uses the
+    same channel headers as save_edf().
+    """
+    def __init__(self, path: str, file_name: str, channels: list, sample_rate: int = 256):
+        """
+        :param path: directory of the file, created if it does not exist
+        :param file_name: name of the edf file
+        :param channels: the ZmaxDataID values of the channels, in the order they are passed to write()
+        :param sample_rate: the sample rate of all channels
+        """
+        Path(path).mkdir(parents=True, exist_ok=True)
+        self.sample_rate = sample_rate
+        self.n_channels = len(channels)
+        self.remainder = np.empty((self.n_channels, 0))  # samples that do not fill a whole data record yet
+        self.samples_written = 0  # samples passed to write(), the remainder included
+        self.ranges = physical_ranges(channels, sample_rate)
+
+        signal_headers = make_signal_headers(channels, sample_rate)
+        header = highlevel.make_header(patientname='patient')
+        header.pop('annotations', None)
+
+        self.writer = pyedflib.EdfWriter(os.path.join(path, file_name), self.n_channels,
+                                         file_type=pyedflib.FILETYPE_EDFPLUS)
+        self.writer.setSignalHeaders(signal_headers)
+        self.writer.setHeader(header)
+
+    def write(self, signals: np.ndarray):
+        """
+        writes all complete data records (one second each) and keeps the rest for the next call
+
+        :param signals: a np.ndarray of shape (n_channels, n_samples), e.g. one epoch
+        """
+        self.samples_written += signals.shape[1]
+        signals = np.clip(signals, self.ranges[:, :1], self.ranges[:, 1:])
+        if self.remainder.shape[1]:
+            signals = np.concatenate((self.remainder, signals), axis=1)
+
+        n_records = signals.shape[1] // self.sample_rate
+        n_samples = n_records * self.sample_rate
+        # a data record holds one second of every channel after each other
+        records = signals[:, :n_samples].reshape(self.n_channels, n_records, self.sample_rate).transpose(1, 0, 2)
+        for record in records:
+            self.writer.blockWritePhysicalSamples(np.ascontiguousarray(record).ravel())
+
+        self.remainder = signals[:, n_samples:]
+
+    def close(self):
+        """writes the incomplete last data record (padded with zeros) and finalizes the header"""
+        if self.remainder.shape[1]:
+            last_record = np.zeros((self.n_channels, self.sample_rate))
+            last_record[:, :self.remainder.shape[1]] = self.remainder
+            self.writer.blockWritePhysicalSamples(last_record.ravel())
+            self.remainder = np.empty((self.n_channels, 0))
+        self.writer.close()
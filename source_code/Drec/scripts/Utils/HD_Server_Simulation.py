@@ -1,119 +1,210 @@
+import argparse
 import socket
 import threading
 import time
 import mne
 import numpy as np
 
+from scripts.Connection.ZmaxHeadband import WORD_OFFSETS, ZmaxDataID
 
-class HD_Server_Sim:
-    def __init__(self):
-        # Server settings
-        self.HOST = '0.0.0.0'
-        self.PORT = 8000
-        self.clients = []
+PACKET_BYTES = 40  # bytes of a data packet, the packet type and the words of WORD_OFFSETS
+FRAME_LEN = 2 + 3 * PACKET_BYTES - 1 + 2  # 'D.' + '06-80-56-...-00' + '\r\n'
+PACKET_TYPE = 6
 
-        # Global variables for EEG data
-        self.eeg_data = None
-        self.sampling_rate = 256  # Hz
-        self.current_sample = 0  # Pointer to track the current sample being streamed
-        self.streaming = False
+# values of the channels that are not simulated, in their physical unit (see ZmaxHeadband._scale)
+DEFAULT_VALUES = {ZmaxDataID.dz: 1.0, ZmaxDataID.bodytemp: 36.0, ZmaxDataID.bat: 3.9}
 
-    def broadcast_data(self, data):
-        """Sends data to all connected clients."""
-        disconnected_clients = []
-        for client in self.clients:
-            try:
-                client.sendall(data.encode('utf-8'))
-            except (ConnectionResetError, BrokenPipeError, OSError) as e:
-                # Mark the client as disconnected
-                disconnected_clients.append(client)
-                print("[ERROR] Failed to send data. Removing disconnected client.")
-
-        # Remove disconnected clients
-        for client in disconnected_clients:
-            self.clients.remove(client)
-
-    def stream_data(self):
-        """Streams 256 samples per second to simulate real-time EEG recording."""
-        n_samples = self.eeg_data.shape[1]  # Total number of samples per channel
-        chunk_size = 1  # Number of samples to send per second
-        interval = chunk_size / self.sampling_rate  # Send chunks every second
-
-        while True:
-            if len(self.clients) > 0 and self.streaming:
-                # Calculate the range of samples to send
-                start = self.current_sample
-                end = self.current_sample + chunk_size
-
-                if end > n_samples:
-                    self.streaming = False
-                else:
-                    chunk = self.eeg_data[:, start:end]
-                    self.current_sample = end
+_HEX_DIGITS = np.frombuffer(b'0123456789ABCDEF', dtype=np.uint8)
 
-                # convert the chunks into a message
-                accumulated_message = ''
-                for idx in range(0, len(chunk[0])):
-                    sigl = chunk[0][idx]
-                    sigr = chunk[1][idx]
-                    accumulated_message += self.signal_to_hex(sigl, sigr) + '\r\n'
 
-                self.broadcast_data(accumulated_message)
-                #print(accumulated_message)
+class SimulatedClient:
+    """a connected client with its own position in the recording"""
+    def __init__(self, client_socket, address):
+        self.socket = client_socket
+        self.address = address
+        self.cursor = 0  # next sample to send
 
-                # Print debug message to check if streaming continues
-                #print(f"[STREAMING] Sent samples {start} to {self.current_sample}")
 
-            else:
-                # print("[INFO] Waiting for clients...")
-                pass
+class HD_Server_Sim:
+    """
+    Simulates the HDServer of one headband. The recording is encoded into the packets of all 17 channels once
+    (set_signals() or eeg_data), every client then gets the packets from its own cursor, in batches that follow the
+    clock at speed times real time. Several simulators on different ports can share the same frames, see
+    start_headbands().
+    """
+    def __init__(self, port: int = 8000, speed: float = 1.0):
+        """
+        :param port: port the simulated HDServer listens on
+        :param speed: multiple of real time the data is streamed at, e.g. 10 to replay an hour in 6 minutes
+        """
+        # Server settings
+        self.HOST = '0.0.0.0'
+        self.PORT = port
+        self.clients = []
+        self.server_socket = None
+        self.running = False
 
-            time.sleep(interval)  # Wait for 1 second before sending the next chunk
+        # the recording, FRAME_LEN bytes per sample
+        self.frames = None
+        self._eeg_data = None
+        self.sampling_rate = 256  # Hz
+        self.speed = speed
+        self.send_interval = 0.01  # seconds between two batches of samples
+        self.samples_sent = 0  # over all clients
+        self._lock = threading.Lock()
+
+    @property
+    def n_samples(self) -> int:
+        return 0 if self.frames is None else len(self.frames) // FRAME_LEN
+
+    @property
+    def eeg_data(self):
+        """eegl and eegr in uV, shape (2, n)"""
+        return self._eeg_data
+
+    @eeg_data.setter
+    def eeg_data(self, eeg):
+        self._eeg_data = eeg
+        self.set_signals({ZmaxDataID.eegl: eeg[0], ZmaxDataID.eegr: eeg[1]})
+
+    def set_signals(self, signals: dict):
+        """
+        :param signals: ZmaxDataID -> samples in the unit ZmaxHeadband decodes them to (uV, g, V, degrees C or the word
+        value), all of the same length. The other channels are constant, see DEFAULT_VALUES
+        """
+        self.frames = self.encode_frames(signals)
+
+    def encode_frames(self, signals: dict, block: int = 60 * 256) -> memoryview:
+        """
+        encodes the packets of all samples at once, block samples at a time to bound the temporary arrays
+
+        :return: the lines the HDServer sends, FRAME_LEN bytes per sample
+        """
+        n = len(next(iter(signals.values())))
+        frames = np.empty((n, FRAME_LEN), dtype=np.uint8)
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            packets = np.zeros((stop - start, PACKET_BYTES), dtype=np.uint8)
+            packets[:, 0] = PACKET_TYPE
+            for dataID, offset in WORD_OFFSETS.items():
+                if dataID in signals:
+                    values = np.asarray(signals[dataID][start:stop], dtype=float)
+                else:
+                    values = np.full(stop - start, DEFAULT_VALUES.get(dataID, 0.0))
+                words = self.to_words(dataID, values)
+                packets[:, offset] = words >> 8
+                packets[:, offset + 1] = words & 0xFF
+
+            frame = frames[start:stop]
+            frame[:, 0:2] = np.frombuffer(b'D.', dtype=np.uint8)
+            digits = frame[:, 2:2 + 3 * PACKET_BYTES].reshape(-1, PACKET_BYTES, 3)
+            digits[:, :, 0] = _HEX_DIGITS[packets >> 4]
+            digits[:, :, 1] = _HEX_DIGITS[packets & 0x0F]
+            digits[:, :, 2] = ord('-')
+            frame[:, -2:] = np.frombuffer(b'\r\n', dtype=np.uint8)  # replaces the '-' after the last byte
+        return memoryview(frames.reshape(-1))
+
+    def to_words(self, dataID: ZmaxDataID, values: np.ndarray) -> np.ndarray:
+        """converts the values of a channel to word values, the inverse of ZmaxHeadband._scale"""
+        if dataID in (ZmaxDataID.eegr, ZmaxDataID.eegl):
+            words = self.descaleEEG(values)
+        elif dataID in (ZmaxDataID.dx, ZmaxDataID.dy, ZmaxDataID.dz):
+            words = self.descaleAccel(values)
+        elif dataID == ZmaxDataID.bodytemp:
+            words = self.BodyTemp(values)
+        elif dataID == ZmaxDataID.bat:
+            words = self.BatteryVoltage(values)
+        else:
+            words = values
+        return np.clip(np.rint(words), 0, 0xFFFF).astype(np.int64)
+
+    def stream_to_client(self, client: SimulatedClient):
+        """
+        Streams 256 * speed samples per second from the cursor of the client. The samples that are due are sent in a
+        batch every send_interval, the batches follow the clock, so sleeping too long does not slow the stream down.
+        """
+        n_samples = self.n_samples
+        stream_start = time.perf_counter()  # the time sample 0 was due
+
+        while self.running and client.cursor < n_samples:
+            end = min(int((time.perf_counter() - stream_start) * self.sampling_rate * self.speed), n_samples)
+            if end > client.cursor:
+                client.socket.sendall(self.frames[client.cursor * FRAME_LEN:end * FRAME_LEN])
+                with self._lock:
+                    self.samples_sent += end - client.cursor
+                client.cursor = end
+            time.sleep(self.send_interval)
 
     def handle_client(self, client_socket, address):
         """Handles communication with a single client."""
         print(f"[NEW CONNECTION] {address} connected.")
-        self.clients.append(client_socket)
+        client = SimulatedClient(client_socket, address)
+        self.clients.append(client)
         try:
             # Wait for the "HELLO" message to start streaming
             while True:
-                message = client_socket.recv(1024).decode('utf-8').strip()
-                if message == "HELLO":
+                message = client_socket.recv(1024)
+                if not message:
+                    raise ConnectionResetError
+                if message.decode('utf-8', errors='replace').strip() == "HELLO":
                     print(f"[HELLO RECEIVED] Starting stream for {address}")
-                    self.streaming = True
-                    time.sleep(1)
                     break
-        except (ConnectionResetError, BrokenPipeError):
-            print(f"[DISCONNECT] {address} disconnected.")
+            self.stream_to_client(client)
+            # like a headband that was switched off, the connection stays open until the client closes it
+            while self.running and client_socket.recv(1024):
+                pass
+        except (ConnectionResetError, BrokenPipeError, OSError):
+            if self.running:
+                print(f"[DISCONNECT] {address} disconnected.")
 
         finally:
-            while self.streaming:
-                time.sleep(1)
             # Ensure the client is removed from the list
-            if client_socket in self.clients:
-                self.clients.remove(client_socket)
+            if client in self.clients:
+                self.clients.remove(client)
             client_socket.close()
 
+    def start(self):
+        """listens on the port and serves the clients in background threads"""
+        self._listen()
+        threading.Thread(target=self._accept_clients, daemon=True).start()
+
     def start_server(self):
         """Sets up the server and handles incoming connections."""
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.bind((self.HOST, self.PORT))
-        server_socket.listen()
-        print(f"[LISTENING] Server is listening on {self.HOST}:{self.PORT}")
-
-        # Start the data streaming thread
-        threading.Thread(target=self.stream_data, daemon=True).start()
-
+        self._listen()
         try:
-            while True:
-                client_socket, address = server_socket.accept()
-                client_thread = threading.Thread(target=self.handle_client, args=(client_socket, address), daemon=True)
-                client_thread.start()
+            self._accept_clients()
         except KeyboardInterrupt:
             print("[SHUTDOWN] Server is shutting down.")
-            for client in self.clients:
-                client.close()
-            server_socket.close()
+            self.stop()
+
+    def stop(self):
+        self.running = False
+        if self.server_socket is not None:
+            self.server_socket.close()
+            self.server_socket = None
+        for client in list(self.clients):
+            try:
+                client.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _listen(self):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.HOST, self.PORT))
+        self.server_socket.listen()
+        self.running = True
+        print(f"[LISTENING] Server is listening on {self.HOST}:{self.PORT}")
+
+    def _accept_clients(self):
+        while self.running:
+            try:
+                client_socket, address = self.server_socket.accept()
+            except OSError:  # closed by stop()
+                return
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client_thread = threading.Thread(target=self.handle_client, args=(client_socket, address), daemon=True)
+            client_thread.start()
 
     # ------------------------
     # EDF Helper Methods (should be functions somewhere)
@@ -150,45 +241,33 @@ class HD_Server_Sim:
             # Load the EDF file
             edf_file_path_L = f'{file_path}EEG L.edf'  # Replace with your EDF file path
             edf_file_path_R = f'{file_path}EEG R.edf'  # Replace with your EDF file path
-            x = f'{file_path}'
             raw_eegl = mne.io.read_raw_edf(edf_file_path_L, preload=True)
             raw_eegr = mne.io.read_raw_edf(edf_file_path_R, preload=True)
 
             eeg = self.combine_raw_instances(raw_eegl, raw_eegr)
-            self.eeg_data = eeg.get_data(picks='eeg')
+            self.eeg_data = eeg.get_data(picks='eeg') * 1e6  # V to uV
 
             print(f"[EDF LOADED] Loaded EEG data with shape {self.eeg_data.shape}")
 
         except Exception as e:
             print(f"[ERROR] Failed to load EDF file: {e}")
-            self.eeg_data = None
+            self._eeg_data = None
 
     # ----------------------------------------
     # signal transformation methods
     # ----------------------------------------
     def signal_to_hex(self, sigl, sigr):
-        descaled_sigl = self.descaleEEG(sigl)
-        descaled_sigr = self.descaleEEG(sigr)
-        buf = f"D.06-"\
-              f"{self.numberToWord(descaled_sigl)}-"\
-              f"{self.numberToWord(descaled_sigr)}-"\
-              f"00-00-00-00-" \
-              f"00-00-00-00-" \
-              f"00-00-00-00-" \
-              f"00-00-00-00-" \
-              f"00-00-00-00-" \
-              f"00-00-00-00-" \
-              f"00-00-00-00-" \
-              f"00-00-00-00-" \
-              f"00-00-00" \
-
-        return buf
+        """a single packet of eegl and eegr, kept as reference for encode_frames()"""
+        buf = ['00'] * PACKET_BYTES
+        buf[0] = self.dec2hex(PACKET_TYPE, pad=2)
+        for dataID, offset in WORD_OFFSETS.items():
+            value = {ZmaxDataID.eegl: sigl, ZmaxDataID.eegr: sigr}.get(dataID, DEFAULT_VALUES.get(dataID, 0.0))
+            buf[offset:offset + 2] = self.numberToWord(self.to_words(dataID, np.float64(value))).split('-')
+        return 'D.' + '-'.join(buf)
 
     def numberToWord(self, n):
-        if n <= 256:
-            return f'00-{self.dec2hex(n, pad=2)}'
-        message = f'{self.dec2hex(int(n / 256), pad=2)}-{self.dec2hex(int(n % 256), pad=2)}'
-        return message
+        n = int(np.clip(np.rint(n), 0, 0xFFFF))
+        return f'{self.dec2hex(n // 256, pad=2)}-{self.dec2hex(n % 256, pad=2)}'
 
     def descaleEEG(self, sig):  # uV to word value
         uvRange = 3952
@@ -224,11 +303,40 @@ class HD_Server_Sim:
             return s.rjust(pad, '0')
 
 
-if __name__ == "__main__":
+def start_headbands(frames, ports: list, speed: float = 1.0) -> list:
+    """
+    starts a simulated HDServer (a virtual headband) on every port, all of them streaming the same frames, e.g. to
+    record from many headbands at once
+
+    :param frames: the encoded recording, see HD_Server_Sim.encode_frames()
+    :return: the started simulators, stop them with stop()
+    """
+    servers = []
+    for port in ports:
+        server = HD_Server_Sim(port=port, speed=speed)
+        server.frames = frames
+        server.start()
+        servers.append(server)
+    return servers
 
-    server = HD_Server_Sim()
-    #server.message_to_hex(1295, 1022)
-    server.load_edf()
 
-    # Start the server
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='simulated HDServer, run as python -m scripts.Utils.HD_Server_Simulation')
+    parser.add_argument('--edf', help='directory with EEG L.edf and EEG R.edf, random eeg if not given')
+    parser.add_argument('--port', type=int, default=8000, help='port of the first headband (default 8000)')
+    parser.add_argument('--headbands', type=int, default=1, help='headbands on consecutive ports (default 1)')
+    parser.add_argument('--hours', type=float, default=1, help='hours of random eeg without --edf (default 1)')
+    parser.add_argument('--speed', type=float, default=1.0, help='multiple of real time (default 1)')
+    args = parser.parse_args()
+
+    server = HD_Server_Sim(port=args.port, speed=args.speed)
+    if args.edf is not None:
+        server.load_edf(args.edf.rstrip('/\\') + '/')
+    else:
+        server.eeg_data = np.random.default_rng(0).normal(0, 20, (2, int(args.hours * 3600 * server.sampling_rate)))
+
+    # Start the servers
+    others = start_headbands(server.frames, range(args.port + 1, args.port + args.headbands), args.speed)
     server.start_server()
+    for other in others:
+        other.stop()
@@ -0,0 +1,92 @@
+import numpy as np
+import yasa
+from scipy.signal import welch
+
+# the bands of yasa.bandpower_from_psd_ndarray(), which YasaClassifier.get_bandpower_per_epoch() uses
+DEFAULT_BANDS = [(0.5, 4, 'Delta'),
+                 (4, 8, 'Theta'),
+                 (8, 12, 'Alpha'),
+                 (12, 16, 'Sigma'),
+                 (16, 30, 'Beta'),
+                 (30, 40, 'Gamma')]
+
+
+class IncrementalBandpower:
+    """
+    Band powers of a growing recording, one 30 s epoch at a time. Gives the same values as
+    YasaClassifier.get_bandpower_per_epoch() over the whole recording, but the welch psd of every epoch is computed
+    only once, when the epoch is added, and kept in an array of shape (epochs, channels, freqs). The band powers of
+    each epoch are derived from it right away, so the last epoch and ratios like theta/delta are looked up in constant
+    time. The psds stay available for other bands or a report of the whole night.
+    """
+    def __init__(self, n_channels: int = 2, sf: int = 256, window_size: int = 5, epoch_len: int = 30,
+                 bands: list = None, relative: bool = True):
+        """
+        :param n_channels: number of channels passed to add_epoch
+        :param sf: sample rate
+        :param window_size: length of the welch segments in seconds
+        :param epoch_len: length of an epoch in seconds
+        :param bands: (low, high, name) of the bands, defaults to DEFAULT_BANDS. YasaClassifier.eeg_bands also works
+        :param relative: band powers relative to the total power of the bands, like yasa
+        """
+        self.sf = sf
+        self.epoch_len = epoch_len * sf
+        self.nperseg = int(window_size * sf)
+        self.bands = DEFAULT_BANDS if bands is None else bands
+        self.band_names = [name for _, _, name in self.bands]
+        self.relative = relative
+        self.freqs = np.fft.rfftfreq(self.nperseg, 1 / sf)
+
+        self.n_epochs = 0
+        self._psd = np.empty((0, n_channels, len(self.freqs)))
+        self._bandpower = np.empty((0, len(self.bands), n_channels))  # [epoch, band, channel]
+
+    @property
+    def psd(self) -> np.ndarray:
+        """the welch psd of every epoch, shape (epochs, channels, freqs), see freqs. Must not be modified"""
+        return self._psd[:self.n_epochs]
+
+    def add_epoch(self, epoch: np.ndarray):
+        """
+        :param epoch: the next 30 s of every channel, shape (channels, 30 * sf)
+        """
+        self._grow()
+        _, psd = welch(epoch, self.sf, nperseg=self.nperseg, axis=-1)
+        self._psd[self.n_epochs] = psd
+        self._bandpower[self.n_epochs] = yasa.bandpower_from_psd_ndarray(psd, self.freqs, self.bands, self.relative)
+        self.n_epochs += 1
+
+    def bandpower(self, bands: list = None) -> np.ndarray:
+        """
+        the band powers of every epoch like YasaClassifier.get_bandpower_per_epoch(), shape [band, epoch, channel]
+
+        :param bands: other bands than the ones of the cache, computed from the cached psds
+        """
+        if bands is None:
+            return self._bandpower[:self.n_epochs].transpose(1, 0, 2)
+        return yasa.bandpower_from_psd_ndarray(self.psd, self.freqs, bands, self.relative)
+
+    def bandpower_last_epoch(self) -> np.ndarray:
+        """the band powers of the newest epoch, shape [band, channel]"""
+        return self._bandpower[self.n_epochs - 1]
+
+    def ratio(self, numerator: str, denominator: str, epoch: int = -1):
+        """
+        ratio of the power of two bands (mean of the channels), e.g. ratio('Theta', 'Delta') for theta/delta
+
+        :param epoch: the epoch, the newest by default. None for an array with the ratio of every epoch
+        """
+        bandpower = self._bandpower[:self.n_epochs] if epoch is None else self._bandpower[:self.n_epochs][epoch]
+        bandpower = bandpower.mean(axis=-1)
+        return (bandpower[..., self.band_names.index(numerator)] /
+                bandpower[..., self.band_names.index(denominator)])
+
+    def _grow(self):
+        if self.n_epochs < len(self._psd):
+            return
+        size = max(2 * len(self._psd), 256)
+        for name in ('_psd', '_bandpower'):
+            old = getattr(self, name)
+            grown = np.empty((size,) + old.shape[1:])
+            grown[:len(old)] = old
+            setattr(self, name, grown)
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import yasa
+from yasa.others import trimbothstd
+
+# the parameters of YasaClassifier.get_eyes()
+REM_DETECT_PARAMS = dict(amplitude=(50, 325), duration=(0.3, 1.2), relative_prominence=0.8, freq_rem=(0.5, 5),
+                         remove_outliers=False)
+# the columns of yasa.rem_detect(...).summary() without a hypnogram, the first three are in seconds
+COLUMNS = ['Start', 'Peak', 'End', 'Duration', 'LOCAbsValPeak', 'ROCAbsValPeak', 'LOCAbsRiseSlope', 'ROCAbsRiseSlope',
+           'LOCAbsFallSlope', 'ROCAbsFallSlope']
+# seconds of signal before the new samples that the detection looks at. The bandpass filter of rem_detect reaches
+# about 3.3 s and a rem with its bases at most 2.4 s
+CONTEXT_SEC = 60
+# rems that start within the last seconds of the recording can still change with the next samples
+SETTLE_SEC = 10
+
+
+def amplitude_ok(trimmed_std: np.ndarray) -> bool:
+    """
+    the amplitude check of yasa.rem_detect, which gives up if a channel fails it
+
+    :param trimmed_std: trimbothstd(data, cut=0.05) of each channel in uV
+    """
+    return bool(np.all((trimmed_std > 0.1) & (trimmed_std < 1e3)))
+
+
+def rem_detect(data: np.ndarray, sf: int):
+    """yasa.rem_detect with the parameters of YasaClassifier.get_eyes(), data in uV, shape (2, n)"""
+    return yasa.rem_detect(data[0], data[1], sf, hypno=None, include=4, verbose='error', **REM_DETECT_PARAMS)
+
+
+class IncrementalRemDetection:
+    """
+    yasa.rem_detect (without a hypnogram) on a growing recording. Every call of add() only looks at the new samples and
+    the CONTEXT_SEC + SETTLE_SEC before them, so it takes the same time at any point of the night, and finds the rems
+    rem_detect on the recording up to the new samples would find.
+
+    Rems are identified by their start (left base). A rem is final once SETTLE_SEC of signal follow its start and is
+    added to the event table exactly once, even if it spans the border between two calls. The rems of the last
+    SETTLE_SEC are kept as pending and replaced with every call. The event table then matches rem_detect on the whole
+    recording, except for windows whose amplitude rem_detect rejects (see rejected), which have no rems.
+    """
+    def __init__(self, sf: int = 256, start: int = 0):
+        """
+        :param sf: sample rate
+        :param start: the sample of the recording passed first, e.g. to start in the middle of a recording
+        """
+        self.sf = sf
+        self.n_samples = start  # samples of the recording so far
+        self.rejected = False  # rem_detect gave up on the amplitude of the last window
+        self._buffer = np.empty((2, 0))  # the end of the recording in uV
+        self._final_until = start  # rems that start before this sample are final
+        self._final = []  # DataFrames of the final rems
+        self._pending = pd.DataFrame(columns=COLUMNS)
+
+    @property
+    def events(self) -> pd.DataFrame:
+        """the rems found so far (the last SETTLE_SEC may still change), times in seconds since the recording started"""
+        tables = [table for table in self._final + [self._pending] if len(table)]
+        if not tables:
+            return pd.DataFrame(columns=COLUMNS)
+        return pd.concat(tables, ignore_index=True)
+
+    def add(self, loc: np.ndarray, roc: np.ndarray) -> pd.DataFrame:
+        """
+        :param loc: the new samples of the left channel in V (like the data of a mne RawArray)
+        :param roc: the new samples of the right channel in V
+        :return: the rems that start in the new samples, times in seconds since the recording started
+        """
+        window = np.concatenate((self._buffer, np.vstack((loc, roc)) * 1e6), axis=1)  # to uV, like get_eyes()
+        window_start = self.n_samples - self._buffer.shape[1]
+        new_start = self.n_samples
+        self.n_samples += len(loc)
+
+        rems = self._detect(window, window_start)
+        starts = np.round(rems['Start'].to_numpy() * self.sf)
+        final_until = max(self.n_samples - SETTLE_SEC * self.sf, self._final_until)
+        self._final.append(rems[(starts >= self._final_until) & (starts < final_until)])
+        self._pending = rems[starts >= final_until]
+        self._final_until = final_until
+
+        self._buffer = window[:, -(CONTEXT_SEC + SETTLE_SEC) * self.sf:]
+        return rems[starts >= new_start].reset_index(drop=True)
+
+    def _detect(self, window: np.ndarray, window_start: int) -> pd.DataFrame:
+        self.rejected = not amplitude_ok(trimbothstd(window, cut=0.05))
+        rem = None if self.rejected else rem_detect(window, self.sf)
+        if not rem:
+            return pd.DataFrame(columns=COLUMNS)
+        rems = rem.summary()[COLUMNS].copy()
+        rems[COLUMNS[:3]] += window_start / self.sf
+        return rems
@@ -0,0 +1,276 @@
+import antropy as ant
+import numpy as np
+import pandas as pd
+import scipy.signal as sp_sig
+import scipy.stats as sp_stats
+import yasa
+from mne.filter import filter_data, resample
+from scipy.integrate import trapezoid
+
+from scripts.Utils.ModelRegistry import get_classifier
+from scripts.Utils.StreamingPreprocessing import StreamingPreprocessor
+
+# the feature pipeline of yasa.SleepStaging for a single eeg channel, see SleepStaging.fit()
+STAGING_SF = 100
+FREQ_BROAD = (0.4, 30)
+BANDS = [(0.4, 1, 'sdelta'),
+         (1, 4, 'fdelta'),
+         (4, 8, 'theta'),
+         (8, 12, 'alpha'),
+         (12, 16, 'sigma'),
+         (16, 30, 'beta')]
+FEATURES = ['std', 'iqr', 'skew', 'kurt', 'nzc', 'hmob', 'hcomp', 'sdelta', 'fdelta', 'theta', 'alpha', 'sigma',
+            'beta', 'dt', 'ds', 'db', 'at', 'abspow', 'perm', 'higuchi', 'petrosian']
+ROLLC_WINDOW = 15  # centered, triangular: 7.5 min
+ROLLP_WINDOW = 4  # past 2 min
+TAIL_EPOCHS = 4  # epochs of signal kept to resample and filter the newest epochs
+PREPROCESSING = ['yasa', 'streaming']
+
+
+def epoch_features(epochs: np.ndarray, sf: float = STAGING_SF) -> np.ndarray:
+    """
+    the eeg features of yasa.SleepStaging for every row of epochs
+
+    :param epochs: filtered epochs in uV, shape (n_epochs, n_samples)
+    :return: array of shape (n_epochs, len(FEATURES))
+    """
+    hmob, hcomp = ant.hjorth_params(epochs, axis=1)
+    freqs, psd = sp_sig.welch(epochs, sf, window='hamming', nperseg=int(5 * sf), average='median')
+    bp = yasa.bandpower_from_psd_ndarray(psd, freqs, bands=BANDS)
+    sdelta, fdelta, theta, alpha, sigma, beta = bp
+    delta = sdelta + fdelta
+    idx_broad = np.logical_and(freqs >= FREQ_BROAD[0], freqs <= FREQ_BROAD[1])
+
+    return np.column_stack([np.std(epochs, ddof=1, axis=1),
+                            sp_stats.iqr(epochs, rng=(25, 75), axis=1),
+                            sp_stats.skew(epochs, axis=1),
+                            sp_stats.kurtosis(epochs, axis=1),
+                            ant.num_zerocross(epochs, axis=1),
+                            hmob,
+                            hcomp,
+                            sdelta, fdelta, theta, alpha, sigma, beta,
+                            delta / theta,
+                            delta / sigma,
+                            delta / beta,
+                            alpha / theta,
+                            trapezoid(psd[:, idx_broad], dx=freqs[1] - freqs[0]),
+                            np.apply_along_axis(ant.perm_entropy, axis=1, arr=epochs, normalize=True),
+                            np.apply_along_axis(ant.higuchi_fd, axis=1, arr=epochs),
+                            ant.petrosian_fd(epochs, axis=1)])
+
+
+class IncrementalSleepStaging:
+    """
+    Sleep staging of a growing recording, one 30 s epoch at a time. Gives the prediction yasa.SleepStaging would give
+    for the last epoch of the whole recording, without recomputing the night:
+
+    - only the newest epochs are resampled, filtered and turned into features, the features of older epochs are cached.
+      The epoch before the newest one is computed a second time once its right neighbour is known, after that the
+      filter does not reach it anymore.
+    - the smoothed features (rolling means over 15 and 4 epochs) are only updated for the epochs whose window changed.
+    - the normalization uses the percentiles over the cached smoothed features and only the newest row is classified.
+
+    With context_epochs the newest epoch is staged from the last context_epochs epochs only, as if SleepStaging was run
+    on them (except for time_hour, which stays the time since the start of the recording). Older features are dropped,
+    so time and memory per epoch are bounded however long the recording gets.
+
+    With preprocessing='streaming' the signal is not resampled and filtered by SleepStaging's zero phase filters but by
+    a StreamingPreprocessor (polyphase resampling, causal band-pass), which carries its state from epoch to epoch. Every
+    epoch is then preprocessed and turned into features exactly once, the previous epoch is not computed again. The
+    causal filter shifts the phase of the signal, so the predictions are close to but not the same as SleepStaging's.
+
+    With n_channels > 1 several eeg channels (e.g. eegl and eegr) are staged together. Every step runs once on an array
+    of all channels: resampling and filtering on (channels, samples), the features on (channels * epochs, samples), the
+    smoothing and normalization on the features of all channels side by side, and the classifier predicts one row per
+    channel in a single call. Each channel is staged like SleepStaging would stage it alone, predict_last() fuses them
+    by the mean of their probabilities.
+    """
+    def __init__(self, sf: int = 256, male: bool = True, age: int = 45, path_to_model: str = 'auto',
+                 context_epochs: int = None, preprocessing: str = 'yasa', n_channels: int = 1):
+        """
+        :param sf: sample rate of the signal passed to add_epoch
+        :param male: metadata for the classifier
+        :param age: metadata for the classifier
+        :param path_to_model: the yasa classifier to use, see ModelRegistry.get_classifier()
+        :param context_epochs: number of epochs the staging is based on, None for the whole recording
+        :param preprocessing: 'yasa' for the filters of SleepStaging, 'streaming' for a StreamingPreprocessor
+        :param n_channels: number of eeg channels passed to add_epoch
+        """
+        if preprocessing not in PREPROCESSING:
+            raise ValueError(f'preprocessing has to be one of {PREPROCESSING}, not {preprocessing}')
+        self.sf = sf
+        self.epoch_len = 30 * sf
+        self.metadata = {'age': age, 'male': int(male)}
+        self.clf = get_classifier(path_to_model)
+        self.context_epochs = context_epochs
+        self.n_channels = n_channels
+        self.preprocessor = None
+        if preprocessing == 'streaming':
+            self.preprocessor = StreamingPreprocessor(sf, STAGING_SF, *FREQ_BROAD, n_channels=n_channels,
+                                                      keep_seconds=30)
+
+        self.n_epochs = 0
+        self._offset = 0  # epoch of the first cached row
+        self._tail = np.empty((n_channels, 0))
+        # one row per epoch with the features of every channel after each other
+        n_features = n_channels * len(FEATURES)
+        self._features = np.empty((0, n_features))  # raw features
+        self._rollc = np.empty((0, n_features))  # not normalized yet
+        self._rollp = np.empty((0, n_features))
+
+    def add_epoch(self, epoch: np.ndarray):
+        """
+        :param epoch: the next 30 s of the eeg channel in V (like the data of a mne RawArray), shape (30 * sf,), or of
+        every channel, shape (n_channels, 30 * sf)
+        """
+        epoch = np.atleast_2d(epoch)
+        self.n_epochs += 1
+        self._grow()
+        n = self.n_epochs - self._offset
+
+        if self.preprocessor is not None:
+            # the preprocessor continues where the previous epoch ended, only the new epoch is computed
+            self.preprocessor.process(epoch * 1e6)
+            n_tail = 1
+            data = self.preprocessor.epoch(self.preprocessor.n_epochs - 1)
+        else:
+            # resample and filter the tail like SleepStaging does with the whole recording
+            self._tail = np.concatenate((self._tail, epoch), axis=1)[:, -TAIL_EPOCHS * self.epoch_len:]
+            data = resample(self._tail, up=float(STAGING_SF), down=float(self.sf), npad='auto') * 1e6
+            data = filter_data(data, STAGING_SF, l_freq=FREQ_BROAD[0], h_freq=FREQ_BROAD[1], verbose=False)
+            n_tail = min(n, 2)
+            end = data.shape[1] // (30 * STAGING_SF) * 30 * STAGING_SF
+            data = data[:, end - n_tail * 30 * STAGING_SF:end]
+        # the epochs of all channels in one batch, shape (channels * n_tail, samples)
+        features = epoch_features(data.reshape(self.n_channels * n_tail, 30 * STAGING_SF))
+        features = features.reshape(self.n_channels, n_tail, len(FEATURES)).transpose(1, 0, 2)
+        self._features[n - n_tail:n] = features.reshape(n_tail, -1)
+
+        # smoothed features of all epochs whose window contains one of the changed rows
+        first = max(n - n_tail - ROLLC_WINDOW // 2, 0)
+        context = max(first - ROLLC_WINDOW // 2, 0)
+        rollc, rollp = self._smooth(self._features[context:n])
+        self._rollc[first:n] = rollc[first - context:]
+        self._rollp[first:n] = rollp[first - context:]
+
+        self._trim()
+
+    def predict_last(self) -> str:
+        """
+        returns the predicted stage of the newest epoch, e.g. 'W', 'N1', 'N2', 'N3' or 'R'. With several channels the
+        stage with the highest mean probability over the channels
+        """
+        if self.n_epochs == 0:
+            return None
+        return self.predict_proba_last().idxmax()
+
+    def predict_proba_last(self) -> pd.Series:
+        """returns the probability of every stage for the newest epoch, the mean over the channels"""
+        if self.n_epochs == 0:
+            return None
+        return self.predict_proba_last_per_channel().mean(axis=0)
+
+    def predict_proba_last_per_channel(self) -> pd.DataFrame:
+        """returns the probability of every stage (columns) for the newest epoch, one row per channel"""
+        if self.n_epochs == 0:
+            return None
+        return pd.DataFrame(self.clf.predict_proba(self._last_row()), columns=self.clf.classes_)
+
+    def predict_last_per_channel(self) -> list:
+        """returns the predicted stage of the newest epoch for every channel"""
+        if self.n_epochs == 0:
+            return None
+        return list(self.predict_proba_last_per_channel().idxmax(axis=1))
+
+    def predict_all(self) -> np.ndarray:
+        """
+        returns the predicted stage of every epoch so far, as yasa.SleepStaging would predict them for the recording
+        so far (fused over the channels like predict_last). Needs the features of all epochs, so it is not available
+        with context_epochs
+        """
+        if self.context_epochs is not None:
+            raise ValueError('predict_all() needs the whole recording, context_epochs has to be None')
+        n = self.n_epochs
+        if n == 0:
+            return np.empty(0, dtype=object)
+
+        # the rows of every channel after each other
+        columns = {}
+        for suffix, values in (('', self._features[:n]),
+                               ('_c7min_norm', self._robust_scale(self._rollc[:n])),
+                               ('_p2min_norm', self._robust_scale(self._rollp[:n]))):
+            values = values.reshape(n, self.n_channels, len(FEATURES)).transpose(1, 0, 2).reshape(-1, len(FEATURES))
+            for name, column in zip(FEATURES, values.T):
+                columns['eeg_' + name + suffix] = column.astype(np.float32)
+        times = np.tile(np.arange(n) * 30.0, self.n_channels)
+        columns['time_hour'] = (times / 3600).astype(np.float32)
+        with np.errstate(invalid='ignore'):
+            columns['time_norm'] = (times / times[-1]).astype(np.float32)
+        for name, value in self.metadata.items():
+            columns[name] = np.full(len(times), value)
+
+        proba = self.clf.predict_proba(pd.DataFrame(columns)[self.clf.feature_name_])
+        return self.clf.classes_[proba.reshape(self.n_channels, n, -1).mean(axis=0).argmax(axis=1)]
+
+    def _last_row(self) -> pd.DataFrame:
+        # the feature row SleepStaging would build for the newest epoch, one per channel
+        n = self.n_epochs - self._offset
+        if self.context_epochs is not None and self.n_epochs > self.context_epochs:
+            # the smoothing windows are cut off at the start of the context
+            rollc, rollp = self._smooth(self._features[n - self.context_epochs:n])
+            n_context = self.context_epochs
+        else:
+            rollc, rollp = self._rollc[:n], self._rollp[:n]
+            n_context = n
+
+        rows = {}
+        for suffix, values in (('', self._features[n - 1]),
+                               ('_c7min_norm', self._robust_scale(rollc)[-1]),
+                               ('_p2min_norm', self._robust_scale(rollp)[-1])):
+            for name, column in zip(FEATURES, values.reshape(self.n_channels, len(FEATURES)).T):
+                rows['eeg_' + name + suffix] = column.astype(np.float32)
+        rows['time_hour'] = np.full(self.n_channels, np.float32((self.n_epochs - 1) * 30 / 3600))
+        with np.errstate(invalid='ignore'):
+            rows['time_norm'] = np.full(self.n_channels, np.float32((n_context - 1) / np.int64(n_context - 1)))
+        for name, value in self.metadata.items():
+            rows[name] = np.full(self.n_channels, value)
+
+        return pd.DataFrame(rows)[self.clf.feature_name_]
+
+    @staticmethod
+    def _smooth(features: np.ndarray):
+        features = pd.DataFrame(features)
+        rollc = features.rolling(window=ROLLC_WINDOW, center=True, min_periods=1, win_type='triang').mean()
+        rollp = features.rolling(window=ROLLP_WINDOW, min_periods=1).mean()
+        return rollc.to_numpy(), rollp.to_numpy()
+
+    @staticmethod
+    def _robust_scale(values: np.ndarray) -> np.ndarray:
+        # sklearn.preprocessing.robust_scale(values, quantile_range=(5, 95))
+        q_low, q_high = np.nanpercentile(values, [5, 95], axis=0)
+        scale = q_high - q_low
+        scale[scale < 10 * np.finfo(scale.dtype).eps] = 1.0
+        return (values - np.nanmedian(values, axis=0)) / scale
+
+    def _grow(self):
+        if self.n_epochs - self._offset <= len(self._features):
+            return
+        size = max(2 * len(self._features), 256)
+        for name in ('_features', '_rollc', '_rollp'):
+            old = getattr(self, name)
+            grown = np.empty((size, old.shape[1]))
+            grown[:len(old)] = old
+            setattr(self, name, grown)
+
+    def _trim(self):
+        # with a bounded context only the rows of the context (and the smoothing windows) are kept
+        if self.context_epochs is None:
+            return
+        keep = max(self.context_epochs, ROLLC_WINDOW + 2)
+        n = self.n_epochs - self._offset
+        if n <= 2 * keep:
+            return
+        for name in ('_features', '_rollc', '_rollp'):
+            rows = getattr(self, name)
+            rows[:keep] = rows[n - keep:n]
+        self._offset += n - keep
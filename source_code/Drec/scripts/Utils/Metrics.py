@@ -0,0 +1,237 @@
+import bisect
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# upper bounds in seconds, from 10 us (decoding a packet) to 60 s (scoring that fell far behind)
+DEFAULT_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_PORT = 8001  # 8000 is the HDServer, 5000 the webhook
+
+
+class Histogram:
+    """
+    distribution of durations (or other values) in cumulative buckets like a prometheus histogram. observe() only
+    counts into a bucket, so it can be called for every packet.
+    """
+    def __init__(self, name: str, description: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # the last one for values above the largest bucket
+        self._sum = 0.0
+        self._max = 0.0
+        self._last = None
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._max = max(self._max, value)
+            self._last = value
+
+    @contextmanager
+    def time(self):
+        """measures the duration of a with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        """count, sum, max and last value and the count of every bucket, taken at once"""
+        with self._lock:
+            return {'counts': list(self._counts), 'count': sum(self._counts), 'sum': self._sum, 'max': self._max,
+                    'last': self._last}
+
+    def quantile(self, q: float, snapshot: dict = None) -> float:
+        """estimates a quantile from the buckets (the upper bound of the bucket it falls into)"""
+        snapshot = snapshot or self.snapshot()
+        if snapshot['count'] == 0:
+            return float('nan')
+        rank = q * snapshot['count']
+        seen = 0
+        for bound, count in zip(self.buckets, snapshot['counts']):
+            seen += count
+            if seen >= rank:
+                return bound
+        return snapshot['max']
+
+    def render(self) -> list:
+        snapshot = self.snapshot()
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        cumulative = 0
+        for bound, count in zip(self.buckets, snapshot['counts']):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {snapshot["count"]}')
+        lines.append(f'{self.name}_sum {snapshot["sum"]!r}')
+        lines.append(f'{self.name}_count {snapshot["count"]}')
+        return lines
+
+    def status(self) -> str:
+        snapshot = self.snapshot()
+        if snapshot['count'] == 0:
+            return f'{self.name}: no values yet'
+        return (f'{self.name}: n={snapshot["count"]} mean={_ms(snapshot["sum"] / snapshot["count"])} '
+                f'p50<={_ms(self.quantile(0.5, snapshot))} p99<={_ms(self.quantile(0.99, snapshot))} '
+                f'max={_ms(snapshot["max"])} last={_ms(snapshot["last"])}')
+
+
+class Gauge:
+    """a value that goes up and down, either set() or read from a function whenever the metrics are rendered"""
+    def __init__(self, name: str, description: str, function=None):
+        self.name = name
+        self.description = description
+        self.function = function
+        self._value = float('nan')
+
+    def set(self, value: float):
+        self._value = value
+
+    @property
+    def value(self) -> float:
+        if self.function is None:
+            return self._value
+        try:
+            value = self.function()
+        except Exception:
+            return float('nan')
+        return float('nan') if value is None else value
+
+    def render(self) -> list:
+        return [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} gauge', f'{self.name} {self.value!r}']
+
+    def status(self) -> str:
+        value = self.value
+        return f'{self.name}: {value:.10g}' if isinstance(value, (int, float)) else f'{self.name}: {value}'
+
+
+class MetricsRegistry:
+    """
+    the histograms and gauges of the program by name. histogram() and gauge() return the existing metric if the name
+    is registered already, so every module can ask for its metrics where it needs them.
+    """
+    def __init__(self, prefix: str = 'drec_'):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, description: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, description, buckets)
+
+    def gauge(self, name: str, description: str, function=None) -> Gauge:
+        gauge = self._get(Gauge, name, description)
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def render(self) -> str:
+        """all metrics in the prometheus text format"""
+        lines = []
+        for metric in self._all():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def status(self) -> str:
+        """a short line per metric, durations in ms"""
+        return '\n'.join(metric.status() for metric in self._all())
+
+    def _get(self, kind, name: str, description: str, *args):
+        name = self.prefix + name
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = kind(name, description, *args)
+            elif not isinstance(metric, kind):
+                raise ValueError(f'{name} is registered as a {type(metric).__name__} already')
+            return metric
+
+    def _all(self) -> list:
+        with self._lock:
+            return [self._metrics[name] for name in sorted(self._metrics)]
+
+
+# the metrics of this process
+METRICS = MetricsRegistry()
+# time the capture backends spend on one packet or chunk: header parsing, reassembly and framing
+CAPTURE_TIME = METRICS.histogram('capture_packet_seconds', 'processing of one captured packet or received chunk')
+
+
+class MetricsServer:
+    """serves the metrics of a registry at http://host:port/metrics in the prometheus text format"""
+    def __init__(self, registry: MetricsRegistry = METRICS, host: str = '127.0.0.1', port: int = METRICS_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.server = None
+
+    def start(self) -> bool:
+        """starts serving in a background thread, returns False if the port could not be opened"""
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # no line per request in the cli
+
+        try:
+            self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            print(f'[ERROR] could not serve the metrics on {self.host}:{self.port}: {e}')
+            return False
+        self.port = self.server.server_address[1]
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True).start()
+        return True
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def resident_memory() -> int:
+    """the resident memory (rss) of this process in bytes, the peak on systems where the current one is not known"""
+    if sys.platform.startswith('linux'):
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb)
+        return counters.WorkingSetSize
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # bytes on macos
+
+
+def _ms(seconds: float) -> str:
+    return f'{1000 * seconds:.2f}ms'
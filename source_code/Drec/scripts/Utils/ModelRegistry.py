@@ -0,0 +1,49 @@
+import glob
+import os
+import threading
+import time
+import warnings
+
+import joblib
+import numpy as np
+import pandas as pd
+import yasa
+
+warnings.filterwarnings('ignore', message='Trying to unpickle estimator LabelEncoder from version 0.24.2 when *')
+
+# the yasa classifiers loaded by this process, by path. They are loaded once and kept for the lifetime of the process
+_classifiers = {}
+_lock = threading.Lock()
+
+
+def resolve_model_path(path_to_model: str = 'auto', name: str = 'clf_eeg+demo') -> str:
+    """'auto' is the latest classifier called name shipped with yasa, like SleepStaging.predict() picks it"""
+    if path_to_model != 'auto':
+        return os.path.abspath(path_to_model)
+    clf_dir = os.path.join(os.path.dirname(yasa.__file__), 'classifiers')
+    return np.sort(glob.glob(os.path.join(clf_dir, name + '_*.joblib')))[-1]
+
+
+def get_classifier(path_to_model: str = 'auto', name: str = 'clf_eeg+demo'):
+    """
+    returns the classifier, loading it only the first time it is asked for
+
+    :param path_to_model: path of a joblib file with a trained LGBMClassifier or 'auto'
+    :param name: the kind of classifier 'auto' picks, e.g. 'clf_eeg+demo' for one eeg channel and metadata
+    """
+    path = resolve_model_path(path_to_model, name)
+    with _lock:
+        if path not in _classifiers:
+            _classifiers[path] = joblib.load(path)
+        return _classifiers[path]
+
+
+def warm_up(path_to_model: str = 'auto', name: str = 'clf_eeg+demo') -> float:
+    """
+    loads the classifier and runs one prediction, so the first epoch of a recording is not slowed down by it. Returns
+    the seconds it took
+    """
+    start = time.perf_counter()
+    clf = get_classifier(path_to_model, name)
+    clf.predict(pd.DataFrame(np.zeros((1, len(clf.feature_name_))), columns=clf.feature_name_))
+    return time.perf_counter() - start
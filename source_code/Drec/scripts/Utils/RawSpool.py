@@ -0,0 +1,112 @@
+import json
+import os
+import sys
+
+from scripts.Utils.EdfUtils import StreamingEdfWriter
+from scripts.Utils.RecordingBuffer import RecordingBuffer
+
+SPOOL_FILE = 'recording.spool'
+HEADER_FILE = 'spool.json'
+
+
+class RawSpool:
+    """
+    Crash safe copy of a running recording in its session directory. The samples are appended to a memory mapped file
+    (see RecordingBuffer) and a small json header describes its content, so an interrupted recording can be converted
+    to edf with recover_spool() or continued with resume=True.
+    """
+    def __init__(self, path: str, columns: list, sample_rate: int, block_size: int, resume: bool = False):
+        """
+        :param path: the session directory
+        :param columns: the ZmaxDataID values of the recorded columns
+        :param sample_rate: sample rate of the recording
+        :param block_size: block size of the RecordingBuffer, a multiple of the epoch length
+        :param resume: continue the spool in path instead of starting a new one
+        """
+        self.path = path
+        self.header = {'sample_rate': sample_rate,
+                       'columns': list(columns),
+                       'block_size': block_size,
+                       'dtype': 'float64',
+                       'n_samples': 0,
+                       'total_samples': 0,
+                       'epoch_count': 0}
+        if resume:
+            self.header = read_spool_header(path)
+        else:
+            os.makedirs(path, exist_ok=True)
+
+        self.recording = RecordingBuffer(len(self.header['columns']),
+                                         block_size=self.header['block_size'],
+                                         dtype=self.header['dtype'],
+                                         spool_file=os.path.join(path, SPOOL_FILE),
+                                         n_samples=self.header['n_samples'])
+        self.write_header()
+
+    def update(self, epoch_count: int, total_samples: int):
+        """
+        records how much of the spool file holds valid data. Called for every epoch, samples appended after the last
+        call are lost in a crash.
+        """
+        self.header['n_samples'] = len(self.recording)
+        self.header['total_samples'] = total_samples
+        self.header['epoch_count'] = epoch_count
+        self.write_header()
+
+    def write_header(self):
+        # write to a temporary file first, so a crash while writing never leaves a broken header behind
+        header_file = os.path.join(self.path, HEADER_FILE)
+        with open(header_file + '.tmp', 'w') as f:
+            json.dump(self.header, f)
+        os.replace(header_file + '.tmp', header_file)
+
+    def close(self, epoch_count: int, total_samples: int):
+        self.recording.flush()
+        self.update(epoch_count, total_samples)
+
+
+def read_spool_header(path: str) -> dict:
+    with open(os.path.join(path, HEADER_FILE)) as f:
+        return json.load(f)
+
+
+def remove_spool(path: str):
+    """deletes the spool of the session directory path, once its recording is saved as edf"""
+    for name in (SPOOL_FILE, HEADER_FILE):
+        try:
+            os.remove(os.path.join(path, name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f'[ERROR] could not delete {os.path.join(path, name)}: {e}')
+
+
+def recover_spool(path: str, file_name: str = 'recording.edf', epoch_len: int = 30 * 256, progress=None):
+    """
+    converts the spool in the session directory path into an edf file, e.g. after the program crashed during a
+    recording. The spool is read epoch by epoch, so the recording never has to fit into memory.
+
+    :param progress: optional: called with the percent done, in steps of 10 percent
+    """
+    header = read_spool_header(path)
+    recording = RecordingBuffer(len(header['columns']),
+                                block_size=header['block_size'],
+                                dtype=header['dtype'],
+                                spool_file=os.path.join(path, SPOOL_FILE),
+                                n_samples=header['n_samples'])
+
+    writer = StreamingEdfWriter(path, file_name, header['columns'], header['sample_rate'])
+    remaining = range(0, len(recording), epoch_len)
+    reported = 0
+    for i, start in enumerate(remaining):
+        writer.write(recording.get(start, start + epoch_len))
+        percent = 100 * (i + 1) // len(remaining)
+        if progress is not None and percent // 10 > reported // 10:
+            progress(percent)
+            reported = percent
+    writer.close()
+    print(f'recovered {len(recording)} samples ({header["epoch_count"]} epochs) to {os.path.join(path, file_name)}')
+
+
+if __name__ == '__main__':
+    recover_spool(sys.argv[1])
@@ -0,0 +1,117 @@
+import os
+
+import numpy as np
+
+
+class RecordingBuffer:
+    """
+    Append only, columnar store for the samples of a recording. Samples are written into preallocated blocks of
+    block_size samples (one row per channel), so appending never copies what was recorded before and ranges that lie
+    within one block are handed out as views.
+
+    If a spool_file is given, the blocks are memory mapped regions of that file instead of memory, so everything that is
+    appended reaches the disk (page cache) right away and survives a crash of the program.
+    """
+    def __init__(self, n_channels: int, block_size: int = 20 * 30 * 256, dtype=np.float64, spool_file: str = None,
+                 n_samples: int = 0):
+        """
+        :param n_channels: number of values per sample
+        :param block_size: number of samples per block. A multiple of the epoch length keeps every epoch in one block
+        :param dtype: dtype of the stored values
+        :param spool_file: optional file the blocks are mapped to
+        :param n_samples: number of samples already in an existing spool_file, to continue a recording
+        """
+        self.n_channels = n_channels
+        self.block_size = block_size
+        self.dtype = np.dtype(dtype)
+        self.spool_file = spool_file
+        self.blocks = []
+        self.n_samples = n_samples
+
+        if spool_file is not None:
+            if not os.path.exists(spool_file):
+                open(spool_file, 'wb').close()
+            for _ in range(-(-n_samples // block_size)):  # ceil
+                self.blocks.append(self._new_block())
+
+    def __len__(self):
+        return self.n_samples
+
+    @property
+    def shape(self):
+        """shape of the recording as (n_samples, n_channels), like the row per sample layout used elsewhere"""
+        return self.n_samples, self.n_channels
+
+    @property
+    def nbytes(self):
+        return sum(block.nbytes for block in self.blocks)
+
+    def append(self, samples: np.ndarray):
+        """
+        :param samples: array of shape (n_samples, n_channels), one row per sample
+        """
+        n_new = len(samples)
+        written = 0
+        while written < n_new:
+            block_idx, offset = divmod(self.n_samples, self.block_size)
+            if block_idx == len(self.blocks):
+                self.blocks.append(self._new_block())
+            count = min(n_new - written, self.block_size - offset)
+            self.blocks[block_idx][:, offset:offset + count] = samples[written:written + count].T
+            written += count
+            self.n_samples += count
+
+    def _new_block(self):
+        if self.spool_file is None:
+            return np.empty((self.n_channels, self.block_size), dtype=self.dtype)
+
+        block_nbytes = self.n_channels * self.block_size * self.dtype.itemsize
+        offset = len(self.blocks) * block_nbytes
+        if os.path.getsize(self.spool_file) < offset + block_nbytes:
+            with open(self.spool_file, 'r+b') as f:
+                f.truncate(offset + block_nbytes)
+        return np.memmap(self.spool_file, dtype=self.dtype, mode='r+', offset=offset,
+                         shape=(self.n_channels, self.block_size))
+
+    def flush(self):
+        """writes the mapped blocks to disk, only needed to survive a crash of the os, not just of the program"""
+        for block in self.blocks:
+            if isinstance(block, np.memmap):
+                block.flush()
+
+    def close(self):
+        """releases the blocks, so a spool file is no longer mapped and can be deleted. The buffer is empty afterwards"""
+        self.blocks = []
+        self.n_samples = 0
+
+    def get(self, start: int = 0, stop: int = None, channels=None) -> np.ndarray:
+        """
+        returns the samples start:stop as an array of shape (n_channels, stop - start). If the range lies within one
+        block (and channels is None or a single int) the result is a view, otherwise a contiguous copy.
+
+        :param start: first sample
+        :param stop: sample after the last one, defaults to the end of the recording
+        :param channels: index or list of indices of the channels to return, defaults to all
+        """
+        start, stop, _ = slice(start, stop).indices(self.n_samples)
+        stop = max(start, stop)
+        if channels is None:
+            channels = slice(None)
+
+        first_block, first_offset = divmod(start, self.block_size)
+        if stop - start > 0 and (stop - 1) // self.block_size == first_block:
+            return self.blocks[first_block][channels, first_offset:first_offset + stop - start]
+
+        n_channels = len(np.arange(self.n_channels)[channels]) if not np.isscalar(channels) else None
+        out = np.empty((stop - start,) if n_channels is None else (n_channels, stop - start), dtype=self.dtype)
+        pos = start
+        while pos < stop:
+            block_idx, offset = divmod(pos, self.block_size)
+            count = min(stop - pos, self.block_size - offset)
+            out[..., pos - start:pos - start + count] = self.blocks[block_idx][channels, offset:offset + count]
+            pos += count
+        return out
+
+    def to_array(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """returns the samples start:stop as one contiguous array of shape (n_samples, n_channels)"""
+        return np.ascontiguousarray(self.get(start, stop).T)
@@ -0,0 +1,129 @@
+from math import gcd
+
+import numpy as np
+from scipy.signal import butter, firwin, sosfilt
+
+
+def resample_filter(up: int, down: int) -> np.ndarray:
+    """the anti aliasing filter scipy.signal.resample_poly designs for up / down"""
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    return firwin(2 * half_len + 1, 1 / max_rate, window=('kaiser', 5.0)) * up
+
+
+class StreamingPreprocessor:
+    """
+    Resampling and band-pass filtering of a signal that arrives in pieces of any length, e.g. every packet of the
+    recording or every epoch. Every sample is processed once, the state of both stages is carried over to the next
+    call, so the cost per sample is the same at any point of the night and the history is never filtered again:
+
+    - a polyphase downsampler with the filter of scipy.signal.resample_poly, kept as the last input samples.
+    - a causal butterworth band-pass (second order sections), kept as the sosfilt state.
+
+    The output is the same as offline sosfilt(sos, upfirdn(h, x, up, down)) on the whole signal. It lags the input by
+    delay samples, the group delay of the resampling filter (0.1 s from 256 to 100 Hz). The processed signal is kept
+    in a buffer of target_sf, see get() and epoch().
+    """
+    def __init__(self, sf: int = 256, target_sf: int = 100, l_freq: float = 0.4, h_freq: float = 30,
+                 order: int = 4, n_channels: int = 1, keep_seconds: float = None):
+        """
+        the defaults give the sample rate and band yasa.SleepStaging uses
+
+        :param sf: sample rate of the input
+        :param target_sf: sample rate of the output
+        :param l_freq: lower edge of the band-pass, None for a low-pass
+        :param h_freq: upper edge of the band-pass, None for a high-pass
+        :param order: order of the butterworth filter
+        :param n_channels: number of channels passed to process
+        :param keep_seconds: how much of the output the buffer keeps at least, None for all of it
+        """
+        self.sf = sf
+        self.target_sf = target_sf
+        divisor = gcd(sf, target_sf)
+        self.up = target_sf // divisor
+        self.down = sf // divisor
+        self.h = resample_filter(self.up, self.down)
+        self.delay = (len(self.h) // 2) / self.down  # in output samples
+
+        # the filter split into its phases, phases[i, p] = h[p + i * up]
+        n_taps = -(-len(self.h) // self.up)
+        padded = np.zeros(n_taps * self.up)
+        padded[:len(self.h)] = self.h
+        self._phases = padded.reshape(n_taps, self.up)
+
+        if l_freq is None:
+            self.sos = butter(order, h_freq, btype='lowpass', fs=target_sf, output='sos')
+        elif h_freq is None:
+            self.sos = butter(order, l_freq, btype='highpass', fs=target_sf, output='sos')
+        else:
+            self.sos = butter(order, [l_freq, h_freq], btype='bandpass', fs=target_sf, output='sos')
+
+        self.n_channels = n_channels
+        self.n_input = 0  # input samples so far
+        self.n_samples = 0  # output samples so far
+        self._history = np.zeros((n_channels, n_taps - 1))  # the last input samples, zeros before the start
+        self._zi = np.zeros((len(self.sos), n_channels, 2))
+        self.keep = None if keep_seconds is None else int(keep_seconds * target_sf)
+        self._buffer = np.empty((n_channels, 0))
+        self._buffer_start = 0  # output sample of the first column of the buffer
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        :param samples: the next samples, shape (n_channels, n) or (n,) for a single channel
+        :return: the output samples that follow from them, same number of dimensions as samples
+        """
+        single = samples.ndim == 1
+        samples = np.atleast_2d(samples)
+        if samples.shape[1] == 0:
+            return samples
+        n_taps = self._phases.shape[0]
+
+        # output m depends on the input samples up to (m * down) // up, with the phase (m * down) % up
+        first = self.n_samples
+        stop = -(-(self.n_input + samples.shape[1]) * self.up // self.down)
+        position = np.arange(first, stop) * self.down
+        last_input = position // self.up - self.n_input + n_taps - 1  # index into the history + samples
+        data = np.concatenate((self._history, samples), axis=1)
+        taps = data[:, last_input[:, None] - np.arange(n_taps)]  # (channels, outputs, taps)
+        resampled = np.einsum('cot,ot->co', taps, self._phases[:, position % self.up].T)
+
+        filtered, self._zi = sosfilt(self.sos, resampled, axis=-1, zi=self._zi)
+
+        self._history = data[:, data.shape[1] - (n_taps - 1):]
+        self.n_input += samples.shape[1]
+        self._append(filtered)
+        return filtered[0] if single else filtered
+
+    def get(self, start: int, stop: int) -> np.ndarray:
+        """the processed signal between two output samples, shape (n_channels, stop - start). Must not be modified"""
+        if start < self._buffer_start:
+            raise ValueError(f'sample {start} is not kept anymore, the buffer starts at {self._buffer_start}')
+        return self._buffer[:, start - self._buffer_start:min(stop, self.n_samples) - self._buffer_start]
+
+    @property
+    def n_epochs(self) -> int:
+        """number of complete 30 s epochs in the buffer"""
+        return self.n_samples // (30 * self.target_sf)
+
+    def epoch(self, index: int) -> np.ndarray:
+        """the processed 30 s epoch index, shape (n_channels, 30 * target_sf). Must not be modified"""
+        epoch_len = 30 * self.target_sf
+        return self.get(index * epoch_len, (index + 1) * epoch_len)
+
+    def _append(self, samples: np.ndarray):
+        used = self.n_samples - self._buffer_start
+        if self.keep is not None and used > 2 * self.keep:
+            # with a bounded buffer only the last keep samples are moved to the front
+            drop = used - self.keep
+            self._buffer[:, :self.keep] = self._buffer[:, drop:used]
+            self._buffer_start += drop
+            used = self.keep
+
+        n = used + samples.shape[1]
+        if n > self._buffer.shape[1]:
+            size = 2 * self.keep if self.keep is not None else 3600 * self.target_sf
+            grown = np.empty((self.n_channels, max(2 * self._buffer.shape[1], n, size)))
+            grown[:, :used] = self._buffer[:, :used]
+            self._buffer = grown
+        self._buffer[:, used:n] = samples
+        self.n_samples += samples.shape[1]
@@ -1,5 +1,27 @@
+import socket
 import struct
 
+# tcp flags
+FIN = 0x01
+SYN = 0x02
+RST = 0x04
+ACK = 0x10
+
+
+class IP_Packet:
+    def __init__(self, ip_packet):
+        iph = struct.unpack('!BBHHHBBH4s4s', ip_packet[:20])
+
+        self.version = iph[0] >> 4
+        self.iph_length = (iph[0] & 0xF) * 4
+        self.total_length = iph[2]
+        self.protocol = iph[6]
+        self.source_address = socket.inet_ntoa(iph[8])
+        self.dest_address = socket.inet_ntoa(iph[9])
+
+        # everything after total_length is link layer padding
+        self.data = ip_packet[:self.total_length]
+
 
 class TCP_Packet:
     def __init__(self, tcp_packet, iph_length):
@@ -13,6 +35,7 @@ class TCP_Packet:
         self.doff_reserved = tcph[4]
         self.tcph_length = self.doff_reserved >> 4
         self.tcp_header_length = self.tcph_length * 4
+        self.flags = tcph[5]
 
         data_offset = iph_length + self.tcp_header_length
         self.data = tcp_packet[data_offset:]
@@ -1,11 +1,18 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import mne.io
 import numpy as np
 import pandas as pd
 import yasa
 from scipy.signal import welch
-import warnings
 
-warnings.filterwarnings('ignore', message='Trying to unpickle estimator LabelEncoder from version 0.24.2 when *')
+from scripts.Utils.IncrementalBandpower import IncrementalBandpower
+from scripts.Utils.IncrementalRemDetection import (CONTEXT_SEC, REM_DETECT_PARAMS, SETTLE_SEC, IncrementalRemDetection,
+                                                   amplitude_ok, rem_detect)
+from scripts.Utils.IncrementalStaging import IncrementalSleepStaging
+from scripts.Utils.ModelRegistry import get_classifier
 
 class YasaClassifier:
 
@@ -24,36 +31,103 @@ class YasaClassifier:
         return raw
 
     @staticmethod
-    def get_sleep_hypno(raw: mne.io.Raw, channel: str, male: bool = True, age: int = 45):
+    def to_raw(data: np.ndarray, ch_names: list, sf: int = 256) -> mne.io.RawArray:
+        """
+        wraps data into a RawArray without copying it. The RawArray shares the memory of data, so data must not be
+        modified while the RawArray is used.
+
+        :param data: the signal in V, shape (n_channels, n_samples), e.g. a slice of a longer recording
+        :param ch_names: the names of the channels
+        :param sf: sample rate of data
+        """
+        info = mne.create_info(ch_names=ch_names, sfreq=sf, ch_types='eeg', verbose='error')
+        return mne.io.RawArray(np.asarray(data, dtype=np.float64), info, copy='auto', verbose='error')
+
+    @staticmethod
+    def channel_views(raw: mne.io.Raw, channels: list) -> list:
+        """returns the data of each channel in V, as views into raw if it is preloaded. They must not be modified"""
+        if not raw.preload:
+            return list(raw.get_data(picks=channels))
+        return [raw._data[raw.ch_names.index(channel)] for channel in channels]
+
+    @staticmethod
+    def get_preds_from_array(eeg: np.ndarray, sf: int = 256, male: bool = True, age: int = 45,
+                             path_to_model: str = 'auto'):
+        """
+        the sleep stage of each epoch of eeg, like get_sleep_hypno() but without a mne Raw. eeg is wrapped into a
+        RawArray without copying it, yasa only copies the channel it stages.
+
+        :param eeg: one eeg channel in V, may be a view into a longer recording
+        :param sf: sample rate of eeg
+        :param male: optional: metadata
+        :param age: optional: metadata
+        :param path_to_model: optional: the classifier, see ModelRegistry.get_classifier()
+        :return: the stage of each epoch, see stage_labels()
+        """
+        return YasaClassifier._predict_from_array(eeg, sf, male, age, path_to_model)[0]
+
+    @staticmethod
+    def get_preds_and_probs_from_array(eeg: np.ndarray, sf: int = 256, male: bool = True, age: int = 45,
+                                       path_to_model: str = 'auto'):
+        """
+        like get_preds_from_array(), but also returns the probability of each stage for each epoch
+
+        :return: the stage of each epoch and a DataFrame with one column per label of the classifier
+        """
+        return YasaClassifier._predict_from_array(eeg, sf, male, age, path_to_model)
+
+    @staticmethod
+    def stage_labels(preds) -> np.ndarray:
+        """
+        the predictions of yasa.SleepStaging.predict() as an array of the labels of the classifier ('W', 'N1', 'N2',
+        'N3', 'R'). yasa >= 0.7 returns a yasa.Hypnogram with long stage names instead of the array
+        """
+        if isinstance(preds, np.ndarray):
+            return preds
+        return preds.hypno.astype(str).replace({'WAKE': 'W', 'REM': 'R'}).to_numpy()
+
+    @staticmethod
+    def _predict_from_array(eeg: np.ndarray, sf: int, male: bool, age: int, path_to_model: str):
+        """
+        stages eeg with the features of yasa.SleepStaging and the classifier kept by ModelRegistry, which
+        SleepStaging.predict() would unpickle on every call
+
+        :return: the labels of the classifier for each epoch and a DataFrame with their probabilities
+        """
+        raw = YasaClassifier.to_raw(eeg[np.newaxis, :], ['eeg1'], sf)
+        sls = yasa.SleepStaging(raw, eeg_name='eeg1', metadata=dict(age=age, male=int(male)))
+        clf = get_classifier(path_to_model, name='clf_eeg+demo')
+        features = sls.get_features()[clf.feature_name_]
+        preds = clf.predict(features)
+        probs = pd.DataFrame(clf.predict_proba(features), index=features.index, columns=clf.classes_)
+        return preds, probs
+
+    @staticmethod
+    def get_sleep_hypno(raw: mne.io.Raw, channel: str, male: bool = True, age: int = 45, path_to_model: str = 'auto'):
         """
         :param raw: the signal loaded from get_raw_eeg_from_edf()
         :param channel: the name of the channel
         :param male: optional: metadata
         :param age: optional: metadata
-        :param scorer: optional: needed to perform EpochByEpochAgreement
-        :return: yasa.Hypnogram
+        :param path_to_model: optional: the classifier, see ModelRegistry.get_classifier()
+        :return: the stage of each epoch, see stage_labels()
         """
-        data = raw.copy()
-        data.pick(channel)
-        sls = yasa.SleepStaging(data, eeg_name=channel, metadata=dict(age=age, male=male))
-        pred = sls.predict()
-        return pred
+        eeg, = YasaClassifier.channel_views(raw, [channel])
+        return YasaClassifier.get_preds_from_array(eeg, raw.info['sfreq'], male, age, path_to_model)
 
     @staticmethod
-    def get_sleep_hypno_probs(raw: mne.io.Raw, channel: str, male: bool = True, age: int = 45) -> np.array:
+    def get_sleep_hypno_probs(raw: mne.io.Raw, channel: str, male: bool = True, age: int = 45,
+                              path_to_model: str = 'auto') -> pd.DataFrame:
         """
         :param raw: the signal loaded from get_raw_eeg_from_edf()
         :param channel: the name of the channel
         :param male: optional: metadata
         :param age: optional: metadata
-        :param scorer: optional: needed to perform EpochByEpochAgreement
-        :return: yasa.Hypnogram
+        :param path_to_model: optional: the classifier, see ModelRegistry.get_classifier()
+        :return: the probability of each stage for each epoch, one column per label of the classifier
         """
-        data = raw.copy()
-        data.pick(channel)
-        sls = yasa.SleepStaging(data, eeg_name=channel, metadata=dict(age=age, male=male))
-        pred = sls.predict_proba()
-        return pred
+        eeg, = YasaClassifier.channel_views(raw, [channel])
+        return YasaClassifier.get_preds_and_probs_from_array(eeg, raw.info['sfreq'], male, age, path_to_model)[1]
 
     @staticmethod
     def get_bandpower(mne_array, channels: list, hypno: np.array = None, window_size: int = 4, sf: int = 256):
@@ -63,7 +137,8 @@ class YasaClassifier:
     @staticmethod
     def get_bandpower_per_epoch(mne_array, window_size: int = 5, sf: int = 256, epoch_len: int = 30):
         # get epochs
-        _, epochs = yasa.sliding_window(mne_array.copy().get_epoch_data(units='V'), sf, window=epoch_len)
+        data = mne_array._data if mne_array.preload else mne_array.get_data()  # not copied if preloaded
+        _, epochs = yasa.sliding_window(data, sf, window=epoch_len)
 
         # calculate psd
         win = int(window_size * sf)
@@ -76,29 +151,25 @@ class YasaClassifier:
         return bandpower, bandpower_last_epoch
 
     @staticmethod
-    def get_preds_per_epoch(mne_array, channel_name: str = 'eegl'):
-        data = mne_array.copy()
-        preds = YasaClassifier.get_sleep_hypno(data, channel_name)
-        return preds
+    def get_preds_per_epoch(mne_array, channel_name: str = 'eegl', path_to_model: str = 'auto'):
+        hypno = YasaClassifier.get_sleep_hypno(mne_array, channel_name, path_to_model=path_to_model)
+        return YasaClassifier.stage_labels(hypno)
 
     @staticmethod
     def get_preds_per_sample(mne_array, predictions, channels: list, epoch_len_sec: int = 30, sf: int = 256):
-        data = mne_array.copy().pick(channels)
+        data = YasaClassifier.channel_views(mne_array, channels)[0]
         preds_per_sample = yasa.hypno_str_to_int(predictions)
         preds_per_sample = yasa.hypno_upsample_to_data(hypno=preds_per_sample, sf_hypno=(1 / epoch_len_sec),
-                                                       data=data.get_epoch_data(), sf_data=sf)
+                                                       data=data, sf_data=sf)
         return preds_per_sample
 
     @staticmethod
     def get_eyes(mne_array, channels: list, predictions=None, sf: int = 256):
-        data = mne_array.copy().pick(channels)
         hypno = None
         if predictions is not None and 'R' in predictions:
-            hypno = YasaClassifier.get_preds_per_sample(predictions, data, channels)
-        loc, roc = data.get_epoch_data(units='uV')
-        rem = yasa.rem_detect(loc, roc, sf, hypno=hypno, include=4, amplitude=(50, 325),
-                              duration=(0.3, 1.2),
-                              relative_prominence=0.8, freq_rem=(0.5, 5), remove_outliers=False, verbose='error')
+            hypno = YasaClassifier.get_preds_per_sample(mne_array, predictions, channels)
+        loc, roc = (channel * 1e6 for channel in YasaClassifier.channel_views(mne_array, channels))  # to uV
+        rem = yasa.rem_detect(loc, roc, sf, hypno=hypno, include=4, verbose='error', **REM_DETECT_PARAMS)
 
         return rem
 
@@ -108,115 +179,160 @@ class YasaClassifier:
         return agr
 
 
-def simulate_scoring_in_live(raw: mne.io.Raw, channel_l: str, channel_r: str, male: bool = True, age: int = 45):
+def simulate_scoring_in_live(raw: mne.io.Raw, channel_l: str, channel_r: str, male: bool = True, age: int = 45,
+                             processes: int = None):
     """
+    replays the recording as if it was scored live from second 0 and writes what the live scoring would have said for
+    every epoch after the first 2 hours to scoring_results.csv:
+
+    - pred: the hypnogram of the recording up to the epoch predicts R for the epoch
+    - eyes: get_eyes() on the recording up to the epoch finds a rem that starts in the epoch
+    - theta/delta: the theta/delta ratio of the epoch (mean of both channels) is above 0.22
+    - combines: all three
+
+    The night is replayed in a single pass. The hypnograms come from IncrementalSleepStaging, the theta/delta ratios
+    from IncrementalBandpower and the rems from IncrementalRemDetection, which only looks at the end of the recording,
+    so the epochs are spread over processes.
 
     :param channel_r: the name of the right channel of the zMax Headband
     :param channel_l: the name of the left channel of the zMax Headband
     :param raw: a signal that contains the at least the l and r eeg channels specified in channels
     :param male: optional: metadata
     :param age: optional: metadata
+    :param processes: optional: number of processes for the rem detection, defaults to the number of cpus
     :return: None
     """
-
-    score_by_eyes = True
-    score_by_hypno = True
-    score_py_psd = True
-
-    rem_epochs = []
-    psd_theta_epochs = []
-    pred_rem_epochs = []
-    combined_epochs = []
-
-    global eeg_bands
-    signal = raw.copy()
-    signal.pick([channel_l, channel_r])
-    ch_l, ch_r = signal.get_epoch_data()
+    data = raw.get_data(picks=[channel_l, channel_r])
 
     # simulate a signal that is received from second 0
     sf = 256
-    epoch_len_in_sec = 30
-    time_offset_in_sec = 30
-    # do nothing the first 2 hours
-    idx = sf * 60 * 120
-
-    while idx + sf * epoch_len_in_sec < len(ch_l):
-        # the signal arrives
-        loc = ch_l[0:idx + (sf * epoch_len_in_sec)]
-        roc = ch_r[0:idx + (sf * epoch_len_in_sec)]
-
-        info = mne.create_info(ch_names=['eegl', 'eegr'], sfreq=256, ch_types='eeg')
-        mne_array = mne.io.RawArray([roc.copy(), loc.copy()], info, verbose='error')
-
-        # -----------------------
-        # calculate power spectral density per 30 sec epoch
-        # -----------------------
-        if score_py_psd:
-            bandpower, bandpower_last_epoch = YasaClassifier.get_bandpower_per_epoch(mne_array)
-
-            delta_mean = (bandpower_last_epoch[0, 0] + bandpower_last_epoch[0, 1]) / 2
-            theta_mean = (bandpower_last_epoch[1, 0] + bandpower_last_epoch[1, 1]) / 2
-            # alpha_mean = (bandpower_last_epoch[2, 0] + bandpower_last_epoch[2, 1]) / 2
-            # sigma_mean = (bandpower_last_epoch[3, 0] + bandpower_last_epoch[3, 1]) / 2
-            # beta_mean = (bandpower_last_epoch[4, 0] + bandpower_last_epoch[4, 1]) / 2
-            # gamma_mean = (bandpower_last_epoch[5, 0] + bandpower_last_epoch[5, 1]) / 2
-            theta_delta_ratio = theta_mean / delta_mean
-
-            if theta_delta_ratio > 0.22:
-                psd_theta_epochs.append(1)
-            else:
-                psd_theta_epochs.append(0)
-        # -----------------------
-        # calculate hypnogram
-        # -----------------------
-        if score_by_hypno:
-            preds = YasaClassifier.get_preds_per_epoch(mne_array=mne_array)
-            if preds[-1] == 'R':
-                pred_rem_epochs.append(1)
-            else:
-                pred_rem_epochs.append(0)
-        # -----------------------
-        # calculate rem phases
-        # -----------------------
-        if score_by_eyes:
-            rem = YasaClassifier.get_eyes(mne_array, preds)
-            if rem:
-                rem_pd = rem.summary()
-                rem_last_30_sec = rem_pd.loc[rem_pd['Start'] > (idx / 256)]
-            else:
-                rem_last_30_sec = pd.DataFrame()
-
-            if not rem_last_30_sec.empty:
-                rem_epochs.append(1)
-            else:
-                rem_epochs.append(0)
-
-        # if all say rem
-        if score_by_hypno and score_by_eyes and score_py_psd:
-            if (theta_delta_ratio > 0.22) and preds[-1] == 'R' and not rem_last_30_sec.empty:
-                combined_epochs.append(1)
-            else:
-                combined_epochs.append(0)
-
-        # -----------------------
-        # uptick the idx
-        # -----------------------
-        idx += sf * time_offset_in_sec
-
-    if score_by_hypno and score_by_eyes and score_py_psd:
-        print(f'combined_epochs: {combined_epochs}')
-    if score_by_eyes:
-        print(f'rem_epochs: {rem_epochs}')
-    if score_py_psd:
-        print(f'psd_theta_epochs: {psd_theta_epochs}')
-    if score_by_hypno:
-        print(f'pred_rem_epochs: {pred_rem_epochs}')
+    epoch_len = sf * 30
+    # do nothing the first 2 hours, the last epoch is not scored
+    first = 2 * 120
+    last = (data.shape[1] - 1) // epoch_len - 1
+    scored = np.arange(first, last + 1)
+
+    # -----------------------
+    # rems that start in each epoch, the epochs do not depend on each other
+    # -----------------------
+    processes = min(processes or os.cpu_count(), max(len(scored), 1))
+    executor = None
+    if processes > 1:
+        executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_replay_worker, initargs=(data,))
+        futures = [executor.submit(_rem_starts_in_epochs, chunk, epoch_len, sf)
+                   for chunk in np.array_split(scored, 4 * processes)]
+        rem_starts = (starts for future in futures for starts in future.result())
+    else:
+        _init_replay_worker(data)
+        rem_starts = iter(_rem_starts_in_epochs(scored, epoch_len, sf))
+
+    # -----------------------
+    # theta/delta ratio, hypnogram of the recording up to every epoch and rem phases, in one pass
+    # -----------------------
+    bandpower = IncrementalBandpower(2, sf)
+    staging = IncrementalSleepStaging(sf, male, age)
+    psd_theta_epochs = []
+    pred_rem_epochs = []
+    rem_epochs = []
+    for epoch in range(last + 1):
+        bandpower.add_epoch(data[:, epoch * epoch_len:(epoch + 1) * epoch_len])
+        staging.add_epoch(data[0, epoch * epoch_len:(epoch + 1) * epoch_len])
+        if epoch < first:
+            continue
+        psd_theta_epochs.append(int(bandpower.ratio('Theta', 'Delta') > 0.22))
+        pred_rem = staging.predict_last() == 'R'
+        eyes = next(rem_starts)
+        if eyes and not pred_rem:
+            # with an R anywhere in the hypnogram get_eyes() only keeps the rems during R
+            eyes = 'R' not in staging.predict_all()
+        pred_rem_epochs.append(int(pred_rem))
+        rem_epochs.append(int(eyes))
+    if executor is not None:
+        executor.shutdown()
+
+    combined_epochs = [int(theta and pred and eyes)
+                       for theta, pred, eyes in zip(psd_theta_epochs, pred_rem_epochs, rem_epochs)]
+
+    print(f'combined_epochs: {combined_epochs}')
+    print(f'rem_epochs: {rem_epochs}')
+    print(f'psd_theta_epochs: {psd_theta_epochs}')
+    print(f'pred_rem_epochs: {pred_rem_epochs}')
 
     scoring_df = pd.DataFrame(list(zip(combined_epochs, rem_epochs, psd_theta_epochs, pred_rem_epochs)), columns=['combines', 'eyes', 'theta/delta', 'pred'])
     print(scoring_df.head())
     scoring_df.to_csv('scoring_results.csv')
 
 
+# the eeg of the replayed recording in V, set in every process by _init_replay_worker()
+_replay_data = None
+
+
+def _init_replay_worker(data):
+    global _replay_data
+    _replay_data = data
+
+
+def _rem_starts_in_epochs(epochs: np.ndarray, epoch_len: int, sf: int) -> np.ndarray:
+    # for each epoch (ascending): does rem_detect on the recording up to the epoch (without a hypnogram) find a rem
+    # that starts in it, like get_eyes() in simulate_scoring_in_live did
+    starts = np.zeros(len(epochs), dtype=bool)
+    if len(epochs) == 0:
+        return starts
+    first = epochs[0] * epoch_len
+    amplitude = _GrowingTrimmedStd(_replay_data[:, :first] * 1e6)
+    context = max(first - (CONTEXT_SEC + SETTLE_SEC) * sf, 0)
+    detector = IncrementalRemDetection(sf, start=context)
+    if first > context:
+        detector.add(*_replay_data[:, context:first])
+    for i, epoch in enumerate(epochs):
+        begin, end = epoch * epoch_len, (epoch + 1) * epoch_len
+        rems = detector.add(*_replay_data[:, begin:end])
+        amplitude.add(_replay_data[:, begin:end] * 1e6)
+        # rem_detect gives up if the amplitude of the whole recording looks wrong
+        if not amplitude_ok(amplitude.std()):
+            continue
+        if detector.rejected:
+            # rem_detect would give up on the window but not on the recording
+            rem = rem_detect(_replay_data[:, :end] * 1e6, sf)
+            rems = rem.summary() if rem else rems
+        starts[i] = np.any(rems['Start'].to_numpy() * sf > begin)
+    return starts
+
+
+class _GrowingTrimmedStd:
+    """
+    trimbothstd(data, cut=0.05) of a growing recording. The samples are kept sorted, so only the 5 % at both ends have
+    to be summed up again when samples are added
+    """
+    cut = 0.05
+
+    def __init__(self, data: np.ndarray):
+        self.sorted = [np.sort(channel) for channel in data]
+        self.sum = data.sum(axis=1)
+        self.sum_sq = (data ** 2).sum(axis=1)
+        self.n_samples = data.shape[1]
+
+    def add(self, data: np.ndarray):
+        for i, channel in enumerate(data):
+            channel = np.sort(channel)
+            self.sorted[i] = np.insert(self.sorted[i], np.searchsorted(self.sorted[i], channel), channel)
+        self.sum += data.sum(axis=1)
+        self.sum_sq += (data ** 2).sum(axis=1)
+        self.n_samples += data.shape[1]
+
+    def std(self) -> np.ndarray:
+        lowercut = int(self.cut * self.n_samples)
+        uppercut = self.n_samples - lowercut
+        n = uppercut - lowercut
+        std = np.empty(len(self.sorted))
+        for i, channel in enumerate(self.sorted):
+            cut_off = np.concatenate((channel[:lowercut], channel[uppercut:]))
+            total = self.sum[i] - cut_off.sum()
+            total_sq = self.sum_sq[i] - (cut_off ** 2).sum()
+            std[i] = np.sqrt(max(total_sq - total ** 2 / n, 0) / (n - 1))
+        return std
+
 
 if __name__ == '__main__':
     my_raw_path = 'C:/coding/git/dreamento/dreamento-online/source_code/Drec/recordings/recording-date-2024-11-27-time-21-39-45/recording-date-2024-11-27-time-21-39-45/complete_recording.edf'
@@ -254,7 +370,3 @@ if __name__ == '__main__':
 
     agr_own = YasaClassifier.get_epoch_by_epoch_agreement([yasa.Hypnogram(hypno_zmax, scorer='1')],
                                                           [yasa.Hypnogram(hypno_own, scorer='2')])
-
-# TODO:
-# check if rem_detect performs exactly the same even if the signal is fed in pieces
-# if yes just do rem detection of the last 15 seconds
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from scripts.Utils.IncrementalRemDetection import COLUMNS, IncrementalRemDetection, rem_detect
+
+SAMPLE_RATE = 256
+EPOCH_LEN = 30 * SAMPLE_RATE
+MINUTES = 4
+
+
+@pytest.fixture(scope='module')
+def eog():
+    """a few minutes of noise in V with opposite deflections on both channels, half of them across epoch borders"""
+    rng = np.random.default_rng(0)
+    n_samples = MINUTES * 60 * SAMPLE_RATE
+    eog = rng.normal(0, 10e-6, (2, n_samples))
+    starts = [border - SAMPLE_RATE // 4 for border in range(EPOCH_LEN, n_samples, EPOCH_LEN)]
+    starts += list(rng.integers(0, n_samples - SAMPLE_RATE, size=len(starts)))
+    for start in starts:
+        duration = int(rng.uniform(0.4, 0.8) * SAMPLE_RATE)
+        movement = rng.uniform(100, 200) * 1e-6 * np.sin(np.pi * np.arange(duration) / duration)
+        eog[0, start:start + duration] += movement
+        eog[1, start:start + duration] -= movement
+    return eog
+
+
+@pytest.fixture(scope='module')
+def whole(eog):
+    return rem_detect(eog * 1e6, SAMPLE_RATE).summary()[COLUMNS]
+
+
+def test_rems_cross_epoch_borders(whole):
+    starts = np.floor(whole['Start'] * SAMPLE_RATE / EPOCH_LEN)
+    ends = np.floor(whole['End'] * SAMPLE_RATE / EPOCH_LEN)
+    assert (starts != ends).sum() >= MINUTES
+
+
+@pytest.mark.parametrize('piece_len', [EPOCH_LEN, 7 * SAMPLE_RATE + 13], ids=['epochs', 'uneven pieces'])
+def test_events_equal_rem_detect_on_whole_signal(eog, whole, piece_len):
+    detector = IncrementalRemDetection(SAMPLE_RATE)
+    for start in range(0, eog.shape[1], piece_len):
+        detector.add(*eog[:, start:start + piece_len])
+
+    events = detector.events
+    assert len(events) == len(whole)
+    np.testing.assert_allclose(events[COLUMNS[:3]].to_numpy(float), whole[COLUMNS[:3]].to_numpy(float), rtol=0,
+                               atol=1e-9)
+    np.testing.assert_allclose(events[COLUMNS].to_numpy(float), whole[COLUMNS].to_numpy(float), rtol=1e-6)
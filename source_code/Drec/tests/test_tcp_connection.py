@@ -0,0 +1,45 @@
+from queue import Queue
+
+from scripts.Connection.TcpConnection import SEQ_MOD, Connection
+
+
+def delivered(queue: Queue) -> bytes:
+    return b''.join(queue.get_nowait() for _ in range(queue.qsize()))
+
+
+def test_second_gap_waits_for_its_own_timeout():
+    conn = Connection('server', 8000, 'client', 50000, first_seq=-1, gap_timeout=1.0)
+    queue = Queue()
+    conn.parse_payload(0, b'aaaa\n', queue, now=0)
+    conn.parse_payload(10, b'cccc\n', queue, now=0.1)  # 5 - 9 missing
+    conn.parse_payload(20, b'eeee\n', queue, now=0.2)  # 15 - 19 missing
+    conn.parse_payload(5, b'bbbb\n', queue, now=5.0)  # fills the first gap
+    conn.parse_payload(25, b'ffff\n', queue, now=5.001)
+    assert conn.gaps == 0
+    assert delivered(queue) == b'aaaa\nbbbb\ncccc\n'
+
+    conn.parse_payload(15, b'dddd\n', queue, now=5.5)
+    assert conn.gaps == 0
+    assert delivered(queue) == b'dddd\neeee\nffff\n'
+    assert not conn.packet_buffer
+
+
+def test_gap_is_skipped_after_timeout():
+    conn = Connection('server', 8000, 'client', 50000, first_seq=-1, gap_timeout=1.0)
+    queue = Queue()
+    conn.parse_payload(0, b'aaaa\n', queue, now=0)
+    conn.parse_payload(10, b'cccc\n', queue, now=0.1)
+    conn.parse_payload(15, b'dddd\n', queue, now=1.2)
+    assert conn.gaps == 1 and conn.gap_bytes == 5
+    assert delivered(queue) == b'aaaa\ncccc\ndddd\n'
+
+
+def test_reordered_segments_across_seq_wraparound():
+    first = SEQ_MOD - 7
+    conn = Connection('server', 8000, 'client', 50000, first_seq=first - 1)
+    queue = Queue()
+    segments = [(first + 5 * i) % SEQ_MOD for i in range(5)]
+    for i in (4, 2, 3, 1, 0):
+        conn.parse_payload(segments[i], bytes([ord('a') + i]) * 4 + b'\n', queue, now=0)
+    assert conn.gaps == 0
+    assert delivered(queue) == b'aaaa\nbbbb\ncccc\ndddd\neeee\n'